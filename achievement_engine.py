@@ -0,0 +1,195 @@
+"""单次遍历的成就计算引擎。
+
+引擎把记录按交易时间顺序取出各列，分成若干批（RecordBlock）交给 Tracker.feed_block，各 Tracker 在整批的
+列上计算特征；再按天切分，把每天的汇总（DayEntry）依次交给 Tracker.end_day。结果已经确定的 Tracker
+会立即移出，全部移出后提前结束。最后返回全部记录的汇总（StreamSummary）。
+
+传入上次返回的汇总（resume）可以从上次结束的地方续算，只处理比上次最后一条更晚的记录；
+keep_open 为真时最后一天不交给 end_day，而是放在汇总的 open_day 中，续算时当天的记录接着累加，
+这样上次的最后一天之后还有同一天的新记录也不会出错。汇总中还保存已处理记录的摘要，续算前先核对
+上次处理过的记录没有变化。
+
+成就本身以声明式规则的形式写在 achievement_rules.py 中，编译成 Tracker 后由这里推进，
+因此无论定义了多少成就，记录的各列都只取一次。achievements.py 中的 CHECKERS 保留为参考实现。
+"""
+
+from __future__ import annotations
+
+import hashlib
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Sequence
+
+from achievements import DayEntry, _is_identity, _take_columns, build_day_index
+from record_store import SpendRecords
+
+
+@dataclass
+class StreamSummary:
+    """全部记录的汇总。open_day 为 keep_open 时尚未交给 end_day 的最后一天，digest 为这些记录的 records_digest。"""
+
+    count: int
+    days: int
+    total_cents: int
+    first_ts: int | None = None
+    first_date: str | None = None
+    last_ts: int | None = None
+    last_date: str | None = None
+    open_day: DayEntry | None = None
+    digest: str | None = None
+
+
+def records_digest(records: SpendRecords, order: Sequence[int]) -> str:
+    """按 order 顺序的各记录（时间、金额、商户）的摘要，用来核对续算时上次处理过的记录没有变化。"""
+
+    h = hashlib.sha256()
+    h.update(len(order).to_bytes(8, "little"))
+    h.update(array("q", map(records.timestamps.__getitem__, order)).tobytes())
+    h.update(array("q", map(records.cents.__getitem__, order)).tobytes())
+    names = map(records.merchants.__getitem__, map(records.merchant_ids.__getitem__, order))
+    h.update("\0".join(names).encode("utf-8"))
+    return h.hexdigest()
+
+
+# 第一批记录的条数，之后每批加倍
+FIRST_BLOCK = 256
+
+
+@dataclass
+class RecordBlock:
+    """一批按时间排序的记录的各列。start 为第一条在完整序列中的位置，续算时为上次处理过的记录数。"""
+
+    start: int
+    timestamps: Sequence[int]
+    cents: Sequence[int]
+    hours: Sequence[int]
+    dates: Sequence[str]
+    merchant_ids: Sequence[int]
+    merchants: Sequence[str]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class Tracker:
+    """引擎推进的状态机的基类。
+
+    wants_records 为真时，新记录按时间顺序分成若干个 RecordBlock，在所有 end_day 之前依次交给 feed_block；
+    wants_days 为真时，每天结束调用一次 end_day。两者返回 True 表示已经不需要后续数据，
+    引擎随即将 done 置为真，之后不会再调用它们。
+    """
+
+    wants_records = False
+    wants_days = False
+    done = False
+
+    def feed_block(self, block: RecordBlock) -> bool | None:
+        return None
+
+    def end_day(self, day: DayEntry) -> bool | None:
+        return None
+
+
+def stream_records(
+    records: SpendRecords,
+    trackers: Sequence[Tracker],
+    order: Sequence[int] | None = None,
+    resume: StreamSummary | None = None,
+    keep_open: bool = False,
+) -> StreamSummary:
+    """按时间顺序遍历一次记录，推进所有 Tracker，返回全部记录的汇总。
+
+    order 为按时间排序的记录下标（如 ReportAggregate.order），不传时自行排序。
+    resume 为上次 keep_open=True 时返回的汇总，此时 records 必须包含上次的全部记录，
+    且不晚于上次最后一笔的记录恰好就是上次处理过的那些（按 digest 核对时间、金额和商户），
+    否则抛出 ValueError；Tracker 需要是上次遍历结束时的状态。keep_open 时返回的汇总带有 digest。
+    """
+
+    if order is None:
+        order = records.sorted_indices()
+    timestamps = records.timestamps
+
+    start = 0
+    if resume is not None and resume.count:
+        if resume.open_day is None:
+            raise ValueError("resumed stream has no open day")
+        # 上次处理过的记录在排序后位于最前面，新记录从第一条晚于上次最后一笔的位置开始
+        start = bisect_right(order, resume.last_ts, key=timestamps.__getitem__)
+        if start != resume.count or records_digest(records, order[:start]) != resume.digest:
+            raise ValueError("records do not extend the resumed stream")
+
+    # 新记录的各列按时间顺序只取一次，交给所有 Tracker 共用
+    fields = records.time_fields()
+    columns = (timestamps, records.cents, fields.hours, fields.dates, records.merchant_ids)
+    if start or not _is_identity(order):
+        columns = _take_columns(columns, order[start:])
+    new_ts, new_cents, new_hours, new_dates, new_mids = columns
+
+    # 按逐段加倍的长度分批交给 Tracker，早早有了结果的 Tracker 不必算完后面的记录
+    record_trackers = [t for t in trackers if t.wants_records and not t.done]
+    lo, size = 0, FIRST_BLOCK
+    while record_trackers and lo < len(new_ts):
+        hi = lo + size
+        block = RecordBlock(
+            start + lo, new_ts[lo:hi], new_cents[lo:hi], new_hours[lo:hi], new_dates[lo:hi], new_mids[lo:hi],
+            records.merchants,
+        )
+        retired = False
+        for t in record_trackers:
+            if t.feed_block(block):
+                t.done = True
+                retired = True
+        if retired:
+            record_trackers = [t for t in record_trackers if not t.done]
+        lo, size = hi, size * 2
+
+    # 每天的汇总与参考实现一样按当天的切片整体计算
+    days = build_day_index(new_ts, new_dates, new_hours, new_cents, new_mids, records.merchants, offset=start)
+    new_days = len(days)
+    if start:
+        # 上次留下的最后一天：新记录里还有同一天的就合并成一天，否则它已经完整，排在最前面交给 end_day
+        carried = resume.open_day
+        if days and days[0].day == carried.day:
+            first = days[0]
+            new_days -= 1
+            days[0] = DayEntry(
+                carried.day, carried.date, carried.start, first.end, carried.first_ts, first.last_ts,
+                carried.cents + first.cents, carried.meals | first.meals,
+                set(carried.merchants) | first.merchants, carried.merchant_visits + first.merchant_visits,
+            )
+        else:
+            days.insert(0, carried)
+
+    day_trackers = [t for t in trackers if t.wants_days and not t.done]
+    # keep_open 时最后一天留给下次续算，不交给 end_day
+    for entry in days[:-1] if keep_open else days:
+        if not day_trackers:
+            break
+        if _end_day(day_trackers, entry):
+            day_trackers = [t for t in day_trackers if not t.done]
+
+    summary = StreamSummary(
+        count=len(order),
+        days=(resume.days if start else 0) + new_days,
+        total_cents=(resume.total_cents if start else 0) + sum(new_cents),
+    )
+    if keep_open:
+        summary.open_day = days[-1] if days else None
+        summary.digest = records_digest(records, order)
+    if order:
+        summary.first_ts = timestamps[order[0]]
+        summary.first_date = fields.dates[order[0]]
+        summary.last_ts = timestamps[order[-1]]
+        summary.last_date = fields.dates[order[-1]]
+
+    return summary
+
+
+def _end_day(day_trackers: list[Tracker], day: DayEntry) -> bool:
+    retired = False
+    for t in day_trackers:
+        if t.end_day(day):
+            t.done = True
+            retired = True
+    return retired
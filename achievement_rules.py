@@ -0,0 +1,910 @@
+"""声明式的成就规则及其编译器。
+
+每个成就是一条规则数据，而不是一段遍历记录的代码：
+
+- RecordRule：第 n 条满足条件的记录解锁（早八人、加个鸡腿、西西弗斯……）；
+- DayRule：第 n 个满足条件的日期解锁（凑单领域大神、百日烟火……）；
+- StreakRule：连续若干个自然日都满足条件（完美一周）；
+- DistinctDaysRule：连续若干个自然日都有消费且商家两两不同（宇宙饭）；
+- SummaryRule：对全部记录的汇总做判断（迷途之子、注意到……）。
+
+条件写成 Cond(特征, 运算, 值)。compile_rules 把一组规则编译成一个 RulePlan：各条规则用到的特征
+（小时、餐次、金额、商家累计次数、当天已有的餐次、与上一笔的间隔、每天的金额与商家……）在每条记录或
+每天上只计算一次，所有规则共用。整个计划由 achievement_engine 推进：记录按时间顺序分批排成整列，
+条件由 map 等在整列上逐项判断，直接定位第 n 条满足条件的记录，规则解锁后就不再往下看；
+每天的汇总逐日交给连续天数、滑动窗口等按天的规则。新增成就只需在 ACHIEVEMENT_RULES 中加一条规则，
+不必再写一遍遍历记录的代码，用到的特征列也不会重新计算。
+
+RulePlan.evaluate_incremental 还会返回遍历结束时的状态（各规则的计数、连续天数、滑动窗口、商户累计次数、
+尚未结束的最后一天和汇总），可以直接序列化为 JSON；下次传回这份状态，只需处理比上次最后一笔更晚的记录。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import operator
+from dataclasses import dataclass, field
+from itertools import compress, islice, repeat
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Iterator, Sequence
+
+from achievement_engine import RecordBlock, StreamSummary, Tracker, stream_records
+from achievements import (
+    ALL_MEALS,
+    MEAL_BITS,
+    AchievementResult,
+    DayEntry,
+    SlidingDayWindow,
+    StreakCounter,
+)
+from record_store import SpendRecords
+from txtime import format_minute
+
+
+@dataclass(frozen=True)
+class Cond:
+    """对一个特征的判断：feature op value。
+
+    ref 不为空时与另一个特征的值比较，忽略 value。任何一边的特征值为 None 时判断为假。
+    op 可以是 <、<=、>、>=、==、!=、in（value 为候选值的集合）和 multiple_of（整除）。
+    """
+
+    feature: str
+    op: str
+    value: Any = None
+    ref: str | None = None
+
+
+@dataclass(frozen=True)
+class Rule:
+    """各类规则的公共字段。
+
+    extra 把输出的键映射到特征名，可以取规则自身的特征（见各子类），也可以取汇总特征；
+    默认只有解锁时才输出 extra，extra_when_locked 为真时未解锁也输出。
+    requires 是针对汇总特征的前提条件，不满足时直接判为未解锁且不输出 extra。
+    """
+
+    id: str
+    where: tuple[Cond, ...] = ()
+    extra: dict[str, str] = field(default_factory=dict)
+    extra_when_locked: bool = False
+    requires: tuple[Cond, ...] = ()
+
+
+@dataclass(frozen=True)
+class RecordRule(Rule):
+    """按时间顺序第 n 条满足 where 的记录解锁，解锁时间为这条记录。
+
+    where 与 extra 可用 RECORD_FEATURES 中的特征，extra 另外可用 amount（元）与 count（已满足的条数）。
+    """
+
+    n: int = 1
+
+
+@dataclass(frozen=True)
+class DayRule(Rule):
+    """按时间顺序第 n 个满足 where 的日期解锁，at 为 "first" 或 "last"，即取当天第一笔还是最后一笔的时间。
+
+    where 与 extra 可用 DayEntry 的属性（date、cents、amount、meals、merchant_visits 等），
+    extra 另外可用 count（已满足的天数）。
+    """
+
+    n: int = 1
+    at: str = "last"
+
+
+@dataclass(frozen=True)
+class StreakRule(Rule):
+    """连续 length 个自然日都满足 where 时解锁，解锁时间为第 length 天的最后一笔。
+
+    where 可用 DayEntry 的属性，extra 可用 start_date 与 end_date。
+    """
+
+    length: int = 7
+
+
+@dataclass(frozen=True)
+class DistinctDaysRule(Rule):
+    """连续 length 个自然日都有非空商户的消费，且这些天里没有商户出现两次。
+
+    解锁时间为最后一天的最后一笔，extra 可用 start_date 与 end_date。
+    """
+
+    length: int = 5
+
+
+@dataclass(frozen=True)
+class SummaryRule(Rule):
+    """对全部记录的汇总特征（SUMMARY_FEATURES）做判断，at 为 "first" 或 "last"，即取第一笔还是最后一笔的时间。
+
+    counts 声明额外的计数特征：名字 -> 记录需要满足的条件，统计满足条件的记录条数。
+    """
+
+    at: str = "last"
+    counts: dict[str, tuple[Cond, ...]] = field(default_factory=dict)
+
+
+# 每条记录上的特征，按此顺序组成元组交给各条件；后三个是需要跨记录维护的累计特征，只在有规则用到时才计算
+RECORD_FEATURES = (
+    "ts",
+    "date",
+    "hour",
+    "cents",
+    "merchant",
+    # MEAL_BITS 中的餐次位
+    "meal",
+    # 在当前小时内的第几秒
+    "second_of_hour",
+    # 截至这一笔，同一商户的消费次数
+    "merchant_count",
+    # 截至这一笔，当天已有的餐次位
+    "day_meals",
+    # 与上一笔的间隔秒数（float），第一笔为 None
+    "gap",
+)
+_RECORD_INDEX = {name: i for i, name in enumerate(RECORD_FEATURES)}
+
+DAY_FEATURES = ("day", "date", "first_ts", "last_ts", "cents", "amount", "meals", "merchant_visits")
+
+SUMMARY_FEATURES = (
+    "records",
+    "days",
+    "total_cents",
+    "total_amount",
+    "first_ts",
+    "first_date",
+    "last_ts",
+    "last_date",
+    # 第一笔、最后一笔的 MM-DD
+    "first_month_day",
+    "last_month_day",
+    "student_id_suffix",
+    # 学号后四位换算成的分（后四位 * 100），没有学号时为 None
+    "unit_cents",
+    "used_default_password",
+)
+
+_OPS: dict[str, Callable[[Any, Any], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "in": lambda a, b: a in b,
+    "multiple_of": lambda a, b: b != 0 and a % b == 0,
+}
+
+
+# 可以直接对整列逐项调用的比较运算
+_COMPARE_OPS = frozenset(("<", "<=", ">", ">=", "==", "!="))
+
+# 列中可能出现 None 的特征
+_NULLABLE_FEATURES = frozenset(("gap",))
+
+
+def _compile_cond(cond: Cond, getters: dict[str, Callable[[Any], Any]]) -> Callable[[Any], bool]:
+    if cond.op not in _OPS:
+        raise ValueError(f"unknown operator {cond.op!r}")
+    if cond.feature not in getters:
+        raise ValueError(f"unknown feature {cond.feature!r}")
+    op = _OPS[cond.op]
+    get = getters[cond.feature]
+
+    if cond.ref is not None:
+        if cond.ref not in getters:
+            raise ValueError(f"unknown feature {cond.ref!r}")
+        get_ref = getters[cond.ref]
+
+        def test_ref(obj: Any) -> bool:
+            a = get(obj)
+            b = get_ref(obj)
+            return a is not None and b is not None and op(a, b)
+
+        return test_ref
+
+    value = frozenset(cond.value) if cond.op == "in" else cond.value
+    if cond.op == "in":
+        return lambda obj: get(obj) in value
+
+    def test(obj: Any) -> bool:
+        a = get(obj)
+        return a is not None and op(a, value)
+
+    return test
+
+
+def _check_conds(conds: Sequence[Cond], features: Sequence[str]) -> None:
+    """编译时检查条件的特征名与运算符。"""
+
+    for cond in conds:
+        if cond.op not in _OPS:
+            raise ValueError(f"unknown operator {cond.op!r}")
+        for name in (cond.feature, cond.ref):
+            if name is not None and name not in features:
+                raise ValueError(f"unknown feature {name!r}")
+
+
+def _compile_where(conds: Sequence[Cond], getters: dict[str, Callable[[Any], Any]]) -> Callable[[Any], bool]:
+    """把一组条件编译成一个判断函数。"""
+
+    tests = [_compile_cond(c, getters) for c in conds]
+    if not tests:
+        return lambda obj: True
+    if len(tests) == 1:
+        return tests[0]
+    if len(tests) == 2:
+        first, second = tests
+        return lambda obj: first(obj) and second(obj)
+    return lambda obj: all(t(obj) for t in tests)
+
+
+_DAY_GETTERS: dict[str, Callable[[Any], Any]] = {name: attrgetter(name) for name in DAY_FEATURES}
+
+
+# 各类规则的 extra 中可以使用的自身特征
+_RECORD_LOCAL = frozenset((*RECORD_FEATURES, "amount", "count"))
+_DAY_LOCAL = frozenset((*DAY_FEATURES, "count", "start_date", "end_date"))
+
+
+# 需要跨记录维护的累计特征
+_RUNNING_FEATURES = frozenset(("merchant_count", "day_meals", "gap"))
+
+
+def _running_features(conds: Sequence[Cond], extra_names: Sequence[str] = ()) -> frozenset[str]:
+    """条件与 extra 中用到的累计特征。"""
+    names = {c.feature for c in conds} | {c.ref for c in conds if c.ref is not None} | set(extra_names)
+    return frozenset(names & _RUNNING_FEATURES)
+
+
+def _summary_getters(counts: Sequence[str]) -> dict[str, Callable[[Any], Any]]:
+    return {name: itemgetter(name) for name in (*SUMMARY_FEATURES, *counts)}
+
+
+class _RecordSlot:
+    """一条 RecordRule（或 SummaryRule 的一个计数）在一次求值中的状态。"""
+
+    __slots__ = ("pos", "conds", "n", "needs", "count", "hit")
+
+    def __init__(self, pos: int, conds: tuple[Cond, ...], n: int, needs: frozenset[str]) -> None:
+        self.pos = pos
+        self.conds = conds
+        self.n = n
+        self.needs = needs
+        self.count = 0
+        self.hit: tuple | None = None
+
+
+class _BlockFeatures:
+    """一批记录上的各特征列。每个特征第一次用到时整列算出并缓存，之后所有规则共用这一列。
+
+    累计特征接着 _RecordStage 中上一批结束时的状态计算，算完后更新这些状态。
+    """
+
+    def __init__(self, stage: _RecordStage, block: RecordBlock) -> None:
+        self.stage = stage
+        self.block = block
+        self.columns: dict[str, Sequence] = {
+            "ts": block.timestamps,
+            "date": block.dates,
+            "hour": block.hours,
+            "cents": block.cents,
+        }
+
+    def __len__(self) -> int:
+        return len(self.block)
+
+    def column(self, name: str) -> Sequence:
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = self._compute(name)
+        return column
+
+    def _compute(self, name: str) -> Sequence:
+        block = self.block
+        stage = self.stage
+        if name == "merchant":
+            return list(map(block.merchants.__getitem__, block.merchant_ids))
+        if name == "meal":
+            return list(map(MEAL_BITS.__getitem__, block.hours))
+        if name == "second_of_hour":
+            return list(map(operator.mod, block.timestamps, repeat(3600)))
+        if name == "merchant_count":
+            counts = stage.merchant_counts
+            column = []
+            for mername in self.column("merchant"):
+                count = counts.get(mername, 0) + 1
+                counts[mername] = count
+                column.append(count)
+            return column
+        if name == "day_meals":
+            date, meals = stage.date, stage.day_meals
+            column = []
+            for record_date, bits in zip(block.dates, self.column("meal")):
+                if record_date != date:
+                    date = record_date
+                    meals = 0
+                meals |= bits
+                column.append(meals)
+            stage.date, stage.day_meals = date, meals
+            return column
+        if name == "gap":
+            ts = block.timestamps
+            if not ts:
+                return []
+            first = float(ts[0] - stage.prev_ts) if stage.prev_ts is not None else None
+            stage.prev_ts = ts[-1]
+            return [first, *map(float, map(operator.sub, ts[1:], ts[:-1]))]
+        raise ValueError(f"unknown feature {name!r}")
+
+    def mask(self, cond: Cond) -> Iterator[bool]:
+        """条件在每条记录上是否成立，按时间顺序惰性产出。"""
+
+        column = self.column(cond.feature)
+        if cond.ref is not None:
+            test = _compile_cond(cond, {cond.feature: itemgetter(0), cond.ref: itemgetter(1)})
+            return map(test, zip(column, self.column(cond.ref)))
+        if cond.op == "in":
+            return map(frozenset(cond.value).__contains__, column)
+        if cond.op in _COMPARE_OPS:
+            op = _OPS[cond.op]
+            value = cond.value
+            if cond.feature in _NULLABLE_FEATURES:
+                return (a is not None and op(a, value) for a in column)
+            return map(op, column, repeat(value))
+        # 其余运算逐值调用较慢；列中重复的值很多，每个不同的值只判断一次，再按值查表
+        test = _compile_cond(cond, {cond.feature: lambda value: value})
+        table = {value: test(value) for value in set(column)}
+        return map(table.__getitem__, column)
+
+    def where(self, conds: Sequence[Cond]) -> Iterator[bool] | None:
+        """一组条件在每条记录上是否全部成立，没有条件时返回 None。"""
+
+        result = None
+        for cond in conds:
+            mask = self.mask(cond)
+            result = mask if result is None else map(operator.and_, result, mask)
+        return result
+
+    def values(self, pos: int) -> tuple:
+        """第 pos 条记录按 RECORD_FEATURES 顺序的特征值，没有算出的累计特征为 None。"""
+
+        block = self.block
+        ts = block.timestamps[pos]
+        hour = block.hours[pos]
+        running = (self.columns.get(name) for name in ("merchant_count", "day_meals", "gap"))
+        return (
+            ts, block.dates[pos], hour, block.cents[pos], block.merchants[block.merchant_ids[pos]],
+            MEAL_BITS[hour], ts % 3600, *(column[pos] if column is not None else None for column in running),
+        )
+
+
+class _RecordStage(Tracker):
+    """计划中按记录求值的部分：在一批记录共用的特征列上求出各 RecordRule 第 n 条满足条件的记录与各个计数。"""
+
+    wants_records = True
+
+    def __init__(self, plan: RulePlan) -> None:
+        self.slots = [_RecordSlot(*spec) for spec in plan._record_specs]
+        self.counters = [_RecordSlot(*spec) for spec in plan._counter_specs]
+        self.active = list(self.slots)
+        self.needs = self._collect_needs()
+        self.merchant_counts: dict[str, int] = {}
+        self.date: str | None = None
+        self.day_meals = 0
+        self.prev_ts: int | None = None
+
+    def feed_block(self, block: RecordBlock) -> bool:
+        features = _BlockFeatures(self, block)
+        # 还有规则用到的累计特征整列推进，下一批续算时接着这里的状态
+        for name in sorted(self.needs):
+            features.column(name)
+
+        n = len(block)
+        for counter in self.counters:
+            mask = features.where(counter.conds)
+            counter.count += n if mask is None else sum(mask)
+        for slot in self.active:
+            mask = features.where(slot.conds)
+            matched = range(n) if mask is None else compress(range(n), mask)
+            # 只取凑满 n 条还差的那几条；解锁后不再计数
+            first = list(islice(matched, slot.n - slot.count))
+            slot.count += len(first)
+            if slot.count == slot.n:
+                slot.hit = features.values(first[-1])
+        self.active = [slot for slot in self.active if slot.hit is None]
+        # 累计特征只在还有规则用到时维护；已解锁的规则不再需要，之后也不会有新规则需要
+        self.needs = self._collect_needs()
+        return not self.active and not self.counters
+
+    def _collect_needs(self) -> frozenset[str]:
+        return frozenset().union(*(slot.needs for slot in self.active), *(c.needs for c in self.counters))
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "slots": [[slot.count, list(slot.hit) if slot.hit is not None else None] for slot in self.slots],
+            "counters": [counter.count for counter in self.counters],
+            "merchant_counts": dict(self.merchant_counts),
+            "date": self.date,
+            "day_meals": self.day_meals,
+            "prev_ts": self.prev_ts,
+        }
+
+    def restore(self, state: dict[str, Any]) -> None:
+        slots = state["slots"]
+        counters = state["counters"]
+        if len(slots) != len(self.slots) or len(counters) != len(self.counters):
+            raise ValueError("record stage state does not match the plan")
+        for slot, (count, hit) in zip(self.slots, slots):
+            slot.count = int(count)
+            slot.hit = tuple(hit) if hit is not None else None
+        for counter, count in zip(self.counters, counters):
+            counter.count = int(count)
+        self.merchant_counts = {str(k): int(v) for k, v in state["merchant_counts"].items()}
+        self.date = state["date"]
+        self.day_meals = int(state["day_meals"])
+        self.prev_ts = state["prev_ts"]
+        self.active = [slot for slot in self.slots if slot.hit is None]
+        self.needs = self._collect_needs()
+        self.done = not self.active and not self.counters
+
+
+class _DaySlot:
+    __slots__ = ("pos", "kind", "test", "n", "count", "streak", "window", "start", "hit")
+
+    def __init__(self, pos: int, kind: str, test: Callable[[DayEntry], bool], n: int) -> None:
+        self.pos = pos
+        self.kind = kind
+        self.test = test
+        self.n = n
+        self.count = 0
+        self.streak = StreakCounter() if kind == "streak" else None
+        self.window = SlidingDayWindow(n) if kind == "distinct" else None
+        self.start: DayEntry | None = None
+        self.hit: DayEntry | None = None
+
+
+class _DayStage(Tracker):
+    """计划中逐日推进的部分：DayRule、StreakRule 与 DistinctDaysRule。"""
+
+    wants_days = True
+
+    def __init__(self, plan: RulePlan) -> None:
+        self.slots = [_DaySlot(*spec) for spec in plan._day_specs]
+        self.active = list(self.slots)
+
+    def end_day(self, day):
+        retired = False
+        for slot in self.active:
+            if slot.kind == "nth":
+                if slot.test(day):
+                    slot.count += 1
+                    if slot.count == slot.n:
+                        slot.hit = day
+            elif slot.kind == "streak":
+                if slot.streak.push(day, slot.test(day)) >= slot.n:
+                    slot.start = slot.streak.start
+                    slot.hit = day
+            elif not day.merchants:
+                slot.window.clear()
+            elif slot.window.push(day, day.merchants, day.merchant_visits - len(day.merchants)):
+                slot.start = slot.window.first
+                slot.hit = day
+            if slot.hit is not None:
+                retired = True
+        if retired:
+            self.active = [slot for slot in self.active if slot.hit is None]
+        return not self.active
+
+    def snapshot(self) -> dict[str, Any]:
+        slots = []
+        for slot in self.slots:
+            state: dict[str, Any] = {"count": slot.count, "start": _dump_day(slot.start), "hit": _dump_day(slot.hit)}
+            if slot.streak is not None:
+                state["streak"] = [slot.streak.length, _dump_day(slot.streak.start), _dump_day(slot.streak.last)]
+            if slot.window is not None:
+                window = slot.window
+                state["window"] = [
+                    [_dump_day(entry) for entry in window.entries],
+                    list(window.last_seen.items()),
+                    window.barrier,
+                ]
+            slots.append(state)
+        return {"slots": slots}
+
+    def restore(self, state: dict[str, Any]) -> None:
+        slots = state["slots"]
+        if len(slots) != len(self.slots):
+            raise ValueError("day stage state does not match the plan")
+        for slot, saved in zip(self.slots, slots):
+            slot.count = int(saved["count"])
+            slot.start = _load_day(saved["start"])
+            slot.hit = _load_day(saved["hit"])
+            if slot.streak is not None:
+                length, start, last = saved["streak"]
+                slot.streak.length = int(length)
+                slot.streak.start = _load_day(start)
+                slot.streak.last = _load_day(last)
+            if slot.window is not None:
+                entries, last_seen, barrier = saved["window"]
+                slot.window.entries.extend(_load_day(entry) for entry in entries)
+                slot.window.last_seen = {item: int(day) for item, day in last_seen}
+                slot.window.barrier = barrier
+        self.active = [slot for slot in self.slots if slot.hit is None]
+        self.done = not self.active
+
+
+def _dump_day(entry: DayEntry | None) -> list | None:
+    if entry is None:
+        return None
+    return [
+        entry.day, entry.date, entry.start, entry.end, entry.first_ts, entry.last_ts,
+        entry.cents, entry.meals, sorted(entry.merchants), entry.merchant_visits,
+    ]
+
+
+def _load_day(data: list | None) -> DayEntry | None:
+    if data is None:
+        return None
+    day, date, start, end, first_ts, last_ts, cents, meals, merchants, visits = data
+    return DayEntry(day, date, start, end, first_ts, last_ts, cents, meals, set(merchants), visits)
+
+
+def _dump_stream(stream: StreamSummary) -> dict[str, Any]:
+    return {
+        "count": stream.count,
+        "days": stream.days,
+        "total_cents": stream.total_cents,
+        "first_ts": stream.first_ts,
+        "first_date": stream.first_date,
+        "last_ts": stream.last_ts,
+        "last_date": stream.last_date,
+        "open_day": _dump_day(stream.open_day),
+        "digest": stream.digest,
+    }
+
+
+def _load_stream(data: dict[str, Any]) -> StreamSummary:
+    return StreamSummary(
+        count=int(data["count"]),
+        days=int(data["days"]),
+        total_cents=int(data["total_cents"]),
+        first_ts=data["first_ts"],
+        first_date=data["first_date"],
+        last_ts=data["last_ts"],
+        last_date=data["last_date"],
+        open_day=_load_day(data["open_day"]),
+        digest=data["digest"],
+    )
+
+
+# 状态格式的版本号，格式变化时递增，旧状态随之失效
+STATE_VERSION = 2
+
+
+class RulePlan:
+    """一组规则编译后的求值计划，可以反复对不同的记录求值。"""
+
+    def __init__(self, rules: Sequence[Rule]) -> None:
+        ids = [rule.id for rule in rules]
+        if len(set(ids)) != len(ids):
+            raise ValueError("duplicate achievement id in rules")
+        self.rules = tuple(rules)
+        self._record_specs: list[tuple] = []
+        self._counter_specs: list[tuple] = []
+        self._counter_names: list[tuple[int, str]] = []
+        self._day_specs: list[tuple[int, str, Callable, int]] = []
+        self._summary_tests: dict[int, tuple[Callable, Callable]] = {}
+
+        for pos, rule in enumerate(self.rules):
+            if isinstance(rule, RecordRule):
+                self._check_extra(rule, _RECORD_LOCAL)
+                needs = _running_features(rule.where, rule.extra.values())
+                _check_conds(rule.where, RECORD_FEATURES)
+                self._record_specs.append((pos, rule.where, rule.n, needs))
+            elif isinstance(rule, DayRule):
+                self._day_specs.append((pos, "nth", _compile_where(rule.where, _DAY_GETTERS), rule.n))
+                self._check_extra(rule, _DAY_LOCAL)
+            elif isinstance(rule, StreakRule):
+                self._day_specs.append((pos, "streak", _compile_where(rule.where, _DAY_GETTERS), rule.length))
+                self._check_extra(rule, ("start_date", "end_date"))
+            elif isinstance(rule, DistinctDaysRule):
+                if rule.where:
+                    raise ValueError(f"DistinctDaysRule {rule.id!r} does not take conditions")
+                self._day_specs.append((pos, "distinct", _compile_where((), _DAY_GETTERS), rule.length))
+                self._check_extra(rule, ("start_date", "end_date"))
+            elif isinstance(rule, SummaryRule):
+                for name, conds in rule.counts.items():
+                    needs = _running_features(conds)
+                    _check_conds(conds, RECORD_FEATURES)
+                    self._counter_specs.append((pos, tuple(conds), 0, needs))
+                    self._counter_names.append((pos, name))
+                self._check_extra(rule, tuple(rule.counts))
+            else:
+                raise TypeError(f"unsupported rule type {type(rule).__name__}")
+
+            counts = tuple(rule.counts) if isinstance(rule, SummaryRule) else ()
+            getters = _summary_getters(counts)
+            requires = _compile_where(rule.requires, getters)
+            where = _compile_where(rule.where, getters) if isinstance(rule, SummaryRule) else None
+            self._summary_tests[pos] = (requires, where)
+
+        # 规则有任何变化时保存的状态都不能再用，用规则的 repr 作为计划的指纹
+        self.fingerprint = hashlib.sha256(repr(self.rules).encode("utf-8")).hexdigest()[:16]
+
+    def _check_extra(self, rule: Rule, local: Sequence[str]) -> None:
+        for name in rule.extra.values():
+            if name not in local and name not in SUMMARY_FEATURES:
+                raise ValueError(f"unknown extra feature {name!r} in rule {rule.id!r}")
+
+    def evaluate(
+        self,
+        records: SpendRecords,
+        order: Sequence[int] | None = None,
+        student_id_suffix: int | None = None,
+        used_default_password: bool | None = None,
+    ) -> list[AchievementResult]:
+        """对记录求值，按规则顺序返回结果。order 为按时间排序的记录下标，可省去一次排序。"""
+
+        record_stage = _RecordStage(self)
+        day_stage = _DayStage(self)
+        stream = stream_records(records, [record_stage, day_stage], order)
+        return self._results(record_stage, day_stage, stream, student_id_suffix, used_default_password)
+
+    def evaluate_incremental(
+        self,
+        records: SpendRecords,
+        state: dict[str, Any] | None = None,
+        order: Sequence[int] | None = None,
+        student_id_suffix: int | None = None,
+        used_default_password: bool | None = None,
+    ) -> tuple[list[AchievementResult], dict[str, Any]]:
+        """在上次的状态上续算，返回 (结果, 新状态)，结果与 evaluate 对全部记录求值相同。
+
+        records 为包括上次记录在内的全部记录，只有比上次最后一笔更晚的记录会被处理。
+        state 为上次返回的状态（可以经过 JSON 往返）；没有状态，或状态与本计划、本批记录对不上时
+        （规则改过、换了学号或年份、旧记录有变化），从头计算。
+        """
+
+        if order is None:
+            order = records.sorted_indices()
+        if state is not None:
+            try:
+                return self._resume(records, state, order, student_id_suffix, used_default_password)
+            except (ValueError, KeyError, TypeError):
+                pass
+        return self._resume(records, None, order, student_id_suffix, used_default_password)
+
+    def _resume(
+        self,
+        records: SpendRecords,
+        state: dict[str, Any] | None,
+        order: Sequence[int],
+        student_id_suffix: int | None,
+        used_default_password: bool | None,
+    ) -> tuple[list[AchievementResult], dict[str, Any]]:
+        record_stage = _RecordStage(self)
+        day_stage = _DayStage(self)
+        resume = None
+        if state is not None:
+            if state.get("version") != STATE_VERSION or state.get("plan") != self.fingerprint:
+                raise ValueError("state was saved by another plan")
+            resume = _load_stream(state["stream"])
+            record_stage.restore(state["records"])
+            day_stage.restore(state["days"])
+
+        stream = stream_records(records, [record_stage, day_stage], order, resume=resume, keep_open=True)
+        new_state = {
+            "version": STATE_VERSION,
+            "plan": self.fingerprint,
+            "stream": _dump_stream(stream),
+            "records": record_stage.snapshot(),
+            "days": day_stage.snapshot(),
+        }
+
+        # 状态保存的是最后一天结束之前的样子，求结果时才把最后一天交给逐日的规则
+        if stream.open_day is not None and not day_stage.done:
+            day_stage.end_day(stream.open_day)
+        results = self._results(record_stage, day_stage, stream, student_id_suffix, used_default_password)
+        return results, new_state
+
+    def _results(
+        self,
+        record_stage: _RecordStage,
+        day_stage: _DayStage,
+        stream: StreamSummary,
+        student_id_suffix: int | None,
+        used_default_password: bool | None,
+    ) -> list[AchievementResult]:
+        summary = _summary_features(stream, student_id_suffix, used_default_password)
+        counts: dict[int, dict[str, int]] = {}
+        for (pos, name), counter in zip(self._counter_names, record_stage.counters):
+            counts.setdefault(pos, {})[name] = counter.count
+
+        record_slots = {slot.pos: slot for slot in record_stage.slots}
+        day_slots = {slot.pos: slot for slot in day_stage.slots}
+        results = []
+        for pos, rule in enumerate(self.rules):
+            features = {**summary, **counts[pos]} if pos in counts else summary
+            requires, where = self._summary_tests[pos]
+            if not requires(features):
+                results.append(AchievementResult(id=rule.id, unlocked=False))
+            elif pos in record_slots:
+                results.append(_record_result(rule, record_slots[pos], features))
+            elif pos in day_slots:
+                results.append(_day_result(rule, day_slots[pos], features))
+            else:
+                results.append(_summary_result(rule, where(features), features))
+        return results
+
+
+def compile_rules(rules: Sequence[Rule]) -> RulePlan:
+    """把规则编译成求值计划；特征名、运算或 extra 写错时抛出 ValueError。"""
+    return RulePlan(rules)
+
+
+def _summary_features(
+    stream: StreamSummary,
+    student_id_suffix: int | None,
+    used_default_password: bool | None,
+) -> dict[str, Any]:
+    return {
+        "records": stream.count,
+        "days": stream.days,
+        "total_cents": stream.total_cents,
+        "total_amount": stream.total_cents / 100,
+        "first_ts": stream.first_ts,
+        "first_date": stream.first_date,
+        "last_ts": stream.last_ts,
+        "last_date": stream.last_date,
+        "first_month_day": stream.first_date[5:] if stream.first_date else None,
+        "last_month_day": stream.last_date[5:] if stream.last_date else None,
+        "student_id_suffix": student_id_suffix,
+        "unit_cents": student_id_suffix * 100 if student_id_suffix else None,
+        "used_default_password": used_default_password,
+    }
+
+
+def _build_result(
+    rule: Rule,
+    unlocked: bool,
+    unlock_ts: int | None,
+    local: Callable[[str], Any],
+    local_names: Sequence[str],
+    summary: dict[str, Any],
+) -> AchievementResult:
+    """组装结果；extra 中的特征名优先按规则自身的特征取值，其次取汇总特征。"""
+
+    extra = None
+    if rule.extra and (unlocked or rule.extra_when_locked):
+        extra = {key: local(name) if name in local_names else summary[name] for key, name in rule.extra.items()}
+    return AchievementResult(
+        id=rule.id,
+        unlocked=unlocked,
+        unlocked_at=format_minute(unlock_ts) if unlocked else None,
+        extra=extra,
+    )
+
+
+def _record_result(rule: RecordRule, slot: _RecordSlot, summary: dict[str, Any]) -> AchievementResult:
+    hit = slot.hit
+
+    def local(name: str) -> Any:
+        if name == "count":
+            return slot.count
+        if hit is None:
+            return None
+        if name == "amount":
+            return hit[_RECORD_INDEX["cents"]] / 100
+        return hit[_RECORD_INDEX[name]]
+
+    unlock_ts = hit[_RECORD_INDEX["ts"]] if hit is not None else None
+    return _build_result(rule, hit is not None, unlock_ts, local, _RECORD_LOCAL, summary)
+
+
+def _day_result(rule: Rule, slot: _DaySlot, summary: dict[str, Any]) -> AchievementResult:
+    hit = slot.hit
+    start = slot.start
+
+    def local(name: str) -> Any:
+        if name == "count":
+            return slot.count
+        if hit is None:
+            return None
+        if name == "start_date":
+            return start.date if start is not None else None
+        if name == "end_date":
+            return hit.date
+        return getattr(hit, name)
+
+    unlock_ts = None
+    if hit is not None:
+        unlock_ts = hit.first_ts if isinstance(rule, DayRule) and rule.at == "first" else hit.last_ts
+    return _build_result(rule, hit is not None, unlock_ts, local, _DAY_LOCAL, summary)
+
+
+def _summary_result(rule: SummaryRule, unlocked: bool, features: dict[str, Any]) -> AchievementResult:
+    unlock_ts = features["first_ts"] if rule.at == "first" else features["last_ts"]
+    return _build_result(rule, unlocked, unlock_ts, features.__getitem__, (), features)
+
+
+ACHIEVEMENT_RULES: list[Rule] = [
+    # 早八人：6:00-8:00 消费 >= 5 次
+    RecordRule(
+        "early_bird",
+        where=(Cond("hour", ">=", 6), Cond("hour", "<", 8)),
+        n=5,
+        extra={"count": "count"},
+        extra_when_locked=True,
+    ),
+    # 守夜人：21:00 以后消费 >= 5 次
+    RecordRule("night_owl", where=(Cond("hour", ">=", 21),), n=5, extra={"count": "count"}, extra_when_locked=True),
+    # 凑单领域大神：单日总金额 >= 20 元且为 10 元的倍数
+    DayRule("make_it_round", where=(Cond("cents", ">=", 2000), Cond("cents", "multiple_of", 1000))),
+    # 加个鸡腿：单笔 > 25 元
+    RecordRule("big_meal", where=(Cond("cents", ">", 2500),), extra={"amount": "amount"}),
+    # 极限生存：单笔 < 1 元
+    RecordRule("minimalist", where=(Cond("cents", "<", 100),), extra={"amount": "amount"}),
+    # 迷途之子：就餐天数 < 50 天
+    SummaryRule("lost_kid", where=(Cond("days", "<", 50),), extra={"days": "days"}, extra_when_locked=True),
+    # 干饭人：就餐天数 >= 1 天
+    SummaryRule("eater", where=(Cond("days", ">=", 1),), at="first", extra={"days": "days"}, extra_when_locked=True),
+    # 百日烟火 / 全勤奖：就餐天数 >= 100 / 200 天，解锁于第 100 / 200 天的第一笔
+    DayRule("hundred_days", n=100, at="first", extra={"days": "days"}, extra_when_locked=True),
+    DayRule("full_timer", n=200, at="first", extra={"days": "days"}, extra_when_locked=True),
+    # 西西弗斯：同一商家第 21 次消费
+    RecordRule(
+        "default_setting",
+        where=(Cond("merchant_count", "==", 21),),
+        extra={"merchant": "merchant", "count": "merchant_count"},
+    ),
+    # 故事的开始：第一笔就在当年 1 月 1 日
+    SummaryRule("story_start", where=(Cond("first_month_day", "==", "01-01"),), at="first", extra={"date": "first_date"}),
+    # 又一年：最后一笔就在当年 12 月 31 日
+    SummaryRule("another_year", where=(Cond("last_month_day", "==", "12-31"),), extra={"date": "last_date"}),
+    # 消失的早餐：9 点前消费 < 10 次
+    SummaryRule(
+        "missing_breakfast",
+        counts={"count": (Cond("hour", "<", 9),)},
+        where=(Cond("records", ">", 0), Cond("count", "<", 10)),
+        extra={"count": "count"},
+        extra_when_locked=True,
+    ),
+    # 好好吃饭：同一天凑齐早、中、晚三餐
+    RecordRule("good_meals", where=(Cond("day_meals", "==", ALL_MEALS),), extra={"date": "date"}),
+    # 完美一周：连续七天一日三餐
+    StreakRule(
+        "perfect_week",
+        where=(Cond("meals", "==", ALL_MEALS),),
+        length=7,
+        extra={"start_date": "start_date", "end_date": "end_date"},
+    ),
+    # 宇宙饭：连续五天每天在不一样的商家吃饭
+    DistinctDaysRule("cosmic_meal", length=5, extra={"start_date": "start_date", "end_date": "end_date"}),
+    # 我的回合：2 分钟内连续刷卡 2 次
+    RecordRule(
+        "my_turn",
+        where=(Cond("gap", ">", 0), Cond("gap", "<=", 120)),
+        extra={"interval_seconds": "gap"},
+    ),
+    # 边缘行者：在某个小时的 59 分 59 秒消费
+    RecordRule("edge_runner", where=(Cond("second_of_hour", "==", 3599),)),
+    # Error 404：单笔 4.04 / 40.4 / 404 元
+    RecordRule("error_404", where=(Cond("cents", "in", (404, 4040, 40400)),), extra={"amount": "amount"}),
+    # Hello World：第一笔消费
+    SummaryRule("hello_world", where=(Cond("records", ">", 0),), at="first", extra={"first_date": "first_date"}),
+    # PI：单笔 3.14 / 31.4 / 314 元
+    RecordRule("pi", where=(Cond("cents", "in", (314, 3140, 31400)),), extra={"amount": "amount"}),
+    # 安全意识：没有使用默认密码
+    SummaryRule("secure_call", where=(Cond("used_default_password", "==", False),), at="first"),
+    # 注意到：总金额恰为学号后四位的倍数
+    SummaryRule(
+        "noticed",
+        requires=(Cond("unit_cents", ">", 0),),
+        where=(Cond("total_cents", ">", 0), Cond("total_cents", "multiple_of", ref="unit_cents")),
+        extra={"total_amount": "total_amount"},
+        extra_when_locked=True,
+    ),
+]
+
+DEFAULT_PLAN = compile_rules(ACHIEVEMENT_RULES)
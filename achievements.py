@@ -1,21 +1,99 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Any
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from collections import defaultdict, deque
+from operator import eq, itemgetter
+from typing import Any, Callable, Hashable, Iterable, Iterator, Sequence
+
+from record_store import SpendRecords
+from txtime import format_minute
+
+
+# 小时 -> 餐次位：早餐 1（< 10 点）、午餐 2（< 15 点）、晚餐 4（< 22 点），其余为 0
+MEAL_BITS = tuple(1 if h < 10 else 2 if h < 15 else 4 if h < 22 else 0 for h in range(24))
+ALL_MEALS = 7
 
 
 @dataclass
-class AchContext:
-    """预处理后的成就计算上下文。"""
+class DayEntry:
+    """某一天全部记录的汇总。
+
+    start、end 为当天记录在按时间排序的序列中的位置（左闭右开），
+    merchants 只包含非空商户名，merchant_visits 为这些商户的消费笔数，
+    两者相等说明当天没有在同一商户消费两次。
+    """
+
+    day: int
+    date: str
+    start: int
+    end: int
+    first_ts: int
+    last_ts: int
+    cents: int = 0
+    meals: int = 0
+    merchants: set[str] = field(default_factory=set)
+    merchant_visits: int = 0
+
+    @property
+    def amount(self) -> float:
+        return self.cents / 100
 
-    records: list[dict]
-    records_sorted_by_time: list[dict]
+
+@dataclass
+class AchContext:
+    """预处理后的成就计算上下文。
+
+    记录按交易时间排好序后以平行的列保存，第 i 个元素都属于时间上的第 i 条记录：
+    timestamps、cents、hours、merchant_ids 与 SpendRecords 中的同名列含义相同，record_dates 为 YYYY-MM-DD，
+    商户名为 merchants[merchant_ids[i]]（即 SpendRecords.merchants）。记录本来就按时间排列时直接引用
+    SpendRecords 的列，否则按时间顺序重排一份，不为每条记录构造字典。
+
+    days 为按时间排列的每天汇总，day_index 以日期字符串索引同一批 DayEntry，
+    按日期定位解锁时间时用 day_range / first_ts_on / last_ts_on，不必再扫描全部记录。
+    """
+
+    timestamps: Sequence[int]
+    cents: Sequence[int]
+    hours: Sequence[int]
+    record_dates: Sequence[str]
+    merchant_ids: Sequence[int]
+    merchants: Sequence[str]
     dates: set[str]
     daily_amount: dict[str, float]
     student_id_suffix: int | None = None
     used_default_password: bool | None = None
+    days: list[DayEntry] = field(default_factory=list)
+    day_index: dict[str, DayEntry] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def mername(self, i: int) -> str:
+        return self.merchants[self.merchant_ids[i]]
+
+    def day(self, date_str: str) -> DayEntry | None:
+        return self.day_index.get(date_str)
+
+    def day_range(self, date_str: str) -> range:
+        """某一天的记录在各列中的位置，没有记录时为空。"""
+        entry = self.day_index.get(date_str)
+        if entry is None:
+            return range(0)
+        return range(entry.start, entry.end)
+
+    def first_ts_on(self, date_str: str) -> int | None:
+        entry = self.day_index.get(date_str)
+        return entry.first_ts if entry is not None else None
+
+    def last_ts_on(self, date_str: str) -> int | None:
+        entry = self.day_index.get(date_str)
+        return entry.last_ts if entry is not None else None
+
+    def nth_day(self, n: int) -> DayEntry | None:
+        """第 n 个有消费的日期（从 1 开始计）。"""
+        return self.days[n - 1] if 0 < n <= len(self.days) else None
 
 
 @dataclass
@@ -26,94 +104,232 @@ class AchievementResult:
     extra: dict[str, Any] | None = None
 
 
-def _parse_dt(raw: str) -> datetime:
-    """将 txdate 字符串解析为 datetime"""
+def build_context(
+    records: SpendRecords,
+    student_id: str | None = None,
+    used_default_password: bool | None = None,
+    order: Sequence[int] | None = None,
+) -> AchContext:
+    """从扣费记录构建成就计算所需的上下文。
 
-    raw = raw.strip()
-    if not raw:
-        raise ValueError("Empty datetime string")
+    order 为按时间排序的记录下标（如 ReportAggregate.order），不传时自行排序。
+    """
 
-    try:
-        return datetime.fromisoformat(raw)
-    except ValueError:
-        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
-            try:
-                return datetime.strptime(raw, fmt)
-            except ValueError:
-                continue
-    raise ValueError(f"Unrecognized datetime format: {raw!r}")
+    if order is None:
+        order = records.sorted_indices()
+    # 时间派生字段由 SpendRecords.time_fields() 统一计算并缓存，这里不再构造 datetime
+    fields = records.time_fields()
+    columns = (records.timestamps, records.cents, fields.hours, fields.dates, records.merchant_ids)
+    if not _is_identity(order):
+        columns = _take_columns(columns, order)
+    timestamps, cents, hours, record_dates, merchant_ids = columns
 
+    days = build_day_index(timestamps, record_dates, hours, cents, merchant_ids, records.merchants)
+    return AchContext(
+        timestamps=timestamps,
+        cents=cents,
+        hours=hours,
+        record_dates=record_dates,
+        merchant_ids=merchant_ids,
+        merchants=records.merchants,
+        dates={entry.date for entry in days},
+        # 每日金额在分上累加，结果与记录的先后顺序无关
+        daily_amount={entry.date: entry.cents / 100 for entry in days},
+        student_id_suffix=parse_student_id_suffix(student_id),
+        used_default_password=used_default_password,
+        days=days,
+        day_index={entry.date: entry for entry in days},
+    )
 
-def _format_dt(dt: datetime | None) -> str | None:
-    if dt is None:
-        return None
-    return dt.strftime("%Y-%m-%d %H:%M")
 
+def _is_identity(order: Sequence[int]) -> bool:
+    return all(map(eq, order, range(len(order))))
 
-def build_context(
-    records: list[dict],
-    student_id: str | None = None,
-    used_default_password: bool | None = None,
-) -> AchContext:
-    """从扣费记录构建成就计算所需的上下文。"""
 
-    records_with_dt: list[dict] = []
-    dates: set[str] = set()
-    daily_amount: dict[str, float] = defaultdict(float)
+def _take_columns(columns: Sequence[Sequence], order: Sequence[int]) -> tuple[Sequence, ...]:
+    """按 order 重排各列，array 仍得到同类型的 array。"""
 
-    student_id_suffix: int | None = None
-    if student_id:
-        s = student_id.strip()
-        if len(s) >= 4 and s[-4:].isdigit():
-            student_id_suffix = int(s[-4:])
+    if len(order) > 1:
+        take = itemgetter(*order)
+    else:
+        # 只有一个下标时 itemgetter 返回单个值而不是元组
+        take = lambda column: [column[i] for i in order]  # noqa: E731
+    return tuple(
+        array(column.typecode, take(column)) if isinstance(column, array) else list(take(column))
+        for column in columns
+    )
 
-    for r in records:
-        raw_date = str(r.get("txdate", ""))
-        try:
-            dt = _parse_dt(raw_date)
-        except ValueError:
+
+def build_day_index(
+    timestamps: Sequence[int],
+    record_dates: Sequence[str],
+    hours: Sequence[int],
+    cents: Sequence[int],
+    merchant_ids: Sequence[int],
+    merchants: Sequence[str],
+    offset: int = 0,
+) -> list[DayEntry]:
+    """把按时间排序的各列按天切分，得到每天的 DayEntry。
+
+    时间戳有序，每天的终点用二分查找定位，再对当天的切片整体求和、取集合，不逐条记录更新 DayEntry。
+    各列只是完整序列从 offset 开始的一段时，DayEntry 的 start、end 仍按完整序列计。
+    """
+
+    # 空商户名不计入 merchants 与 merchant_visits
+    blank = merchants.index("") if "" in merchants else -1
+    days: list[DayEntry] = []
+    start = 0
+    n = len(timestamps)
+    while start < n:
+        day = timestamps[start] // 86400
+        end = bisect_left(timestamps, (day + 1) * 86400, start)
+        meals = 0
+        for hour in set(hours[start:end]):
+            meals |= MEAL_BITS[hour]
+        day_mids = merchant_ids[start:end]
+        names = {merchants[mid] for mid in set(day_mids)}
+        names.discard("")
+        days.append(
+            DayEntry(
+                day, record_dates[start], start + offset, end + offset, timestamps[start], timestamps[end - 1],
+                sum(cents[start:end]), meals, names, end - start - day_mids.count(blank),
+            )
+        )
+        start = end
+    return days
+
+
+def iter_day_runs(
+    days: Iterable[DayEntry],
+    keep: Callable[[DayEntry], bool] | None = None,
+) -> Iterator[list[DayEntry]]:
+    """把按时间排列的 DayEntry 切成若干段连续的自然日，逐段产出。
+
+    没有记录的日期和 keep 返回假的日期都会截断当前段，只遍历有记录的日期。
+    """
+
+    run: list[DayEntry] = []
+    for entry in days:
+        if keep is not None and not keep(entry):
+            if run:
+                yield run
+                run = []
             continue
+        if run and entry.day != run[-1].day + 1:
+            yield run
+            run = []
+        run.append(entry)
+    if run:
+        yield run
+
+
+class StreakCounter:
+    """逐日推进的连续天数计数，适合按时间逐天喂入的场景。
+
+    push 传入当天是否满足条件，返回截至当天的连续天数；不满足条件或与上一个满足条件的日期
+    之间有空缺时，计数从头开始。start 为当前连续段的第一天。
+    """
+
+    __slots__ = ("length", "start", "last")
+
+    def __init__(self) -> None:
+        self.length = 0
+        self.start: DayEntry | None = None
+        self.last: DayEntry | None = None
+
+    def push(self, entry: DayEntry, ok: bool) -> int:
+        if not ok:
+            self.length = 0
+            return 0
+        if self.length and self.last is not None and entry.day == self.last.day + 1:
+            self.length += 1
+        else:
+            self.length = 1
+            self.start = entry
+        self.last = entry
+        return self.length
 
-        amount = float(r.get("amount", 0.0))
-        date_str = dt.date().isoformat()
 
-        dates.add(date_str)
-        daily_amount[date_str] += amount
+class SlidingDayWindow:
+    """最近 size 个连续自然日的滑动窗口，增量判断窗口内的元素是否两两不同。
 
-        new_r = dict(r)
-        new_r["__dt"] = dt
-        records_with_dt.append(new_r)
+    last_seen 记录每个元素最后出现在哪一天。新的一天加入时，与之前重复的元素把 barrier
+    推到它们上一次出现的日期：起点不晚于 barrier 的窗口都含有重复。因此每天只需对当天的元素集合
+    做一次集合运算和一次字典更新，移出窗口的日期无需任何处理。日期不连续时窗口自动清空。
+    """
 
-    records_sorted_by_time = sorted(records_with_dt, key=lambda rec: rec["__dt"])
+    __slots__ = ("size", "entries", "last_seen", "barrier")
 
-    return AchContext(
-        records=records_with_dt,
-        records_sorted_by_time=records_sorted_by_time,
-        dates=dates,
-        daily_amount=daily_amount,
-        student_id_suffix=student_id_suffix,
-        used_default_password=used_default_password,
-    )
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries: deque[DayEntry] = deque(maxlen=size)
+        self.last_seen: dict[Hashable, int] = {}
+        self.barrier: int | None = None
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.last_seen.clear()
+        self.barrier = None
+
+    def push(self, entry: DayEntry, items: set | frozenset, repeats: int = 0) -> bool:
+        """加入一天去重后的元素集合 items，repeats 为当天内部的重复次数。
+
+        返回加入后窗口是否已满且元素两两不同。
+        """
+
+        entries = self.entries
+        if entries and entry.day != entries[-1].day + 1:
+            self.clear()
+        entries.append(entry)
+
+        last_seen = self.last_seen
+        barrier = self.barrier
+        if repeats:
+            # 当天内部就有重复：包含这一天的窗口都不满足，之后的窗口也不会再用到这一天的元素
+            barrier = entry.day
+        else:
+            overlap = last_seen.keys() & items
+            if overlap:
+                latest = max(map(last_seen.__getitem__, overlap))
+                if barrier is None or latest > barrier:
+                    barrier = latest
+            last_seen.update(dict.fromkeys(items, entry.day))
+        self.barrier = barrier
+        return len(entries) == self.size and (barrier is None or barrier < entries[0].day)
+
+    @property
+    def full(self) -> bool:
+        return len(self.entries) == self.size
+
+    @property
+    def first(self) -> DayEntry:
+        return self.entries[0]
+
+    @property
+    def last(self) -> DayEntry:
+        return self.entries[-1]
+
+    def distinct(self) -> bool:
+        return bool(self.entries) and (self.barrier is None or self.barrier < self.entries[0].day)
 
 
 def ach_early_bird(ctx: AchContext) -> AchievementResult:
     """早八人：06:00-08:00 间消费 >= 5 次。"""
 
     count = 0
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
 
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if 6 <= dt.hour < 8:
+    for ts, hour in zip(ctx.timestamps, ctx.hours):
+        if 6 <= hour < 8:
             count += 1
             if count == 5:
-                unlock_dt = dt
+                unlock_ts = ts
                 break
 
     return AchievementResult(
         id="early_bird",
         unlocked=count >= 5,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked_at=format_minute(unlock_ts),
         extra={"count": count},
     )
 
@@ -122,20 +338,19 @@ def ach_night_owl(ctx: AchContext) -> AchievementResult:
     """守夜人：21:00 以后消费 >= 5 次。"""
 
     count = 0
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
 
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if dt.hour >= 21:
+    for ts, hour in zip(ctx.timestamps, ctx.hours):
+        if hour >= 21:
             count += 1
             if count == 5:
-                unlock_dt = dt
+                unlock_ts = ts
                 break
 
     return AchievementResult(
         id="night_owl",
         unlocked=count >= 5,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked_at=format_minute(unlock_ts),
         extra={"count": count},
     )
 
@@ -152,19 +367,13 @@ def ach_make_it_round(ctx: AchContext) -> AchievementResult:
                 if candidate_date is None or date_str < candidate_date:
                     candidate_date = date_str
 
-    unlock_dt: datetime | None = None
-    if candidate_date is not None:
-        # 将该日最后一笔消费时间作为解锁时间
-        for rec in reversed(ctx.records_sorted_by_time):
-            dt: datetime = rec["__dt"]
-            if dt.date().isoformat() == candidate_date:
-                unlock_dt = dt
-                break
+    # 将该日最后一笔消费时间作为解锁时间
+    unlock_ts = ctx.last_ts_on(candidate_date) if candidate_date is not None else None
 
     return AchievementResult(
         id="make_it_round",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
         extra=None,
     )
 
@@ -173,21 +382,21 @@ def ach_big_meal(ctx: AchContext) -> AchievementResult:
     """加个鸡腿：单笔消费金额 > 25 元。"""
 
     threshold = 25.0
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     max_amount = 0.0
 
-    for rec in ctx.records_sorted_by_time:
-        amount = float(rec.get("amount", 0.0))
+    for ts, cents in zip(ctx.timestamps, ctx.cents):
+        amount = cents / 100
         if amount > threshold:
-            unlock_dt = rec["__dt"]
+            unlock_ts = ts
             max_amount = amount
             break
 
     return AchievementResult(
         id="big_meal",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"amount": max_amount} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"amount": max_amount} if unlock_ts is not None else None,
     )
 
 
@@ -195,21 +404,21 @@ def ach_minimalist(ctx: AchContext) -> AchievementResult:
     """极限生存：单笔消费金额 < 1 元。"""
 
     threshold = 1.0
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     min_amount = None
 
-    for rec in ctx.records_sorted_by_time:
-        amount = float(rec.get("amount", 0.0))
+    for ts, cents in zip(ctx.timestamps, ctx.cents):
+        amount = cents / 100
         if amount < threshold:
-            unlock_dt = rec["__dt"]
+            unlock_ts = ts
             min_amount = amount
             break
 
     return AchievementResult(
         id="minimalist",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"amount": min_amount} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"amount": min_amount} if unlock_ts is not None else None,
     )
 
 
@@ -219,14 +428,12 @@ def ach_lost_kid(ctx: AchContext) -> AchievementResult:
     days_count = len(ctx.dates)
     unlock = days_count < 50
     # 使用最后一笔消费的时间作为解锁时间（如果有）
-    last_dt: datetime | None = (
-        ctx.records_sorted_by_time[-1]["__dt"] if ctx.records_sorted_by_time else None
-    )
+    last_ts: int | None = ctx.timestamps[-1] if ctx.timestamps else None
 
     return AchievementResult(
         id="lost_kid",
         unlocked=unlock,
-        unlocked_at=_format_dt(last_dt) if unlock else None,
+        unlocked_at=format_minute(last_ts) if unlock else None,
         extra={"days": days_count},
     )
 
@@ -237,14 +444,12 @@ def ach_eater(ctx: AchContext) -> AchievementResult:
     days_count = len(ctx.dates)
     unlocked = days_count >= 1
 
-    first_dt: datetime | None = (
-        ctx.records_sorted_by_time[0]["__dt"] if ctx.records_sorted_by_time else None
-    )
+    first_ts: int | None = ctx.timestamps[0] if ctx.timestamps else None
 
     return AchievementResult(
         id="eater",
         unlocked=unlocked,
-        unlocked_at=_format_dt(first_dt),
+        unlocked_at=format_minute(first_ts),
         extra={"days": days_count},
     )
 
@@ -255,22 +460,14 @@ def ach_hundred_days(ctx: AchContext) -> AchievementResult:
     days_count = len(ctx.dates)
     unlocked = days_count >= 100
 
-    unlock_dt: datetime | None = None
-    if unlocked:
-        seen: set[str] = set()
-        for rec in ctx.records_sorted_by_time:
-            dt: datetime = rec["__dt"]
-            date_str = dt.date().isoformat()
-            if date_str not in seen:
-                seen.add(date_str)
-                if len(seen) == 100:
-                    unlock_dt = dt
-                    break
+    # 第 100 个就餐日的第一笔
+    nth = ctx.nth_day(100)
+    unlock_ts = nth.first_ts if nth is not None else None
 
     return AchievementResult(
         id="hundred_days",
         unlocked=unlocked,
-        unlocked_at=_format_dt(unlock_dt) if unlocked else None,
+        unlocked_at=format_minute(unlock_ts) if unlocked else None,
         extra={"days": days_count},
     )
 
@@ -281,22 +478,14 @@ def ach_full_timer(ctx: AchContext) -> AchievementResult:
     days_count = len(ctx.dates)
     unlocked = days_count >= 200
 
-    unlock_dt: datetime | None = None
-    if unlocked:
-        seen: set[str] = set()
-        for rec in ctx.records_sorted_by_time:
-            dt: datetime = rec["__dt"]
-            date_str = dt.date().isoformat()
-            if date_str not in seen:
-                seen.add(date_str)
-                if len(seen) == 200:
-                    unlock_dt = dt
-                    break
+    # 第 200 个就餐日的第一笔
+    nth = ctx.nth_day(200)
+    unlock_ts = nth.first_ts if nth is not None else None
 
     return AchievementResult(
         id="full_timer",
         unlocked=unlocked,
-        unlocked_at=_format_dt(unlock_dt) if unlocked else None,
+        unlocked_at=format_minute(unlock_ts) if unlocked else None,
         extra={"days": days_count},
     )
 
@@ -305,23 +494,23 @@ def ach_default_setting(ctx: AchContext) -> AchievementResult:
     """西西弗斯：在同一个商家消费次数 > 20 次。"""
 
     counts: dict[str, int] = defaultdict(int)
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     target_mer: str | None = None
 
-    for rec in ctx.records_sorted_by_time:
-        mer = str(rec.get("mername", ""))
+    for ts, mid in zip(ctx.timestamps, ctx.merchant_ids):
+        mer = ctx.merchants[mid]
         counts[mer] += 1
         if counts[mer] == 21:
-            unlock_dt = rec["__dt"]
+            unlock_ts = ts
             target_mer = mer
             break
 
     return AchievementResult(
         id="default_setting",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
         extra={"merchant": target_mer, "count": counts.get(target_mer, 0)}
-        if unlock_dt is not None and target_mer is not None
+        if unlock_ts is not None and target_mer is not None
         else None,
     )
 
@@ -329,54 +518,38 @@ def ach_default_setting(ctx: AchContext) -> AchievementResult:
 def ach_story_start(ctx: AchContext) -> AchievementResult:
     """故事的开始：在第一天吃饭。"""
 
-    if not ctx.records_sorted_by_time:
+    if not ctx.timestamps:
         return AchievementResult(id="story_start", unlocked=False)
 
-    first_year = ctx.records_sorted_by_time[0]["__dt"].year
+    first_year = int(ctx.record_dates[0][:4])
     target_date_str = f"{first_year:04d}-01-01"
 
-    if target_date_str not in ctx.dates:
-        return AchievementResult(id="story_start", unlocked=False)
-
-    unlock_dt: datetime | None = None
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if dt.date().isoformat() == target_date_str:
-            unlock_dt = dt
-            break
+    unlock_ts = ctx.first_ts_on(target_date_str)
 
     return AchievementResult(
         id="story_start",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"date": target_date_str} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"date": target_date_str} if unlock_ts is not None else None,
     )
 
 
 def ach_another_year(ctx: AchContext) -> AchievementResult:
     """又一年：在最后一天吃饭。"""
 
-    if not ctx.records_sorted_by_time:
+    if not ctx.timestamps:
         return AchievementResult(id="another_year", unlocked=False)
 
-    last_year = ctx.records_sorted_by_time[-1]["__dt"].year
+    last_year = int(ctx.record_dates[-1][:4])
     target_date_str = f"{last_year:04d}-12-31"
 
-    if target_date_str not in ctx.dates:
-        return AchievementResult(id="another_year", unlocked=False)
-
-    unlock_dt: datetime | None = None
-    for rec in reversed(ctx.records_sorted_by_time):
-        dt: datetime = rec["__dt"]
-        if dt.date().isoformat() == target_date_str:
-            unlock_dt = dt
-            break
+    unlock_ts = ctx.last_ts_on(target_date_str)
 
     return AchievementResult(
         id="another_year",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"date": target_date_str} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"date": target_date_str} if unlock_ts is not None else None,
     )
 
 
@@ -384,20 +557,17 @@ def ach_missing_breakfast(ctx: AchContext) -> AchievementResult:
     """消失的早餐：全年 9 点前消费次数 < 10 次。"""
 
     early_count = 0
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if dt.hour < 9:
+    for hour in ctx.hours:
+        if hour < 9:
             early_count += 1
 
-    unlocked = bool(ctx.records_sorted_by_time) and early_count < 10
-    last_dt: datetime | None = (
-        ctx.records_sorted_by_time[-1]["__dt"] if unlocked and ctx.records_sorted_by_time else None
-    )
+    unlocked = bool(ctx.timestamps) and early_count < 10
+    last_ts: int | None = ctx.timestamps[-1] if unlocked else None
 
     return AchievementResult(
         id="missing_breakfast",
         unlocked=unlocked,
-        unlocked_at=_format_dt(last_dt) if last_dt is not None else None,
+        unlocked_at=format_minute(last_ts) if last_ts is not None else None,
         extra={"count": early_count},
     )
 
@@ -405,155 +575,79 @@ def ach_missing_breakfast(ctx: AchContext) -> AchievementResult:
 def ach_good_meals(ctx: AchContext) -> AchievementResult:
     """好好吃饭：单日内同时有早、中、晚三餐记录。"""
 
-    meals_by_date: dict[str, set[str]] = defaultdict(set)
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     target_date: str | None = None
 
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        date_str = dt.date().isoformat()
-        h = dt.hour
-        if h < 10:
-            meals_by_date[date_str].add("breakfast")
-        elif h < 15:
-            meals_by_date[date_str].add("lunch")
-        elif h < 22:
-            meals_by_date[date_str].add("dinner")
-
-        if len(meals_by_date[date_str]) == 3:
-            unlock_dt = dt
-            target_date = date_str
+    # 最早凑齐三餐的一天，再在当天的记录中找到凑齐的那一笔
+    for entry in ctx.days:
+        if entry.meals == ALL_MEALS:
+            meals = 0
+            for i in ctx.day_range(entry.date):
+                meals |= MEAL_BITS[ctx.hours[i]]
+                if meals == ALL_MEALS:
+                    unlock_ts = ctx.timestamps[i]
+                    target_date = entry.date
+                    break
             break
 
     return AchievementResult(
         id="good_meals",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"date": target_date} if unlock_dt is not None and target_date is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"date": target_date} if unlock_ts is not None and target_date is not None else None,
     )
 
 
 def ach_perfect_week(ctx: AchContext) -> AchievementResult:
     """完美一周：连续七天一日三餐。"""
-    meals_by_date: dict[str, set[str]] = defaultdict(set)
-
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        date_str = dt.date().isoformat()
-        h = dt.hour
-        if h < 10:
-            meals_by_date[date_str].add("breakfast")
-        elif h < 15:
-            meals_by_date[date_str].add("lunch")
-        elif h < 22:
-            meals_by_date[date_str].add("dinner")
-
-    if not meals_by_date:
-        return AchievementResult(id="perfect_week", unlocked=False)
-
-    date_keys = sorted(meals_by_date.keys())
-    first_date = datetime.fromisoformat(date_keys[0]).date()
-    last_date = datetime.fromisoformat(date_keys[-1]).date()
-
-    unlock_dt: datetime | None = None
+
+    unlock_ts: int | None = None
     span_start: str | None = None
     span_end: str | None = None
 
-    cur = first_date
-    streak = 0
-    while cur <= last_date:
-        date_str = cur.isoformat()
-        meals = meals_by_date.get(date_str)
-        if meals is not None and len(meals) >= 3:
-            if streak == 0:
-                span_start = date_str
-            streak += 1
-            if streak >= 7:
-                span_end = date_str
-                for rec in reversed(ctx.records_sorted_by_time):
-                    dt = rec["__dt"]
-                    if dt.date().isoformat() == date_str:
-                        unlock_dt = dt
-                        break
-                break
-        else:
-            streak = 0
-        cur += timedelta(days=1)
+    # 第一段长度够 7 天的三餐连续段，取其中前 7 天
+    for run in iter_day_runs(ctx.days, lambda entry: entry.meals == ALL_MEALS):
+        if len(run) >= 7:
+            span_start = run[0].date
+            span_end = run[6].date
+            unlock_ts = run[6].last_ts
+            break
 
     return AchievementResult(
         id="perfect_week",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
         extra={"start_date": span_start, "end_date": span_end}
-        if unlock_dt is not None and span_start is not None and span_end is not None
+        if unlock_ts is not None and span_start is not None and span_end is not None
         else None,
     )
 
 
 def ach_cosmic_meal(ctx: AchContext) -> AchievementResult:
     """宇宙饭：连续五天每天在不一样的商家吃饭"""
-    merchants_by_date: dict[str, list[str]] = defaultdict(list)
-
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        date_str = dt.date().isoformat()
-        mer = str(rec.get("mername", ""))
-        if mer:
-            merchants_by_date[date_str].append(mer)
 
-    if not merchants_by_date:
-        return AchievementResult(id="cosmic_meal", unlocked=False)
-
-    date_keys = sorted(merchants_by_date.keys())
-    first_date = datetime.fromisoformat(date_keys[0]).date()
-    last_date = datetime.fromisoformat(date_keys[-1]).date()
-
-    window: list[Any] = []
-    unlock_dt: datetime | None = None
+    window = SlidingDayWindow(5)
+    unlock_ts: int | None = None
     span_start: str | None = None
     span_end: str | None = None
 
-    cur = first_date
-    while cur <= last_date:
-        window.append(cur)
-        if len(window) > 5:
-            window.pop(0)
-
-        if len(window) == 5:
-            used_merchants: set[str] = set()
-            valid = True
-            for d in window:
-                ds = d.isoformat()
-                todays_merchants = merchants_by_date.get(ds, [])
-                if not todays_merchants:
-                    valid = False
-                    break
-                for mer in todays_merchants:
-                    if mer in used_merchants:
-                        valid = False
-                        break
-                    used_merchants.add(mer)
-                if not valid:
-                    break
-
-            if valid:
-                span_start = window[0].isoformat()
-                span_end = window[-1].isoformat()
-                for rec in reversed(ctx.records_sorted_by_time):
-                    dt = rec["__dt"]
-                    if dt.date().isoformat() == span_end:
-                        unlock_dt = dt
-                        break
-                break
-
-        cur += timedelta(days=1)
+    for entry in ctx.days:
+        # 没有非空商户名的日期与没有记录的日期一样，会打断连续的五天
+        if not entry.merchants:
+            window.clear()
+            continue
+        if window.push(entry, entry.merchants, entry.merchant_visits - len(entry.merchants)):
+            span_start = window.first.date
+            span_end = entry.date
+            unlock_ts = entry.last_ts
+            break
 
     return AchievementResult(
         id="cosmic_meal",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
         extra={"start_date": span_start, "end_date": span_end}
-        if unlock_dt is not None and span_start is not None and span_end is not None
+        if unlock_ts is not None and span_start is not None and span_end is not None
         else None,
     )
 
@@ -561,43 +655,41 @@ def ach_cosmic_meal(ctx: AchContext) -> AchievementResult:
 def ach_my_turn(ctx: AchContext) -> AchievementResult:
     """我的回合：2 分钟内连续刷卡 2 次。"""
 
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     interval_seconds: float | None = None
 
-    prev_dt: datetime | None = None
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if prev_dt is not None:
-            delta = (dt - prev_dt).total_seconds()
+    prev_ts: int | None = None
+    for ts in ctx.timestamps:
+        if prev_ts is not None:
+            delta = float(ts - prev_ts)
             if 0 < delta <= 120:
-                unlock_dt = dt
+                unlock_ts = ts
                 interval_seconds = delta
                 break
-        prev_dt = dt
+        prev_ts = ts
 
     return AchievementResult(
         id="my_turn",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"interval_seconds": interval_seconds} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"interval_seconds": interval_seconds} if unlock_ts is not None else None,
     )
 
 
 def ach_edge_runner(ctx: AchContext) -> AchievementResult:
     """边缘行者：在任意小时的 59 分 59 秒完成交易。"""
 
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
 
-    for rec in ctx.records_sorted_by_time:
-        dt: datetime = rec["__dt"]
-        if dt.minute == 59 and dt.second == 59:
-            unlock_dt = dt
+    for ts in ctx.timestamps:
+        if ts % 3600 == 3599:
+            unlock_ts = ts
             break
 
     return AchievementResult(
         id="edge_runner",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
         extra=None,
     )
 
@@ -605,64 +697,58 @@ def ach_edge_runner(ctx: AchContext) -> AchievementResult:
 def ach_error_404(ctx: AchContext) -> AchievementResult:
     """Error 404：单笔消费金额恰为 404 元（含 4.04 / 40.4 / 404）。"""
 
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     amount_value: float | None = None
 
     targets = {404, 4040, 40400}
 
-    for rec in ctx.records_sorted_by_time:
-        amount = float(rec.get("amount", 0.0))
-        cents = int(round(amount * 100))
+    for ts, cents in zip(ctx.timestamps, ctx.cents):
         if cents in targets:
-            unlock_dt = rec["__dt"]
-            amount_value = amount
+            unlock_ts = ts
+            amount_value = cents / 100
             break
 
     return AchievementResult(
         id="error_404",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"amount": amount_value} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"amount": amount_value} if unlock_ts is not None else None,
     )
 
 
 def ach_hello_world(ctx: AchContext) -> AchievementResult:
     """Hello World：在这一年消费过（记录时间为第一笔消费）。"""
 
-    if not ctx.records_sorted_by_time:
+    if not ctx.timestamps:
         return AchievementResult(id="hello_world", unlocked=False)
 
-    first_dt: datetime = ctx.records_sorted_by_time[0]["__dt"]
-
     return AchievementResult(
         id="hello_world",
         unlocked=True,
-        unlocked_at=_format_dt(first_dt),
-        extra={"first_date": first_dt.date().isoformat()},
+        unlocked_at=format_minute(ctx.timestamps[0]),
+        extra={"first_date": ctx.record_dates[0]},
     )
 
 
 def ach_pi(ctx: AchContext) -> AchievementResult:
     """PI：单笔消费金额恰为 314 元（含 3.14 / 31.4 / 314）。"""
 
-    unlock_dt: datetime | None = None
+    unlock_ts: int | None = None
     amount_value: float | None = None
 
     targets = {314, 3140, 31400}
 
-    for rec in ctx.records_sorted_by_time:
-        amount = float(rec.get("amount", 0.0))
-        cents = int(round(amount * 100))
+    for ts, cents in zip(ctx.timestamps, ctx.cents):
         if cents in targets:
-            unlock_dt = rec["__dt"]
-            amount_value = amount
+            unlock_ts = ts
+            amount_value = cents / 100
             break
 
     return AchievementResult(
         id="pi",
-        unlocked=unlock_dt is not None,
-        unlocked_at=_format_dt(unlock_dt),
-        extra={"amount": amount_value} if unlock_dt is not None else None,
+        unlocked=unlock_ts is not None,
+        unlocked_at=format_minute(unlock_ts),
+        extra={"amount": amount_value} if unlock_ts is not None else None,
     )
 
 
@@ -675,14 +761,14 @@ def ach_secure_call(ctx: AchContext) -> AchievementResult:
 
     unlocked = not ctx.used_default_password
 
-    unlock_dt: datetime | None = None
-    if unlocked and ctx.records_sorted_by_time:
-        unlock_dt = ctx.records_sorted_by_time[0]["__dt"]
+    unlock_ts: int | None = None
+    if unlocked and ctx.timestamps:
+        unlock_ts = ctx.timestamps[0]
 
     return AchievementResult(
         id="secure_call",
         unlocked=unlocked,
-        unlocked_at=_format_dt(unlock_dt),
+        unlocked_at=format_minute(unlock_ts),
         extra=None,
     )
 
@@ -694,26 +780,18 @@ def ach_noticed(ctx: AchContext) -> AchievementResult:
     if not suffix:
         return AchievementResult(id="noticed", unlocked=False)
 
-    total_amount = 0.0
-    for rec in ctx.records:
-        try:
-            total_amount += float(rec.get("amount", 0.0))
-        except (TypeError, ValueError):
-            continue
-
-    total_cents = int(round(total_amount * 100))
+    total_cents = sum(ctx.cents)
+    total_amount = total_cents / 100
     unit_cents = suffix * 100
 
     unlocked = total_cents > 0 and unit_cents > 0 and total_cents % unit_cents == 0
 
-    last_dt: datetime | None = (
-        ctx.records_sorted_by_time[-1]["__dt"] if unlocked and ctx.records_sorted_by_time else None
-    )
+    last_ts: int | None = ctx.timestamps[-1] if unlocked and ctx.timestamps else None
 
     return AchievementResult(
         id="noticed",
         unlocked=unlocked,
-        unlocked_at=_format_dt(last_dt) if last_dt is not None else None,
+        unlocked_at=format_minute(last_ts) if last_ts is not None else None,
         extra={"total_amount": total_amount},
     )
 
@@ -745,22 +823,88 @@ CHECKERS = [
 ]
 
 
-def evaluate_achievements(
-    records: list[dict],
-    student_id: str | None = None,
-    used_default_password: bool | None = None,
-) -> dict[str, dict[str, Any]]:
-    """对给定记录计算所有成就状态，返回适合注入前端的字典。"""
+def parse_student_id_suffix(student_id: str | None) -> int | None:
+    """取学号后四位数字，不满足时返回 None。"""
+
+    if student_id:
+        s = student_id.strip()
+        if len(s) >= 4 and s[-4:].isdigit():
+            return int(s[-4:])
+    return None
 
-    ctx = build_context(records, student_id=student_id, used_default_password=used_default_password)
-    result: dict[str, dict[str, Any]] = {}
 
-    for checker in CHECKERS:
-        ach = checker(ctx)
-        result[ach.id] = {
+def to_ach_state(results: list[AchievementResult]) -> dict[str, dict[str, Any]]:
+    """将成就结果转换为适合注入前端的字典。"""
+
+    return {
+        ach.id: {
             "unlocked": ach.unlocked,
             "unlocked_at": ach.unlocked_at,
             "extra": ach.extra or {},
         }
+        for ach in results
+    }
+
+
+def evaluate_achievements_reference(
+    records: SpendRecords,
+    student_id: str | None = None,
+    used_default_password: bool | None = None,
+    order: Sequence[int] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """逐个运行 CHECKERS 计算成就状态。
+
+    每个成就各自扫描记录，写法直观，作为 achievement_rules 中规则的参考实现，用于核对结果。
+    """
+
+    ctx = build_context(records, student_id=student_id, used_default_password=used_default_password, order=order)
+    return to_ach_state([checker(ctx) for checker in CHECKERS])
+
+
+def evaluate_achievements(
+    records: SpendRecords,
+    student_id: str | None = None,
+    used_default_password: bool | None = None,
+    order: Sequence[int] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """对给定记录计算所有成就状态，返回适合注入前端的字典。
 
-    return result
+    由 achievement_rules 中编译好的规则在一次遍历中完成，结果与 evaluate_achievements_reference 相同。
+    order 为按时间排序的记录下标（如 ReportAggregate.order），可省去一次排序。
+    """
+
+    # achievement_rules 依赖本模块中的 AchievementResult 等，只能在这里导入
+    from achievement_rules import DEFAULT_PLAN
+
+    results = DEFAULT_PLAN.evaluate(
+        records,
+        order=order,
+        student_id_suffix=parse_student_id_suffix(student_id),
+        used_default_password=used_default_password,
+    )
+    return to_ach_state(results)
+
+
+def evaluate_achievements_incremental(
+    records: SpendRecords,
+    state: dict[str, Any] | None = None,
+    student_id: str | None = None,
+    used_default_password: bool | None = None,
+    order: Sequence[int] | None = None,
+) -> tuple[dict[str, dict[str, Any]], dict[str, Any]]:
+    """与 evaluate_achievements 相同，但在上次保存的状态上续算，返回 (成就状态, 新状态)。
+
+    新状态可以序列化为 JSON 保存，下次连同全部记录一起传回，只有比上次最后一笔更晚的记录会被处理；
+    state 为 None 或与这批记录对不上时从头计算。
+    """
+
+    from achievement_rules import DEFAULT_PLAN
+
+    results, new_state = DEFAULT_PLAN.evaluate_incremental(
+        records,
+        state,
+        order=order,
+        student_id_suffix=parse_student_id_suffix(student_id),
+        used_default_password=used_default_password,
+    )
+    return to_ach_state(results), new_state
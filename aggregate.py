@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import queue
+import threading
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from operator import itemgetter
+
+from record_store import SpendRecords
+from txtime import format_time
+
+
+@dataclass
+class ReportAggregate:
+    """生成报告所需的聚合结果，金额均以分为单位。
+
+    order 为按交易时间排序后的记录下标，CSV 等需要按时间输出的地方直接使用，无需再排序。
+    """
+
+    records: SpendRecords = field(default_factory=SpendRecords)
+    daily_stats: dict = field(default_factory=dict)
+    merchant_cents: dict[str, int] = field(default_factory=dict)
+    merchant_counts: dict[str, int] = field(default_factory=dict)
+    total_cents: int = 0
+    order: array = field(default_factory=lambda: array("q"))
+
+    @property
+    def total_amount(self) -> float:
+        return self.total_cents / 100
+
+
+def aggregate_records(records: SpendRecords) -> ReportAggregate:
+    """单次遍历记录，同时得到商户金额与次数、总金额、每天统计和按时间排序的下标。
+
+    daily_stats 的结构见 build_daily_stats。金额在分上累加，输出时才换算为元。
+    """
+
+    timestamps = records.timestamps
+    cents_col = records.cents
+    merchant_ids = records.merchant_ids
+    merchants = records.merchants
+    fields = records.time_fields()
+    # 按 epoch 天号分组：[count, cents, {商户编号: 分}, [记录下标]]
+    days: dict[int, list] = {}
+    last_day = None
+    day_stats: list = []
+
+    # 同一区间内的记录按天连续排列，天号不变时不必再查 days
+    for i, day, cents, mid in zip(range(len(timestamps)), fields.days, cents_col, merchant_ids):
+        if day != last_day:
+            day_stats = days.get(day)
+            if day_stats is None:
+                day_stats = days[day] = [0, 0, {}, []]
+            last_day = day
+        day_stats[0] += 1
+        day_stats[1] += cents
+        day_merchants = day_stats[2]
+        day_merchants[mid] = day_merchants.get(mid, 0) + cents
+        day_stats[3].append(i)
+
+    # 商户次数用 C 实现的 Counter 统计；商户金额由每天的商户金额汇总，不再逐条累加
+    counts = [0] * len(merchants)
+    for mid, cnt in Counter(merchant_ids).items():
+        counts[mid] = cnt
+    totals = [0] * len(merchants)
+
+    # 将 merchants 从 dict 压平成列表，按金额从高到低排序；txs 按时间排序。
+    # 每天的下标排好序后按天号拼接，就是全部记录按时间的稳定排序结果
+    daily_stats: dict[str, dict[str, dict]] = {}
+    for day, (count, day_cents, day_merchants, indices) in days.items():
+        date_str = fields.dates[indices[0]]
+        for mid, cents in day_merchants.items():
+            totals[mid] += cents
+        if len(day_merchants) > 1:
+            merchant_items = sorted(day_merchants.items(), key=itemgetter(1), reverse=True)
+        else:
+            merchant_items = day_merchants.items()
+        merchants_list = [{"name": merchants[mid], "amount": cents / 100} for mid, cents in merchant_items]
+        if len(indices) > 1:
+            indices.sort(key=timestamps.__getitem__)
+        txs = [
+            {
+                "time": format_time(timestamps[i]),
+                "mername": merchants[merchant_ids[i]],
+                "amount": cents_col[i] / 100,
+            }
+            for i in indices
+        ]
+
+        daily_stats.setdefault(date_str[:4], {})[date_str] = {
+            "count": count,
+            "amount": day_cents / 100,
+            "merchants": merchants_list,
+            "txs": txs,
+        }
+
+    order = array("q")
+    for day in sorted(days):
+        order.extend(days[day][3])
+
+    return ReportAggregate(
+        records=records,
+        daily_stats=daily_stats,
+        merchant_cents=dict(zip(merchants, totals)),
+        merchant_counts=dict(zip(merchants, counts)),
+        total_cents=sum(totals),
+        order=order,
+    )
+
+
+def build_daily_stats(records: SpendRecords) -> dict:
+    """按年和日期聚合每天的用餐次数与金额及商户明细。
+
+    返回结构大致为：
+    {
+        "2025": {
+            "2025-03-01": {"count": 3, "amount": 25.5, "merchants": [{"name": "一食堂", "amount": 10.0}, ...]},
+            ...
+        },
+        ...
+    }
+    """
+
+    return aggregate_records(records).daily_stats
+
+
+def merge_aggregates(parts: list[ReportAggregate]) -> ReportAggregate:
+    """按给定顺序合并各日期区间的聚合结果。
+
+    各区间的日期互不重叠，因此每天的统计可以直接拼接，按时间排序的下标也只需加上偏移量后拼接，
+    结果与对全部记录调用 aggregate_records 一致；万一同一天出现在多个区间里，
+    或区间没有按时间先后排列，则退回对全部记录重新统计。
+    """
+
+    merged = ReportAggregate()
+    totals: dict[str, int] = defaultdict(int)
+    counts: dict[str, int] = defaultdict(int)
+    overlapped = False
+    last_ts: int | None = None
+
+    for part in parts:
+        offset = len(merged.records)
+        if part.order:
+            first_ts = part.records.timestamps[part.order[0]]
+            if last_ts is not None and first_ts < last_ts:
+                overlapped = True
+            last_ts = part.records.timestamps[part.order[-1]]
+        if not overlapped:
+            merged.order.extend(array("q", (i + offset for i in part.order)) if offset else part.order)
+
+        merged.records.extend(part.records)
+        merged.total_cents += part.total_cents
+        for name, cents in part.merchant_cents.items():
+            totals[name] += cents
+        for name, cnt in part.merchant_counts.items():
+            counts[name] += cnt
+        for year, days in part.daily_stats.items():
+            year_stats = merged.daily_stats.setdefault(year, {})
+            if not overlapped and any(d in year_stats for d in days):
+                overlapped = True
+            year_stats.update(days)
+
+    if overlapped:
+        return aggregate_records(merged.records)
+    merged.merchant_cents = dict(totals)
+    merged.merchant_counts = dict(counts)
+    return merged
+
+
+class AggregatingConsumer:
+    """在后台线程中对陆续下载完成的日期区间做聚合，让统计与网络请求重叠进行。
+
+    submit 可以在任意线程、以任意顺序调用；finish 按最终采用的区间顺序合并结果。
+    """
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue = queue.Queue()
+        self._parts: dict[tuple[str, str], ReportAggregate] = {}
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            rng, records = item
+            if self._error is not None:
+                continue
+            try:
+                self._parts[rng] = aggregate_records(records)
+            except BaseException as exc:  # noqa: BLE001
+                self._error = exc
+
+    def submit(self, rng: tuple[str, str], records: SpendRecords) -> None:
+        self._queue.put((rng, records))
+
+    def close(self) -> None:
+        """停止后台线程，可重复调用。"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def finish(self, ranges: list[tuple[str, str]]) -> ReportAggregate:
+        self.close()
+        if self._error is not None:
+            raise self._error
+        return merge_aggregates([self._parts[r] for r in ranges])
@@ -0,0 +1,33 @@
+"""缓存文件的原子写入。"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Callable, TextIO
+
+
+def atomic_write(path: str, write: Callable[[TextIO], None], newline: str | None = None) -> bool:
+    """在 path 所在目录先写临时文件，写完再用 os.replace 换上，多个进程同时运行也不会读到写了一半的文件。
+
+    write 接收以 UTF-8 打开的临时文件并写入内容。目录不存在时自动创建；写入失败时删掉临时文件并返回 False，
+    调用方一般把失败当作这次没有缓存。
+    """
+
+    directory = os.path.dirname(path) or "."
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    except OSError:
+        return False
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,85 @@
+"""
+成就计算的基准测试
+
+用替身服务器的数据生成函数（见 stub_server.py）在进程内合成若干年的消费记录，分别用手写的 CHECKERS
+（evaluate_achievements_reference）和编译后的规则（evaluate_achievements）计算成就，核对两者结果一致，
+并比较耗时。
+
+用法：
+    python bench/bench_achievements.py --years 1 4 --per-day 3 12 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from stub_server import StubConfig, trades_for_day  # noqa: E402
+
+
+def synth_trades(years: int, per_day: float) -> list[dict]:
+    config = StubConfig(per_day=per_day)
+    day = date(2026 - years, 1, 1)
+    trades: list[dict] = []
+    while day <= date(2025, 12, 31):
+        trades.extend(trades_for_day(day, config))
+        day += timedelta(days=1)
+    return trades
+
+
+def best_of(repeat: int, func) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="成就计算基准测试")
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--per-day", type=float, nargs="+", default=[3.0, 12.0])
+    parser.add_argument("--repeat", type=int, default=5, help="每种实现运行几次，取最快的一次")
+    parser.add_argument("--student-id", default="1120251234")
+    args = parser.parse_args()
+
+    import achievements
+    import main as main_mod
+    from aggregate import aggregate_records
+
+    print(f"{'years':>5} {'per_day':>7} {'records':>7} {'checkers':>9} {'rules':>9} {'speedup':>7}")
+    for years in args.years:
+        for per_day in args.per_day:
+            records = main_mod.to_spend_records(synth_trades(years, per_day))
+            order = aggregate_records(records).order
+
+            expected = achievements.evaluate_achievements_reference(records, args.student_id, False, order=order)
+            actual = achievements.evaluate_achievements(records, args.student_id, False, order=order)
+            if actual != expected:
+                diff = sorted(k for k in expected if actual.get(k) != expected[k])
+                raise SystemExit(f"结果不一致: {', '.join(diff)}")
+
+            checkers = best_of(
+                args.repeat,
+                lambda: achievements.evaluate_achievements_reference(records, args.student_id, False, order=order),
+            )
+            rules = best_of(
+                args.repeat,
+                lambda: achievements.evaluate_achievements(records, args.student_id, False, order=order),
+            )
+            print(
+                f"{years:>5} {per_day:>7.1f} {len(records):>7} {checkers * 1000:>7.1f}ms "
+                f"{rules * 1000:>7.1f}ms {checkers / rules:>6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+柱状图的基准测试
+
+合成若干个商户的金额与次数，像生成报告时一样先后画金额图和次数图，分别统计排版、绘制、PNG 编码的耗时，
+以及文字尺寸缓存（charts.text_bbox）的命中情况。每轮开始前清空缓存，模拟一次全新的运行。
+batch 列为用 ChartBatch 在后台线程中渲染两张图并写出文件的总耗时；绘制文字时持有 GIL，与依次渲染相近。
+svg 列为同样的两张图排版后输出为 SVG 的耗时，png/svg 两列为两张图的文件大小。
+第二张表比较 charts.EXPORT_PROFILES 中各个输出方案：两张图从排好的版到文件内容（绘制、转换和编码）的耗时与总大小。
+
+用法：
+    python bench/bench_charts.py --merchants 30 300 --repeat 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import charts  # noqa: E402
+
+
+def synth_merchants(count: int, seed: int = 0) -> tuple[list[str], list[float], list[int]]:
+    rng = random.Random(seed)
+    labels = [f"{rng.choice('良中北南')}{i}号窗口·{rng.choice(['面食', '麻辣烫', '快餐', '水果'])}" for i in range(count)]
+    amounts = sorted((round(rng.uniform(1, 3000), 2) for _ in range(count)), reverse=True)
+    counts = sorted((rng.randint(1, 400) for _ in range(count)), reverse=True)
+    return labels, amounts, counts
+
+
+CHARTS = (
+    ("吃饭消费总结", "消费金额（元）", False),
+    ("吃饭次数统计", "消费次数（次）", True),
+)
+
+
+def render_report(
+    labels: list[str], amounts: list[float], counts: list[int], sizes: dict[str, int]
+) -> dict[str, float]:
+    """画出一份报告中的两张图，返回各步骤的耗时（秒），PNG 文件的总大小记在 sizes["png"] 中。"""
+
+    timings = {"layout": 0.0, "draw": 0.0, "encode": 0.0}
+    sizes["png"] = 0
+    for values, (title, xlabel, integer_values) in zip((amounts, counts), CHARTS):
+        start = time.perf_counter()
+        layout = charts.layout_bar_chart(labels, values, title, xlabel, integer_values)
+        laid_out = time.perf_counter()
+        img = charts.draw_layout(layout)
+        drawn = time.perf_counter()
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        encoded = time.perf_counter()
+        sizes["png"] += buf.tell()
+        timings["layout"] += laid_out - start
+        timings["draw"] += drawn - laid_out
+        timings["encode"] += encoded - drawn
+    return timings
+
+
+def render_svg_report(
+    labels: list[str], amounts: list[float], counts: list[int], sizes: dict[str, int]
+) -> float:
+    """把两张图排版后输出为 SVG，返回耗时（秒），总大小（UTF-8 字节数）记在 sizes["svg"] 中。"""
+
+    start = time.perf_counter()
+    sizes["svg"] = 0
+    for values, (title, xlabel, integer_values) in zip((amounts, counts), CHARTS):
+        layout = charts.layout_bar_chart(labels, values, title, xlabel, integer_values)
+        sizes["svg"] += len(charts.render_svg(layout).encode("utf-8"))
+    return time.perf_counter() - start
+
+
+def encode_profiles(
+    labels: list[str], amounts: list[float], counts: list[int], repeat: int
+) -> dict[str, tuple[float, int]]:
+    """各输出方案编码两张图的最短耗时（秒）和总大小（字节）。"""
+
+    layouts = [
+        charts.layout_bar_chart(labels, values, title, xlabel, integer_values)
+        for values, (title, xlabel, integer_values) in zip((amounts, counts), CHARTS)
+    ]
+    results = {}
+    for name in charts.EXPORT_PROFILES:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            size = sum(len(charts.encode_layout(layout, name)) for layout in layouts)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, size)
+    return results
+
+
+def render_batch(labels: list[str], amounts: list[float], counts: list[int], output_dir: str) -> float:
+    start = time.perf_counter()
+    batch = charts.ChartBatch(
+        [
+            charts.BarChartJob(labels, amounts, os.path.join(output_dir, "amount.png"), "吃饭消费总结", "消费金额（元）"),
+            charts.BarChartJob(labels, counts, os.path.join(output_dir, "count.png"), "吃饭次数统计", "消费次数（次）", True),
+        ]
+    )
+    batch.wait()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="柱状图基准测试")
+    parser.add_argument("--merchants", type=int, nargs="+", default=[30, 300])
+    parser.add_argument("--repeat", type=int, default=3, help="每种规模运行几次，取最快的一次")
+    args = parser.parse_args()
+
+    print(
+        f"{'merchants':>9} {'layout':>9} {'draw':>9} {'encode':>9} {'total':>9} {'batch':>9} {'svg':>9} "
+        f"{'png':>8} {'svg':>8} {'hits':>6} {'misses':>6}"
+    )
+    for count in args.merchants:
+        labels, amounts, counts = synth_merchants(count)
+        best: dict[str, float] | None = None
+        sizes: dict[str, int] = {}
+        for _ in range(args.repeat):
+            charts.text_bbox.cache_clear()
+            timings = render_report(labels, amounts, counts, sizes)
+            if best is None or sum(timings.values()) < sum(best.values()):
+                best = timings
+        info = charts.text_bbox.cache_info()
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            batch = float("inf")
+            for _ in range(args.repeat):
+                charts.text_bbox.cache_clear()
+                batch = min(batch, render_batch(labels, amounts, counts, output_dir))
+
+        svg = float("inf")
+        for _ in range(args.repeat):
+            charts.text_bbox.cache_clear()
+            svg = min(svg, render_svg_report(labels, amounts, counts, sizes))
+
+        print(
+            f"{count:>9} {best['layout'] * 1000:>7.1f}ms {best['draw'] * 1000:>7.1f}ms "
+            f"{best['encode'] * 1000:>7.1f}ms {sum(best.values()) * 1000:>7.1f}ms {batch * 1000:>7.1f}ms {svg * 1000:>7.1f}ms "
+            f"{sizes['png'] / 1024:>6.0f}KB {sizes['svg'] / 1024:>6.0f}KB {info.hits:>6} {info.misses:>6}"
+        )
+
+    print()
+    print(f"{'merchants':>9} {'profile':>8} {'encode':>9} {'size':>8}")
+    for count in args.merchants:
+        labels, amounts, counts = synth_merchants(count)
+        for name, (seconds, size) in encode_profiles(labels, amounts, counts, args.repeat).items():
+            print(f"{count:>9} {name:>8} {seconds * 1000:>7.1f}ms {size / 1024:>6.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+拉取阶段的基准测试
+
+在进程内启动替身服务器（见 stub_server.py），用不同的并发数运行 main.fetch_records，
+统计服务器实际收到的请求数、耗时与吞吐量；每种并发数依次测试不带缓存、冷缓存与热缓存三种情况。
+
+用法：
+    python bench/bench_fetch.py --workers 1 3 6 --latency 0.3 --years 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from stub_server import StubConfig, StubServer  # noqa: E402
+
+
+def run_once(main_mod, server: StubServer, begin_date: str, end_date: str, use_async: bool) -> dict:
+    server.stats.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if use_async:
+            import asyncio
+
+            _, aggregate = asyncio.run(
+                main_mod.fetch_records_async("0" * 32, "1120250000", begin_date, end_date)
+            )
+        else:
+            _, aggregate = main_mod.fetch_records("0" * 32, "1120250000", begin_date, end_date)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": server.stats.trade_requests + server.stats.openid_requests,
+        "errors": server.stats.errors,
+        "records": len(aggregate.records),
+        "seconds": elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="拉取阶段基准测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 3, 6])
+    parser.add_argument("--rate", type=float, default=None, help="每秒请求数上限，默认沿用 main.FETCH_RATE")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="响应体发送一半后断开连接的概率")
+    parser.add_argument("--cap", type=int, default=None)
+    parser.add_argument("--per-day", type=float, default=3.0)
+    parser.add_argument("--years", type=int, default=1, help="拉取最近几年（截至 2025 年底）")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="测试 --async 拉取路径")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        cap=args.cap,
+        per_day=args.per_day,
+    )
+    server = StubServer(config).start()
+    # dkykt_api 在导入时读取 DKYKT_BASE，必须在导入 main 之前设置
+    os.environ["DKYKT_BASE"] = server.base_url
+    import dkykt_api
+    import main as main_mod
+
+    # 重试退避缩短，避免错误率测试被等待时间主导
+    dkykt_api.BACKOFF = 0.05
+
+    begin_date = f"{2026 - args.years}-01-01"
+    end_date = "2025-12-31"
+    print(f"替身服务器: {server.base_url}  区间: {begin_date} ~ {end_date}  延迟: {args.latency}s")
+    print(f"{'workers':>7} {'cache':>6} {'requests':>8} {'errors':>6} {'records':>7} {'seconds':>8} {'rec/s':>9}")
+
+    cache_root = tempfile.mkdtemp(prefix="eatbit_bench_")
+    try:
+        for workers in args.workers:
+            main_mod.FETCH_WORKERS = workers
+            if args.rate is not None:
+                main_mod.FETCH_RATE = args.rate
+            main_mod.CACHE_DIR = os.path.join(cache_root, f"w{workers}")
+
+            runs = [("off", False), ("cold", True), ("warm", True)]
+            for label, use_cache in runs:
+                main_mod.USE_CACHE = use_cache
+                r = run_once(main_mod, server, begin_date, end_date, args.use_async)
+                rate = r["records"] / r["seconds"] if r["seconds"] > 0 else float("inf")
+                print(
+                    f"{workers:>7} {label:>6} {r['requests']:>8} {r['errors']:>6} "
+                    f"{r['records']:>7} {r['seconds']:>8.2f} {rate:>9.0f}"
+                )
+    finally:
+        server.stop()
+        shutil.rmtree(cache_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
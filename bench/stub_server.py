@@ -0,0 +1,273 @@
+"""
+dkykt.info.bit.edu.cn 的本地替身服务器
+
+模拟程序用到的两个接口，便于离线测试与性能调优：
+- GET  /home/openDingTalkHomePage：带 JSESSIONID 时返回 302，Location 中带 openid；
+- POST /selftrade/queryCardSelfTradeList：为任意日期范围生成确定性的合成消费记录。
+
+可以配置响应延迟、5xx 错误率、单次返回条数上限与单次查询的最大天数。
+
+用法：
+    python bench/stub_server.py --port 8765 --latency 0.2 --error-rate 0.05 --cap 300
+然后以环境变量 DKYKT_BASE=http://127.0.0.1:8765 运行 main.py。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MERCHANTS = [
+    "良一一层",
+    "良一二层",
+    "良二一层",
+    "良四二层",
+    "良七清真",
+    "中关村食堂",
+    "中关村超市",
+    "浴室",
+    "开水房",
+    "校医院",
+    "咖啡厅",
+]
+
+STUB_OPENID = "stub" + "0" * 90 + "2025" + "0" * 20
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.0
+    # 在 latency 基础上附加的均匀随机延迟上限
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    # 发出响应头和一半响应体后断开连接的概率，模拟下载途中断网
+    drop_rate: float = 0.0
+    # 单次查询最多返回的条数，None 表示不限
+    cap: int | None = None
+    # 单次查询允许的最大天数，超出时返回错误，None 表示不限
+    max_days: int | None = None
+    # 平均每天的交易笔数
+    per_day: float = 3.0
+    seed: int = 0
+
+
+@dataclass
+class StubStats:
+    openid_requests: int = 0
+    trade_requests: int = 0
+    errors: int = 0
+    trades_served: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.openid_requests = self.trade_requests = self.errors = self.trades_served = 0
+
+
+def trades_for_day(day: date, config: StubConfig) -> list[dict]:
+    """为某一天生成确定性的合成交易记录（按时间倒序，与真实接口一致）。"""
+
+    rng = random.Random(f"{config.seed}:{day.isoformat()}")
+    count = max(0, int(rng.gauss(config.per_day, 1.5) + 0.5))
+    trades = []
+    for _ in range(count):
+        hour = rng.choice([7, 8, 11, 12, 13, 17, 18, 19, 21])
+        ts = f"{day.isoformat()} {hour:02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+        amount = -rng.randint(100, 3000) / 100
+        trades.append(
+            {
+                "txdate": ts,
+                "mername": rng.choice(MERCHANTS),
+                "txamt": f"{amount:.2f}",
+                "cardbalance": f"{rng.randint(0, 50000) / 100:.2f}",
+                "txname": "消费",
+            }
+        )
+    # 偶尔有一笔充值
+    if rng.random() < 0.03:
+        trades.append(
+            {
+                "txdate": f"{day.isoformat()} 10:00:00",
+                "mername": "圈存机",
+                "txamt": "100.00",
+                "cardbalance": "0.00",
+                "txname": "充值",
+            }
+        )
+    trades.sort(key=lambda t: t["txdate"], reverse=True)
+    return trades
+
+
+def _make_handler(config: StubConfig, stats: StubStats) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:  # noqa: A002
+            pass
+
+        def _delay(self) -> None:
+            wait = config.latency + (random.uniform(0, config.jitter) if config.jitter else 0.0)
+            if wait > 0:
+                time.sleep(wait)
+
+        def _send(self, status: int, body: bytes, content_type: str, extra: dict | None = None) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _has_session(self) -> bool:
+            return "JSESSIONID=" in self.headers.get("Cookie", "")
+
+        def do_GET(self) -> None:  # noqa: N802
+            url = urlparse(self.path)
+            if url.path != "/home/openDingTalkHomePage":
+                self._send(404, b"not found", "text/plain")
+                return
+            stats.add(openid_requests=1)
+            self._delay()
+            if not self._has_session():
+                # 登录失效时真实接口不会重定向
+                self._send(200, b"<html>login</html>", "text/html")
+                return
+            idserial = (parse_qs(url.query).get("idserial") or [""])[0]
+            location = f"/home/index?openid={STUB_OPENID}&idserial={idserial}"
+            self._send(302, b"", "text/html", {"Location": location})
+
+        def do_POST(self) -> None:  # noqa: N802
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length)
+            if url.path != "/selftrade/queryCardSelfTradeList":
+                self._send(404, b"not found", "text/plain")
+                return
+            stats.add(trade_requests=1)
+            self._delay()
+
+            if not self._has_session():
+                self._send(200, b"<html>login</html>", "text/html")
+                return
+            if config.error_rate and random.random() < config.error_rate:
+                stats.add(errors=1)
+                self._send(502, b"Bad Gateway", "text/plain")
+                return
+
+            try:
+                payload = json.loads(raw)
+                begin = date.fromisoformat(payload["beginDate"])
+                end = date.fromisoformat(payload["endDate"])
+            except (ValueError, KeyError, TypeError):
+                body = json.dumps({"success": False, "message": "参数错误"}, ensure_ascii=False)
+                self._send(200, body.encode("utf-8"), "application/json;charset=UTF-8")
+                return
+
+            if config.max_days is not None and (end - begin).days + 1 > config.max_days:
+                body = json.dumps({"success": False, "message": "查询范围过大"}, ensure_ascii=False)
+                self._send(200, body.encode("utf-8"), "application/json;charset=UTF-8")
+                return
+
+            result: list[dict] = []
+            day = end
+            while day >= begin:
+                result.extend(trades_for_day(day, config))
+                day -= timedelta(days=1)
+            if config.cap is not None:
+                result = result[: config.cap]
+            stats.add(trades_served=len(result))
+
+            body = json.dumps({"success": True, "resultData": result}, ensure_ascii=False).encode("utf-8")
+            if config.drop_rate and random.random() < config.drop_rate:
+                stats.add(errors=1)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                return
+            self._send(200, body, "application/json;charset=UTF-8")
+
+    return Handler
+
+
+class StubServer:
+    """在后台线程中运行的替身服务器，也可以用作上下文管理器。"""
+
+    def __init__(self, config: StubConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config or StubConfig()
+        self.stats = StubStats()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self.config, self.stats))
+        self._httpd.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="dkykt 本地替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="附加随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 502 的概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="响应体发送一半后断开连接的概率")
+    parser.add_argument("--cap", type=int, default=None, help="单次查询返回条数上限")
+    parser.add_argument("--max-days", type=int, default=None, help="单次查询允许的最大天数")
+    parser.add_argument("--per-day", type=float, default=3.0, help="平均每天交易笔数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        cap=args.cap,
+        max_days=args.max_days,
+        per_day=args.per_day,
+        seed=args.seed,
+    )
+    server = StubServer(config, host=args.host, port=args.port)
+    print(f"替身服务器已启动: {server.base_url}")
+    print(f"运行 main.py 前请设置环境变量 DKYKT_BASE={server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,606 @@
+"""报告中横向柱状图的排版与绘制。
+
+画一张图分两步：layout_bar_chart 先算出标题、坐标轴、刻度、柱子和各处文字的位置，得到 ChartLayout；
+draw_layout 再按顺序一次画完。排版需要的文字尺寸由 text_bbox 测量，结果按 (字号, 文字) 缓存在
+有上限的 LRU 缓存中，各张图共用，金额图和次数图里同样的商户名只测量一次；
+text_bbox.cache_info() 可以查看命中次数。
+
+字体文件在每个进程中只查找一次（resolve_font_path），找到的路径记在 set_font_hint 指定的小文件里，
+下次运行直接打开，不必再逐个尝试 FONT_CANDIDATES。互不依赖的几张图可以交给 ChartBatch
+在后台线程中渲染，调用方继续做别的事，需要文件时再 wait()。Pillow 绘制文字时不释放 GIL，
+几张图一起渲染并不比依次渲染快，好处只在于不占用调用方的线程。
+
+商户很多时，图片高度随柱子数量线性增长。top_n 只保留前若干个柱子，其余合并为一个“其他”柱子；
+page_size 把柱子分成固定高度的若干页，每页单独画、单独保存，同一时间只有一页图片在内存中，
+各页共用同一个横轴刻度，柱子长度可以互相比较。
+
+同一份 ChartLayout 也可以由 render_svg 输出为 SVG 文字：不需要栅格化文字和编码位图，文件也小得多，
+得到的 <svg> 元素可以直接嵌入 HTML。
+
+图表的编码方式由 EXPORT_PROFILES 中的输出方案决定：default 为 24 位 RGB 的 PNG；fast 与 small 先转为调色板图像
+（图中只有白、黑、文字边缘的灰色和柱子的颜色），再分别以低压缩率和最优压缩保存 PNG；web 为无损 WebP；
+svg 为矢量图。调色板的转换是无损的，fast、small、web 解码后的像素与 default 完全相同。
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import Mapping, Sequence, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from atomic_file import atomic_write
+
+FONT_CANDIDATES = [
+    "simhei.ttf",
+    "msyh.ttc",
+    "msyh.ttf",
+    "simsun.ttc",
+    "simsun.ttf",
+]
+
+_FONT_CACHE: dict[int, ImageFont.ImageFont] = {}
+_FONT_LOCK = threading.Lock()
+_UNRESOLVED = object()
+_font_path: object = _UNRESOLVED
+_font_hint_path: str | None = None
+
+
+def set_font_hint(path: str | None) -> None:
+    """指定记录字体路径的文件；需要在第一次加载字体之前调用。"""
+    global _font_hint_path
+    _font_hint_path = path
+
+
+def resolve_font_path() -> str | None:
+    """FONT_CANDIDATES 中第一个可用字体的文件路径，都不可用时为 None。每个进程只查找一次。"""
+
+    global _font_path
+    with _FONT_LOCK:
+        if _font_path is _UNRESOLVED:
+            _font_path = _find_font_path()
+        return _font_path
+
+
+def _find_font_path() -> str | None:
+    hinted = _read_font_hint()
+    if hinted is not None and os.path.isfile(hinted):
+        return hinted
+
+    for name in FONT_CANDIDATES:
+        try:
+            font = ImageFont.truetype(name, 10)
+        except OSError:
+            continue
+        # truetype 在系统字体目录中找到文件时，path 是找到的完整路径
+        path = font.path if isinstance(font.path, str) else name
+        _write_font_hint(path)
+        return path
+    return None
+
+
+def _read_font_hint() -> str | None:
+    if _font_hint_path is None:
+        return None
+    try:
+        with open(_font_hint_path, "r", encoding="utf-8") as f:
+            hint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # 候选列表改过以后，旧的记录不再可信
+    if not isinstance(hint, dict) or hint.get("candidates") != FONT_CANDIDATES:
+        return None
+    path = hint.get("path")
+    return path if isinstance(path, str) else None
+
+
+def _write_font_hint(path: str) -> None:
+    if _font_hint_path is None:
+        return
+    # 记录失败只是下次需要重新查找
+    hint = {"candidates": FONT_CANDIDATES, "path": path}
+    atomic_write(_font_hint_path, lambda f: json.dump(hint, f, ensure_ascii=False))
+
+
+def load_font(size: int) -> ImageFont.ImageFont:
+    """按字号加载 resolve_font_path 找到的中文字体，没有可用字体时退回 Pillow 的默认字体。可在多个线程中调用。"""
+
+    font = _FONT_CACHE.get(size)
+    if font is not None:
+        return font
+
+    path = resolve_font_path()
+    font = None
+    if path is not None:
+        try:
+            font = ImageFont.truetype(path, size)
+        except OSError:
+            font = None
+    if font is None:
+        font = ImageFont.load_default()
+    return _FONT_CACHE.setdefault(size, font)
+
+
+# 只用来测量文字的画布；测量结果与在任意 RGB 图上调用 textbbox 相同
+_MEASURE = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+TEXT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_bbox(size: int, text: str) -> tuple[float, float, float, float]:
+    """文字以左上角为原点绘制时的外框 (left, top, right, bottom)。"""
+    return _MEASURE.textbbox((0, 0), text, font=load_font(size))
+
+
+@dataclass
+class TextItem:
+    x: float
+    y: float
+    text: str
+    size: int
+    fill: str = "black"
+
+
+@dataclass
+class RectItem:
+    box: tuple[float, float, float, float]
+    fill: tuple[int, int, int] | str
+
+
+@dataclass
+class LineItem:
+    points: tuple[float, float, float, float]
+    fill: str = "black"
+    width: int = 1
+
+
+ChartItem = Union[TextItem, RectItem, LineItem]
+
+
+@dataclass
+class ChartLayout:
+    """排好版的一张图：画布尺寸和按绘制顺序排列的各个元素。"""
+
+    width: int
+    height: int
+    items: list[ChartItem] = field(default_factory=list)
+    background: str = "white"
+
+
+@dataclass(frozen=True)
+class BarChartStyle:
+    width: int = 1200
+    left_margin: int = 260
+    right_margin: int = 160
+    top_margin: int = 80
+    bottom_margin: int = 80
+    bar_height: int = 24
+    bar_spacing: int = 12
+    min_height: int = 400
+    title_size: int = 28
+    label_size: int = 18
+    value_size: int = 16
+    axis_size: int = 16
+    num_ticks: int = 5
+    bar_color: tuple[int, int, int] = (51, 122, 183)
+
+
+DEFAULT_STYLE = BarChartStyle()
+
+
+def layout_bar_chart(
+    labels: Sequence[str],
+    values: Sequence[float],
+    title: str,
+    xlabel: str,
+    integer_values: bool = False,
+    style: BarChartStyle = DEFAULT_STYLE,
+    max_value: float | None = None,
+) -> ChartLayout:
+    """计算横向柱状图中每个元素的位置，不进行任何绘制。
+
+    max_value 为横轴的最大值，不传时取 values 中的最大值；分页时各页传入同一个值，刻度保持一致。
+    """
+
+    s = style
+    total_bar_area = len(labels) * (s.bar_height + s.bar_spacing) - s.bar_spacing
+    height = max(s.min_height, s.top_margin + total_bar_area + s.bottom_margin)
+    layout = ChartLayout(s.width, height)
+    items = layout.items
+
+    # 标题，水平居中
+    left, _, right, _ = text_bbox(s.title_size, title)
+    items.append(TextItem((s.width - (right - left)) / 2, 20, title, s.title_size))
+
+    # x 轴下面的标签
+    left, _, right, _ = text_bbox(s.axis_size, xlabel)
+    items.append(TextItem((s.width - (right - left)) / 2, height - s.bottom_margin + 45, xlabel, s.axis_size))
+
+    # 我们用 val / max_val * usable_width 计算柱子长度, 需要 max_val 大于 0
+    if max_value is not None:
+        max_val = max_value
+    else:
+        max_val = max(values) if values else 0.0
+    if max_val <= 0:
+        return layout
+
+    # x 轴横线
+    usable_width = s.width - s.left_margin - s.right_margin
+    axis_y = height - s.bottom_margin + 10
+    items.append(LineItem((s.left_margin, axis_y, s.width - s.right_margin, axis_y)))
+
+    # x 轴坐标
+    for i in range(s.num_ticks + 1):
+        x = s.left_margin + usable_width * i / s.num_ticks
+        items.append(LineItem((x, axis_y, x, axis_y + 5)))    # 竖直刻度线
+        tick_val = max_val * i / s.num_ticks
+        tick_str = f"{tick_val:.0f}" if max_val >= 10 else f"{tick_val:.2f}"
+        left, _, right, _ = text_bbox(s.axis_size, tick_str)
+        items.append(TextItem(x - (right - left) / 2, axis_y + 8, tick_str, s.axis_size))
+
+    # 商家名和柱子
+    current_y = s.top_margin
+    for label, value in zip(labels, values):
+        bar_len = 0 if value <= 0 else value / max_val * usable_width
+        y0 = current_y
+        items.append(RectItem((s.left_margin, y0, s.left_margin + bar_len, y0 + s.bar_height), s.bar_color))
+
+        left, top, right, bottom = text_bbox(s.label_size, label)
+        label_x = s.left_margin - 10 - (right - left)
+        items.append(TextItem(label_x, y0 + (s.bar_height - (bottom - top)) / 2, label, s.label_size))
+
+        value_str = str(int(round(value))) if integer_values else f"{value:.2f}"
+        _, top, _, bottom = text_bbox(s.value_size, value_str)
+        value_x = s.left_margin + bar_len + 8
+        items.append(TextItem(value_x, y0 + (s.bar_height - (bottom - top)) / 2, value_str, s.value_size))
+
+        current_y += s.bar_height + s.bar_spacing
+
+    return layout
+
+
+def draw_layout(layout: ChartLayout) -> Image.Image:
+    """按排好的版一次画出整张图。"""
+
+    img = Image.new("RGB", (layout.width, layout.height), layout.background)
+    draw = ImageDraw.Draw(img)
+    for item in layout.items:
+        if isinstance(item, TextItem):
+            draw.text((item.x, item.y), item.text, fill=item.fill, font=load_font(item.size))
+        elif isinstance(item, RectItem):
+            draw.rectangle(item.box, fill=item.fill)
+        else:
+            draw.line(item.points, fill=item.fill, width=item.width)
+    return img
+
+
+# SVG 中文字使用的字体，与 FONT_CANDIDATES 对应，由浏览器按顺序选择
+SVG_FONT_FAMILY = "SimHei, 'Microsoft YaHei', SimSun, sans-serif"
+
+
+@lru_cache(maxsize=None)
+def _ascent(size: int) -> float:
+    # Pillow 以文字的上沿为 y 坐标绘制，SVG 以基线为 y 坐标，两者相差字体的 ascent
+    font = load_font(size)
+    if hasattr(font, "getmetrics"):
+        return font.getmetrics()[0]
+    return size
+
+
+def _svg_num(value: float) -> str:
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _svg_color(color: tuple[int, int, int] | str) -> str:
+    if isinstance(color, tuple):
+        return "#{:02x}{:02x}{:02x}".format(*color)
+    return color
+
+
+def render_svg(layout: ChartLayout) -> str:
+    """把排好的版输出为一个 <svg> 元素（不含 XML 声明），可以保存为 .svg 文件或直接嵌入 HTML。"""
+
+    w, h = layout.width, layout.height
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}" '
+        f'font-family={quoteattr(SVG_FONT_FAMILY)} shape-rendering="crispEdges">',
+        f'<rect width="{w}" height="{h}" fill="{_svg_color(layout.background)}"/>',
+    ]
+    for item in layout.items:
+        if isinstance(item, TextItem):
+            parts.append(
+                f'<text x="{_svg_num(item.x)}" y="{_svg_num(item.y + _ascent(item.size))}" '
+                f'font-size="{item.size}" fill="{_svg_color(item.fill)}">{escape(item.text)}</text>'
+            )
+        elif isinstance(item, RectItem):
+            # 与 Pillow 的 rectangle 一致，右下角的像素也在矩形内
+            x0, y0, x1, y1 = item.box
+            parts.append(
+                f'<rect x="{_svg_num(x0)}" y="{_svg_num(y0)}" width="{_svg_num(x1 - x0 + 1)}" '
+                f'height="{_svg_num(y1 - y0 + 1)}" fill="{_svg_color(item.fill)}"/>'
+            )
+        else:
+            x0, y0, x1, y1 = item.points
+            parts.append(
+                f'<line x1="{_svg_num(x0)}" y1="{_svg_num(y0)}" x2="{_svg_num(x1)}" y2="{_svg_num(y1)}" '
+                f'stroke="{_svg_color(item.fill)}" stroke-width="{item.width}"/>'
+            )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+@dataclass(frozen=True)
+class ExportProfile:
+    """图表的一种输出方案：文件扩展名、格式、是否先转为调色板图像，以及传给 Image.save 的参数。"""
+
+    extension: str
+    format: str
+    palette: bool = False
+    options: Mapping[str, object] = field(default_factory=dict)
+
+
+EXPORT_PROFILES: dict[str, ExportProfile] = {
+    "default": ExportProfile(".png", "PNG"),
+    # 编码最快，文件比 default 略小
+    "fast": ExportProfile(".png", "PNG", palette=True, options={"compress_level": 1}),
+    # PNG 中文件最小，编码时间与 default 相近
+    "small": ExportProfile(".png", "PNG", palette=True, options={"optimize": True}),
+    # 文件最小，适合嵌入网页或上传
+    "web": ExportProfile(".webp", "WEBP", options={"lossless": True}),
+    "svg": ExportProfile(".svg", "SVG"),
+}
+
+
+def get_profile(name: str) -> ExportProfile:
+    try:
+        return EXPORT_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"unknown chart export profile: {name!r}") from None
+
+
+def _rgb(color: tuple[int, int, int] | str) -> tuple[int, int, int]:
+    return color if isinstance(color, tuple) else ImageColor.getrgb(color)[:3]
+
+
+def to_palette(img: Image.Image, layout: ChartLayout) -> Image.Image | None:
+    """把 draw_layout 画出的图无损地转为调色板图像；图中有灰色和柱子颜色以外的颜色时返回 None。
+
+    Image.quantize 使用精度较低的查找表，相近的灰色会被合并，所以这里直接由灰度图构造：
+    灰色像素的索引就是它的灰度，柱子的颜色占用一个没有出现过的灰度，再按排版把柱子重新画一遍。
+    """
+
+    colors = img.getcolors(256)
+    if colors is None:
+        return None
+    rects = [item for item in layout.items if isinstance(item, RectItem)]
+    fills = {_rgb(item.fill) for item in rects}
+    if any(not (r == g == b) and (r, g, b) not in fills for _, (r, g, b) in colors):
+        return None
+
+    gray = img.convert("L")
+    histogram = gray.histogram()
+    free = [level for level in range(256) if not histogram[level]]
+    colored = sorted(fill for fill in fills if not (fill[0] == fill[1] == fill[2]))
+    if len(colored) > len(free):
+        return None
+
+    palette = [level for level in range(256) for _ in range(3)]
+    index: dict[tuple[int, int, int], int] = {}
+    for fill, level in zip(colored, free):
+        index[fill] = level
+        palette[level * 3:level * 3 + 3] = fill
+    out = Image.frombytes("P", gray.size, gray.tobytes())
+    out.putpalette(palette)
+    draw = ImageDraw.Draw(out)
+    for item in rects:
+        fill = _rgb(item.fill)
+        draw.rectangle(item.box, fill=index.get(fill, fill[0]))
+    return out
+
+
+def encode_layout(layout: ChartLayout, profile: str = "default") -> bytes:
+    """按输出方案把排好的版编码为文件内容，可以写入文件，也可以转为 data URL 嵌入网页或上传。"""
+
+    p = get_profile(profile)
+    if p.format == "SVG":
+        return render_svg(layout).encode("utf-8")
+    img = draw_layout(layout)
+    if p.palette:
+        img = to_palette(img, layout) or img
+    buf = io.BytesIO()
+    img.save(buf, format=p.format, **p.options)
+    return buf.getvalue()
+
+
+def _save_layout(layout: ChartLayout, path: str, profile: str) -> None:
+    data = encode_layout(layout, profile)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@dataclass(frozen=True)
+class BarChartJob:
+    """一张待渲染的横向柱状图，参数与 save_horizontal_bar_chart 相同。"""
+
+    labels: Sequence[str]
+    values: Sequence[float]
+    path: str
+    title: str
+    xlabel: str
+    integer_values: bool = False
+    top_n: int | None = None
+    page_size: int | None = None
+    profile: str = "default"
+
+    def render(self) -> list[str]:
+        return save_horizontal_bar_chart(
+            self.labels,
+            self.values,
+            self.path,
+            self.title,
+            self.xlabel,
+            self.integer_values,
+            top_n=self.top_n,
+            page_size=self.page_size,
+            profile=self.profile,
+        )
+
+
+class ChartBatch:
+    """在后台线程中渲染的一批图表。
+
+    创建后立即开始渲染，调用方可以继续做别的事（各图之间受 GIL 限制，总耗时与依次渲染相近）；wait() 等待全部完成，有图表渲染失败时抛出第一个异常。
+    timings 记录每张图（按路径）的渲染耗时（秒）。
+    """
+
+    def __init__(self, jobs: Sequence[BarChartJob], max_workers: int | None = None) -> None:
+        self.jobs = list(jobs)
+        self.timings: dict[str, float] = {}
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(1, len(self.jobs)), thread_name_prefix="chart")
+        self._futures = [executor.submit(self._render, job) for job in self.jobs]
+        # 不再提交新任务，线程在已提交的图表画完后自行退出
+        executor.shutdown(wait=False)
+
+    def _render(self, job: BarChartJob) -> None:
+        start = time.perf_counter()
+        job.render()
+        self.timings[job.path] = time.perf_counter() - start
+
+    def done(self) -> bool:
+        return all(f.done() for f in self._futures)
+
+    def wait(self) -> None:
+        for future in self._futures:
+            future.result()
+
+
+OTHER_LABEL = "其他（{count} 家）"
+
+
+def collapse_top_n(
+    labels: Sequence[str],
+    values: Sequence[float],
+    top_n: int,
+    other_label: str = OTHER_LABEL,
+) -> tuple[list[str], list[float]]:
+    """保留前 top_n 个柱子，其余合并为一个“其他”柱子放在最后；不超过 top_n 个时原样返回。
+
+    labels、values 应已按数值从大到小排列。other_label 中的 {count} 替换为被合并的个数。
+    """
+
+    if top_n < 1:
+        raise ValueError("top_n must be at least 1")
+    labels = list(labels)
+    values = list(values)
+    if len(labels) <= top_n:
+        return labels, values
+    rest = values[top_n:]
+    return labels[:top_n] + [other_label.format(count=len(rest))], values[:top_n] + [sum(rest)]
+
+
+def page_paths(path: str, pages: int) -> list[str]:
+    """分页保存时各页的文件名：a.png 变为 a_1.png、a_2.png……只有一页时仍为 a.png。"""
+
+    if pages <= 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}_{i}{ext}" for i in range(1, pages + 1)]
+
+
+def remove_stale_pages(path: str, keep: Sequence[str]) -> None:
+    """删掉 path 按 page_paths 命名的各个文件（a.png、a_1.png、a_2.png……）中不在 keep 里的那些。
+
+    EXPORT_PROFILES 中各输出方案的扩展名都算在内，换用其他方案后旧格式的图也会被删掉。
+    """
+
+    directory = os.path.dirname(path) or "."
+    root, ext = os.path.splitext(os.path.basename(path))
+    prefix = f"{root}_"
+    exts = {ext} | {p.extension for p in EXPORT_PROFILES.values()}
+    kept = {os.path.basename(p) for p in keep}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if name in kept:
+            continue
+        stem, name_ext = os.path.splitext(name)
+        if name_ext not in exts:
+            continue
+        if stem == root or stem.startswith(prefix) and stem[len(prefix):].isdigit():
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def save_horizontal_bar_chart(
+    labels: Sequence[str],
+    values: Sequence[float],
+    path: str,
+    title: str,
+    xlabel: str,
+    integer_values: bool = False,
+    top_n: int | None = None,
+    page_size: int | None = None,
+    style: BarChartStyle = DEFAULT_STYLE,
+    profile: str = "default",
+) -> list[str]:
+    """画一张横向柱状图，按输出方案 profile（见 EXPORT_PROFILES）保存，返回写出的文件路径；
+    labels 或 values 为空时不生成文件。path 的扩展名由调用方决定，一般取 ExportProfile.extension。
+
+    给出 top_n 时只画前 top_n 个柱子和一个“其他”柱子（见 collapse_top_n）。
+    给出 page_size 且柱子多于 page_size 个时，每 page_size 个柱子画成一页，按 page_paths 命名分别保存，
+    各页高度相同、横轴刻度相同，标题后附页码。保存后删掉同一张图以前留下的、这次没有写出的页面
+    （见 remove_stale_pages），输出目录中不会混有不分页的旧图或多出的旧页。
+    """
+
+    get_profile(profile)
+    if not labels or not values:
+        return []
+
+    if top_n is not None:
+        labels, values = collapse_top_n(labels, values, top_n)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if page_size is None or len(labels) <= page_size:
+        layout = layout_bar_chart(labels, values, title, xlabel, integer_values, style)
+        _save_layout(layout, path, profile)
+        remove_stale_pages(path, [path])
+        return [path]
+
+    if page_size < 1:
+        raise ValueError("page_size must be at least 1")
+    pages = (len(labels) + page_size - 1) // page_size
+    paths = page_paths(path, pages)
+    # 最后一页柱子较少，也与其他页同样高
+    full_bars = page_size * (style.bar_height + style.bar_spacing) - style.bar_spacing
+    page_style = replace(
+        style, min_height=max(style.min_height, style.top_margin + full_bars + style.bottom_margin)
+    )
+    max_value = max(values)
+    for page, page_path in enumerate(paths):
+        start = page * page_size
+        layout = layout_bar_chart(
+            labels[start:start + page_size],
+            values[start:start + page_size],
+            f"{title}（{page + 1}/{pages}）",
+            xlabel,
+            integer_values,
+            page_style,
+            max_value=max_value,
+        )
+        _save_layout(layout, page_path, profile)
+    remove_stale_pages(path, paths)
+    return paths
@@ -5,8 +5,21 @@
 生成可以直接复制到 Cloudflare Dashboard 的 worker.js 文件。
 """
 
-import base64
 import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report_template import SlotTemplate, image_data_url  # noqa: E402
+
+WORKER_SLOTS = (
+    "__INDEX_HTML__",
+    "__STYLES_CSS__",
+    "__SCRIPTS_JS__",
+    "__MOBILE_HTML__",
+    "__MOBILE_CSS__",
+    "__MOBILE_JS__",
+)
 
 
 def escape_js_string(content: str) -> str:
@@ -19,30 +32,13 @@ def escape_js_string(content: str) -> str:
     )
 
 
-def image_to_base64(img_path: str) -> str:
-    """读取图片文件并转换为 base64 data URL。"""
-    ext = os.path.splitext(img_path)[1].lower()
-    mime_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".gif": "image/gif",
-        ".webp": "image/webp",
-    }
-    mime = mime_types.get(ext, "image/jpeg")
-    with open(img_path, "rb") as f:
-        data = f.read()
-    b64 = base64.b64encode(data).decode("ascii")
-    return f"data:{mime};base64,{b64}"
-
-
 def rewrite_asset_urls(content: str, templates_dir: str) -> str:
     """将图片路径替换为 base64 data URL（避免 CORS 问题）。"""
     avatar_path = os.path.join(templates_dir, "images", "eatbit.jpg")
     sprite_path = os.path.join(templates_dir, "images", "ach.jpg")
 
-    avatar_b64 = image_to_base64(avatar_path) if os.path.exists(avatar_path) else ""
-    sprite_b64 = image_to_base64(sprite_path) if os.path.exists(sprite_path) else ""
+    avatar_b64 = image_data_url(avatar_path) if os.path.exists(avatar_path) else ""
+    sprite_b64 = image_data_url(sprite_path) if os.path.exists(sprite_path) else ""
 
     result = content
     if avatar_b64:
@@ -87,24 +83,22 @@ def build_worker() -> None:
 
     # 读取 worker 模板
     with open(template_path, "r", encoding="utf-8") as f:
-        worker_template = f.read()
-
-    # 替换占位符
-    worker_js = (
-        worker_template
-        .replace("__INDEX_HTML__", escape_js_string(index_html))
-        .replace("__STYLES_CSS__", escape_js_string(styles_css))
-        .replace("__SCRIPTS_JS__", escape_js_string(scripts_js))
-        .replace("__MOBILE_HTML__", escape_js_string(mobile_html))
-        .replace("__MOBILE_CSS__", escape_js_string(mobile_css))
-        .replace("__MOBILE_JS__", escape_js_string(mobile_js))
-    )
-
-    # 写入输出文件
+        worker_template = SlotTemplate.parse(f.read(), {name: name for name in WORKER_SLOTS})
+
+    # 一次填入各个占位符并写入输出文件；填入的内容不会再被替换，
+    # 模板文件中的 __EAT_DATA__ 等占位符原样保留，由 worker 运行时填充
+    values = {
+        "__INDEX_HTML__": escape_js_string(index_html),
+        "__STYLES_CSS__": escape_js_string(styles_css),
+        "__SCRIPTS_JS__": escape_js_string(scripts_js),
+        "__MOBILE_HTML__": escape_js_string(mobile_html),
+        "__MOBILE_CSS__": escape_js_string(mobile_css),
+        "__MOBILE_JS__": escape_js_string(mobile_js),
+    }
     with open(output_path, "w", encoding="utf-8") as f:
-        f.write(worker_js)
+        worker_template.write(f, values)
 
-    output_size_kb = len(worker_js.encode("utf-8")) / 1024
+    output_size_kb = os.path.getsize(output_path) / 1024
     print(f"已生成 worker_used.js ({output_size_kb:.2f} KB)")
     print(f"路径: {output_path}")
     print("\n请将 worker_used.js 的内容复制到 Cloudflare Dashboard 的 Worker 编辑器中。")
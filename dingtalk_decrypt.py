@@ -8,6 +8,7 @@ import os
 import re
 import shutil
 import sqlite3
+import sys
 import tempfile
 from dataclasses import dataclass
 from pathlib import Path
@@ -29,8 +30,13 @@ class _DATA_BLOB(ctypes.Structure):
     _fields_ = [("cbData", ctypes.wintypes.DWORD), ("pbData", ctypes.POINTER(ctypes.c_byte))]
 
 
-crypt32 = ctypes.windll.crypt32
-kernel32 = ctypes.windll.kernel32
+# 仅 Windows 可用；其他平台上仍允许导入本模块（例如连接本地替身服务器做测试），
+# extract_jsessionid_from_dingtalk 会因找不到 LOCALAPPDATA 而抛出 DecryptError
+if sys.platform == "win32":
+    crypt32 = ctypes.windll.crypt32
+    kernel32 = ctypes.windll.kernel32
+else:
+    crypt32 = kernel32 = None
 
 
 def _bytes_to_blob(data: bytes) -> _DATA_BLOB:
@@ -1,6 +1,11 @@
 from __future__ import annotations
 
+import codecs
 import json
+import os
+import random
+import time
+from typing import Callable, Iterator
 from urllib.parse import parse_qs, urlparse
 
 import requests
@@ -15,16 +20,25 @@ class DkyktError(RuntimeError):
         self.evidence = evidence
 
 
-BASE = "https://dkykt.info.bit.edu.cn"
+class StreamInterruptedError(DkyktError):
+    """流式查询在接收响应体的途中连接中断。已经产出的记录无法撤回，由调用方决定是否整段重新查询。"""
+
+
+# 可通过环境变量指向本地替身服务器，便于离线测试
+BASE = os.environ.get("DKYKT_BASE", "https://dkykt.info.bit.edu.cn")
 
 PROXIES = {
     "http": None,
     "https": None,
 }
 
+# 网络异常或 5xx 时的重试次数与退避基数（秒）
+RETRIES = 3
+BACKOFF = 1.0
 
-def get_openid(session: requests.Session, idserial: str, dingtalk_ua: str) -> str:
-    headers = {
+
+def _openid_headers(dingtalk_ua: str) -> dict[str, str]:
+    return {
         "User-Agent": dingtalk_ua,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Accept-Language": "zh-CN,zh;q=0.9",
@@ -32,28 +46,55 @@ def get_openid(session: requests.Session, idserial: str, dingtalk_ua: str) -> st
         "Referer": f"{BASE}/home/openDingtalkLoginNew",
     }
 
-    try:
-        resp = session.get(
-            f"{BASE}/home/openDingTalkHomePage",
-            params={"idserial": idserial},
-            headers=headers,
-            timeout=15,
-            allow_redirects=False,
-            proxies=PROXIES,
-        )
-    except requests.RequestException as exc:
-        raise DkyktError(
-            user_message="网络连接异常。",
-            hint="请检查网络连接（如是否已关闭代理）。",
-            evidence=repr(exc),
-        )
 
-    loc = resp.headers.get("location", "")
+def _network_error(exc: BaseException) -> DkyktError:
+    return DkyktError(
+        user_message="网络连接异常。",
+        hint="请检查网络连接（如是否已关闭代理）。",
+        evidence=repr(exc),
+    )
+
+
+def _retry_delay(attempt: int, backoff: float) -> float:
+    """第 attempt 次失败后的等待时间：指数退避并加入随机抖动。"""
+    return backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _send_with_retry(
+    send: Callable[[], requests.Response],
+    retries: int,
+    backoff: float,
+) -> requests.Response:
+    """发送请求，网络异常和 5xx 响应会按指数退避重试。
+
+    其余响应（包括登录失效导致的 302、非 JSON 内容等）原样返回，由调用方判定为不可重试的错误。
+    """
+
+    attempt = 0
+    while True:
+        try:
+            resp = send()
+        except requests.RequestException as exc:
+            if attempt >= retries:
+                raise _network_error(exc)
+        else:
+            if resp.status_code < 500 or attempt >= retries:
+                return resp
+            # stream=True 时响应体未读取，不关闭会一直占着连接池中的连接
+            resp.close()
+        time.sleep(_retry_delay(attempt, backoff))
+        attempt += 1
+
+
+def _parse_openid_redirect(status_code: int, headers: dict) -> str:
+    """从 openDingTalkHomePage 的 302 响应头中解析 openid。"""
+
+    loc = headers.get("location", "")
     if not loc:
         raise DkyktError(
             user_message="无法推断 openid，JSESSIONID 可能已过期。",
             hint="尝试打开钉钉、进入校园卡界面，然后从托盘退出钉钉，再重试。",
-            evidence=f"status={resp.status_code}, headers={dict(resp.headers)!r}",
+            evidence=f"status={status_code}, headers={dict(headers)!r}",
         )
 
     qs = parse_qs(urlparse(loc).query)
@@ -68,14 +109,32 @@ def get_openid(session: requests.Session, idserial: str, dingtalk_ua: str) -> st
     return openid
 
 
-def query_trades(
+def get_openid(
     session: requests.Session,
-    openid: str,
-    begin_date: str,
-    end_date: str,
+    idserial: str,
     dingtalk_ua: str,
-) -> list[dict]:
-    url = f"{BASE}/selftrade/queryCardSelfTradeList"
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    resp = _send_with_retry(
+        lambda: session.get(
+            f"{BASE}/home/openDingTalkHomePage",
+            params={"idserial": idserial},
+            headers=_openid_headers(dingtalk_ua),
+            timeout=15,
+            allow_redirects=False,
+            proxies=PROXIES,
+        ),
+        retries,
+        backoff,
+    )
+
+    return _parse_openid_redirect(resp.status_code, resp.headers)
+
+
+def _trades_request(openid: str, begin_date: str, end_date: str, dingtalk_ua: str) -> tuple[dict, dict]:
+    """返回 queryCardSelfTradeList 请求所需的 (headers, payload)。"""
+
     headers = {
         "User-Agent": dingtalk_ua,
         "Accept": "application/json, text/javascript, */*; q=0.01",
@@ -92,45 +151,238 @@ def query_trades(
         "idserialOther": "",
         "chooseZH": "1",
     }
+    return headers, payload
+
+
+def _status_error(status_code: int, text: str) -> DkyktError:
+    return DkyktError(
+        user_message=f"查询请求失败，HTTP 状态码 {status_code}。",
+        hint="尝试打开钉钉、进入校园卡界面，然后从托盘退出钉钉，再重试；若仍失败，可以来 QQ 群 1015011529 反馈。",
+        evidence=text[:2000],
+    )
+
+
+def _not_json_error(text: str) -> DkyktError:
+    return DkyktError(
+        user_message="查询接口返回的不是 JSON（可能登录失效或接口变更）。",
+        hint="可以来 QQ 群 1015011529 反馈。",
+        evidence=text[:2000],
+    )
+
+
+def _structure_error(evidence: str) -> DkyktError:
+    return DkyktError(
+        user_message="接口返回结构异常。",
+        hint="可以来 QQ 群 1015011529 反馈。",
+        evidence=evidence[:2000],
+    )
+
+
+def _parse_trades_response(status_code: int, text: str) -> list[dict]:
+    """校验查询接口的响应并取出 resultData 列表。"""
+
+    if status_code != 200:
+        raise _status_error(status_code, text)
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        raise _not_json_error(text)
+
+    result = data.get("resultData") if isinstance(data, dict) else None
+    if not isinstance(result, list):
+        raise _structure_error(repr(data))
+
+    return result
+
+
+class _StructureError(ValueError):
+    pass
 
+
+class _JsonStream:
+    """在不断追加的文本缓冲区上做增量 JSON 解析，只保留尚未消费的部分。"""
+
+    _WS = " \t\r\n"
+
+    def __init__(self, chunks: Iterator[str]) -> None:
+        self._chunks = chunks
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        # 保留开头一段原文，出错时作为调试信息
+        self.head = ""
+
+    def _fill(self) -> bool:
+        """读入下一块文本，已到结尾时返回 False。"""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            if len(self.head) < 2000:
+                self.head += chunk[: 2000 - len(self.head)]
+            self._buf = self._buf[self._pos:] + chunk
+            self._pos = 0
+            return True
+        self._eof = True
+        return False
+
+    def read_head(self) -> str:
+        """继续读入文本直到凑满调试用的开头部分，返回开头原文。"""
+        while len(self.head) < 2000 and self._fill():
+            pass
+        return self.head
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符（不消费），文本结束时返回空串。"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self._buf, self._pos)
+        self._pos += 1
+        return c
+
+    def value(self):
+        """解析下一个完整的 JSON 值。
+
+        缓冲区里的值恰好到末尾时（例如数字可能还没读完）需要继续读入后再解析。
+        """
+        self.peek()
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return val
+
+
+def _iter_result_data(chunks: Iterator[str]) -> Iterator[dict]:
+    """从响应文本块中逐条解析 {"...": ..., "resultData": [...]} 里的 resultData 元素。
+
+    语法错误抛出 json.JSONDecodeError，缺少 resultData 或其不是数组时抛出 _StructureError。
+    """
+
+    stream = _JsonStream(chunks)
     try:
-        resp = session.post(
-            url,
+        stream.expect("{")
+        if stream.peek() == "}":
+            raise _StructureError("missing resultData")
+        while True:
+            key = stream.value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting property name", "", 0)
+            stream.expect(":")
+            if key == "resultData":
+                break
+            stream.value()
+            if stream.expect(",}") == "}":
+                raise _StructureError("missing resultData")
+
+        if stream.peek() != "[":
+            raise _StructureError(f"resultData is {stream.value()!r}")
+        stream.expect("[")
+        if stream.peek() == "]":
+            return
+        while True:
+            yield stream.value()
+            if stream.expect(",]") == "]":
+                return
+    except (json.JSONDecodeError, _StructureError) as exc:
+        exc.head = stream.read_head()
+        raise
+
+
+def query_trades(
+    session: requests.Session,
+    openid: str,
+    begin_date: str,
+    end_date: str,
+    dingtalk_ua: str,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> list[dict]:
+    headers, payload = _trades_request(openid, begin_date, end_date, dingtalk_ua)
+
+    resp = _send_with_retry(
+        lambda: session.post(
+            f"{BASE}/selftrade/queryCardSelfTradeList",
             params={"openid": openid},
             json=payload,
             headers=headers,
             timeout=20,
             proxies=PROXIES,
-        )
-    except requests.RequestException as exc:
-        raise DkyktError(
-            user_message="网络连接异常。",
-            hint="请检查网络连接（如是否已关闭代理）。",
-            evidence=repr(exc),
-        )
+        ),
+        retries,
+        backoff,
+    )
 
-    if resp.status_code != 200:
-        raise DkyktError(
-            user_message=f"查询请求失败，HTTP 状态码 {resp.status_code}。",
-            hint="尝试打开钉钉、进入校园卡界面，然后从托盘退出钉钉，再重试；若仍失败，可以来 QQ 群 1015011529 反馈。",
-            evidence=resp.text[:2000],
-        )
+    return _parse_trades_response(resp.status_code, resp.text)
 
-    try:
-        data = resp.json()
-    except json.JSONDecodeError:
-        raise DkyktError(
-            user_message="查询接口返回的不是 JSON（可能登录失效或接口变更）。",
-            hint="可以来 QQ 群 1015011529 反馈。",
-            evidence=resp.text[:2000],
-        )
 
-    result = data.get("resultData")
-    if not isinstance(result, list):
-        raise DkyktError(
-            user_message="接口返回结构异常。",
-            hint="可以来 QQ 群 1015011529 反馈。",
-            evidence=repr(data)[:2000],
-        )
+def query_trades_stream(
+    session: requests.Session,
+    openid: str,
+    begin_date: str,
+    end_date: str,
+    dingtalk_ua: str,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> Iterator[dict]:
+    """query_trades 的流式版本：边接收响应边解析，逐条产出 resultData 中的交易记录。
 
-    return result
+    不会在内存中同时保留完整的响应文本和解析后的列表。开始产出记录后如果连接中断，
+    已经产出的记录无法撤回，因此这里只在收到响应头之前重试，之后的中断抛出 StreamInterruptedError，
+    由调用方丢弃已收到的部分后整段重试（见 trade_fetcher.fetch_slices）。
+    """
+
+    headers, payload = _trades_request(openid, begin_date, end_date, dingtalk_ua)
+
+    resp = _send_with_retry(
+        lambda: session.post(
+            f"{BASE}/selftrade/queryCardSelfTradeList",
+            params={"openid": openid},
+            json=payload,
+            headers=headers,
+            timeout=20,
+            proxies=PROXIES,
+            stream=True,
+        ),
+        retries,
+        backoff,
+    )
+
+    with resp:
+        if resp.status_code != 200:
+            raise _status_error(resp.status_code, resp.text)
+
+        decoder = codecs.getincrementaldecoder(resp.encoding or "utf-8")(errors="replace")
+
+        def chunks() -> Iterator[str]:
+            for raw in resp.iter_content(chunk_size=64 * 1024):
+                yield decoder.decode(raw)
+            yield decoder.decode(b"", final=True)
+
+        try:
+            yield from _iter_result_data(chunks())
+        except requests.RequestException as exc:
+            err = _network_error(exc)
+            raise StreamInterruptedError(err.user_message, err.hint, err.evidence) from exc
+        except json.JSONDecodeError as exc:
+            raise _not_json_error(getattr(exc, "head", ""))
+        except _StructureError as exc:
+            raise _structure_error(f"{exc}: {getattr(exc, 'head', '')}")
@@ -0,0 +1,228 @@
+"""dkykt_api 的 asyncio 版本。
+
+只依赖标准库：用 asyncio 的流接口实现一个够用的 HTTP/1.1 客户端（每个请求一条连接），
+请求头、请求体以及响应的校验逻辑与 dkykt_api 共用，抛出的仍是 DkyktError。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import ssl
+from typing import Awaitable, Callable
+from urllib.parse import urlencode, urlsplit
+
+import dkykt_api
+from dkykt_api import (
+    BACKOFF,
+    RETRIES,
+    DkyktError,
+    _network_error,
+    _openid_headers,
+    _parse_openid_redirect,
+    _parse_trades_response,
+    _retry_delay,
+    _trades_request,
+)
+
+__all__ = ["AsyncSession", "DkyktError", "get_openid", "query_trades"]
+
+
+class _ProtocolError(Exception):
+    """服务器返回了无法解析的 HTTP 响应。"""
+
+
+_NETWORK_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, _ProtocolError)
+
+
+class AsyncResponse:
+    def __init__(self, status_code: int, headers: dict[str, str], content: bytes) -> None:
+        self.status_code = status_code
+        # 头部名统一小写
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+
+class AsyncSession:
+    """极简的异步会话，只负责保存 cookie 并逐个发起请求。"""
+
+    def __init__(self, cookies: dict[str, str] | None = None) -> None:
+        self.cookies: dict[str, str] = dict(cookies or {})
+        self._ssl = ssl.create_default_context()
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        json_body: object = None,
+        timeout: float = 20,
+    ) -> AsyncResponse:
+        return await asyncio.wait_for(
+            self._request(method, url, params, headers or {}, json_body),
+            timeout=timeout,
+        )
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        params: dict[str, str] | None,
+        headers: dict[str, str],
+        json_body: object,
+    ) -> AsyncResponse:
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        host = parts.hostname or ""
+        port = parts.port or (443 if https else 80)
+        target = parts.path or "/"
+        query = "&".join(q for q in (parts.query, urlencode(params or {})) if q)
+        if query:
+            target = f"{target}?{query}"
+
+        body = b""
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}"]
+        for k, v in headers.items():
+            lines.append(f"{k}: {v}")
+        if self.cookies:
+            lines.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        if body or method != "GET":
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Accept-Encoding: identity")
+        lines.append("Connection: close")
+        raw_request = ("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + body
+
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl if https else None
+        )
+        try:
+            writer.write(raw_request)
+            await writer.drain()
+            return await self._read_response(reader)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _read_response(self, reader: asyncio.StreamReader) -> AsyncResponse:
+        status_line = (await reader.readline()).decode("latin-1").strip()
+        pieces = status_line.split(" ", 2)
+        if len(pieces) < 2 or not pieces[0].startswith("HTTP/") or not pieces[1].isdigit():
+            raise _ProtocolError(f"bad status line: {status_line!r}")
+        status_code = int(pieces[1])
+
+        headers: dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            name = name.strip().lower()
+            value = value.strip()
+            if name == "set-cookie":
+                cookie_name, _, rest = value.partition("=")
+                self.cookies[cookie_name.strip()] = rest.split(";", 1)[0]
+            headers[name] = value
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks: list[bytes] = []
+            while True:
+                size_line = (await reader.readline()).split(b";", 1)[0].strip()
+                try:
+                    size = int(size_line, 16)
+                except ValueError:
+                    raise _ProtocolError(f"bad chunk size: {size_line!r}")
+                if size == 0:
+                    # 跳过可能存在的 trailer
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "content-length" in headers:
+            content = await reader.readexactly(int(headers["content-length"]))
+        else:
+            content = await reader.read()
+
+        return AsyncResponse(status_code, headers, content)
+
+
+async def _send_with_retry(
+    send: Callable[[], Awaitable[AsyncResponse]],
+    retries: int,
+    backoff: float,
+) -> AsyncResponse:
+    """与 dkykt_api._send_with_retry 相同：网络异常和 5xx 按指数退避重试。"""
+
+    attempt = 0
+    while True:
+        try:
+            resp = await send()
+        except _NETWORK_ERRORS as exc:
+            if attempt >= retries:
+                raise _network_error(exc)
+        else:
+            if resp.status_code < 500 or attempt >= retries:
+                return resp
+        await asyncio.sleep(_retry_delay(attempt, backoff))
+        attempt += 1
+
+
+async def get_openid(
+    session: AsyncSession,
+    idserial: str,
+    dingtalk_ua: str,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> str:
+    resp = await _send_with_retry(
+        lambda: session.request(
+            "GET",
+            f"{dkykt_api.BASE}/home/openDingTalkHomePage",
+            params={"idserial": idserial},
+            headers=_openid_headers(dingtalk_ua),
+            timeout=15,
+        ),
+        retries,
+        backoff,
+    )
+
+    return _parse_openid_redirect(resp.status_code, resp.headers)
+
+
+async def query_trades(
+    session: AsyncSession,
+    openid: str,
+    begin_date: str,
+    end_date: str,
+    dingtalk_ua: str,
+    retries: int = RETRIES,
+    backoff: float = BACKOFF,
+) -> list[dict]:
+    headers, payload = _trades_request(openid, begin_date, end_date, dingtalk_ua)
+
+    resp = await _send_with_retry(
+        lambda: session.request(
+            "POST",
+            f"{dkykt_api.BASE}/selftrade/queryCardSelfTradeList",
+            params={"openid": openid},
+            headers=headers,
+            json_body=payload,
+            timeout=20,
+        ),
+        retries,
+        backoff,
+    )
+
+    return _parse_trades_response(resp.status_code, resp.text)
@@ -1,4 +1,4 @@
-import base64
+import asyncio
 import csv
 
 from colorama import Fore, init as colorama_init
@@ -9,18 +9,27 @@ import shutil
 import sys
 import threading
 import time
-from collections import defaultdict
-from datetime import datetime, timedelta
+from typing import Iterable
+from urllib.parse import urlparse
 
 import hashlib
 import secrets
 import requests
-from PIL import Image, ImageDraw, ImageFont
 
-from achievements import evaluate_achievements
+from achievements import evaluate_achievements, evaluate_achievements_incremental
+from aggregate import AggregatingConsumer, ReportAggregate
+from atomic_file import atomic_write
+from charts import BarChartJob, ChartBatch, get_profile, set_font_hint, text_bbox
 
 from dingtalk_decrypt import DecryptError, extract_jsessionid_from_dingtalk
-from dkykt_api import DkyktError, get_openid, query_trades
+import dkykt_api_async
+from dkykt_api import BASE as DKYKT_BASE, DkyktError, get_openid
+from record_store import SpendRecords, format_cents
+from report_pipeline import ReportPipeline
+from report_template import load_report_template
+from trade_cache import FetchCheckpoint, TradeCache
+from trade_fetcher import FetchStats, TokenBucket, fetch_trades_adaptive, fetch_trades_adaptive_async
+from txtime import format_ts, parse_txdate
 
 EDGE_UA = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -39,8 +48,27 @@ DINGTALK_UA = (
 
 FILTERS = ["浴室", "医院", "开水"] # 如果名称包含这些字符串，将被过滤掉
 
+# 并发拉取消费记录的线程数，以及每秒最多发起的查询请求数
+FETCH_WORKERS = 6
+FETCH_RATE = 4.0
+
+# 已结束月份的查询结果缓存在本地，重复运行时无需重新下载；超过 CACHE_TTL_DAYS 天的缓存会被刷新
+CACHE_DIR = ".cache"
+CACHE_TTL_DAYS = 30
+
+# 柱状图最多画多少个商户，其余合并为“其他”；None 表示全部画出
+CHART_TOP_N: int | None = None
+# 商户多于这个数时柱状图分页保存（summary_amount_1.png、summary_amount_2.png……），每页高度固定；None 表示不分页
+CHART_PAGE_SIZE: int | None = None
+# 柱状图的输出方案，见 charts.EXPORT_PROFILES："default"、"fast"、"small"（PNG），"web"（WebP），"svg"（矢量图）
+CHART_PROFILE = "default"
+
 # 调试模式：通过命令行 --debug 参数启用
 DEBUG = "--debug" in sys.argv or "-debug" in sys.argv
+# 异步模式：通过命令行 --async 参数启用，边下载边转换记录
+USE_ASYNC = "--async" in sys.argv
+# 通过命令行 --no-cache 参数禁用本地查询缓存
+USE_CACHE = "--no-cache" not in sys.argv
 
 
 def make_student_key(student_id: str) -> str:
@@ -50,9 +78,9 @@ def make_student_key(student_id: str) -> str:
     h.update(student_id.encode("utf-8"))
     return h.hexdigest()
 
-def to_spend_records(raw_trades: list[dict]) -> list[dict]:
-    """将原始交易记录转换为仅包含扣费记录的简单结构。"""
-    records: list[dict] = []
+def to_spend_records(raw_trades: Iterable[dict]) -> SpendRecords:
+    """将原始交易记录转换为仅包含扣费记录的列式存储。raw_trades 可以是逐条产出的迭代器。"""
+    records = SpendRecords()
 
     for item in raw_trades:
         txamt = item.get("txamt")
@@ -76,28 +104,30 @@ def to_spend_records(raw_trades: list[dict]) -> list[dict]:
         if any(keyword in mername for keyword in FILTERS):
             continue
 
-        records.append(
-            {
-                "txdate": str(txdate),
-                "mername": mername,
-                # 消费额转为正数，便于阅读
-                "amount": -amt,
-            }
-        )
+        # 交易时间无法解析的记录无法按天统计，直接跳过
+        try:
+            ts = parse_txdate(str(txdate))
+        except ValueError:
+            continue
+
+        # 消费额转为正数的分，便于阅读与精确累加
+        records.append(ts, int(round(-amt * 100)), mername)
 
     return records
 
 
-def save_csv(records: list[dict], path: str) -> None:
+def save_csv(aggregate: ReportAggregate, path: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    sorted_records = sorted(records, key=lambda r: r["txdate"])
-
+    records = aggregate.records
+    timestamps = records.timestamps
     with open(path, "w", encoding="utf-8-sig", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["txdate", "mername", "amount"])
-        for r in sorted_records:
-            writer.writerow([r["txdate"], r["mername"], f"{r['amount']:.2f}"])
+        writer.writerows(
+            [format_ts(timestamps[i]), records.mername(i), format_cents(records.cents[i])]
+            for i in aggregate.order
+        )
 
 
 def _format_merchant_label(name: str) -> str:
@@ -116,318 +146,137 @@ def _format_merchant_label(name: str) -> str:
             return name + "（东）"
     return name
 
-_FONT_CANDIDATES = [
-    "simhei.ttf",
-    "msyh.ttc",
-    "msyh.ttf",
-    "simsun.ttc",
-    "simsun.ttf",
-]
-
-
-_FONT_CACHE: dict[int, ImageFont.ImageFont] = {}
-
-
-def _load_font(size: int) -> ImageFont.ImageFont:
-    font = _FONT_CACHE.get(size)
-    if font is not None:
-        return font
-
-    for name in _FONT_CANDIDATES:
-        try:
-            font = ImageFont.truetype(name, size)
-            _FONT_CACHE[size] = font
-            return font
-        except OSError:
-            continue
-
-    font = ImageFont.load_default()
-    _FONT_CACHE[size] = font
-    return font
 
-
-def _save_horizontal_bar_chart(
-    labels: list[str],
-    values: list[float],
+def amount_chart_job(
+    aggregate: ReportAggregate,
     path: str,
-    title: str,
-    xlabel: str,
-    integer_values: bool = False,
-) -> None:
-    if not labels or not values:
-        return
-
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-
-    width = 1200
-    left_margin = 260
-    right_margin = 160
-    top_margin = 80
-    bottom_margin = 80
-    bar_height = 24
-    bar_spacing = 12
-
-    total_bar_area = len(labels) * (bar_height + bar_spacing) - bar_spacing
-    height = max(400, top_margin + total_bar_area + bottom_margin)
-
-    img = Image.new("RGB", (width, height), "white")
-    draw = ImageDraw.Draw(img)
-
-    title_font = _load_font(28)
-    label_font = _load_font(18)
-    value_font = _load_font(16)
-    axis_font = _load_font(16)
-
-    # 标题
-    title_bbox = draw.textbbox((0, 0), title, font=title_font)
-    title_x = (width - (title_bbox[2] - title_bbox[0])) / 2     # 水平居中
-    title_y = 20
-    draw.text((title_x, title_y), title, fill="black", font=title_font)
-
-    # x 轴下面的标签
-    xlabel_bbox = draw.textbbox((0, 0), xlabel, font=axis_font)
-    xlabel_x = (width - (xlabel_bbox[2] - xlabel_bbox[0])) / 2
-    xlabel_y = height - bottom_margin + 45
-    draw.text((xlabel_x, xlabel_y), xlabel, fill="black", font=axis_font)
-
-    # 我们用 val / max_val * usable_width 计算柱子长度, 需要 max_val 大于 0
-    max_val = max(values) if values else 0.0
-    if max_val <= 0:
-        img.save(path, format="PNG")
-        return
-
-    # x 轴横线
-    usable_width = width - left_margin - right_margin
-    axis_y = height - bottom_margin + 10
-    draw.line((left_margin, axis_y, width - right_margin, axis_y), fill="black", width=1)
-
-    # x 轴坐标
-    num_ticks = 5
-    for i in range(num_ticks + 1):
-        x = left_margin + usable_width * i / num_ticks
-        draw.line((x, axis_y, x, axis_y + 5), fill="black", width=1)    # 竖直刻度线
-        tick_val = max_val * i / num_ticks
-        tick_str = f"{tick_val:.0f}" if max_val >= 10 else f"{tick_val:.2f}"
-        tick_bbox = draw.textbbox((0, 0), tick_str, font=axis_font)
-        tick_x = x - (tick_bbox[2] - tick_bbox[0]) / 2
-        tick_y = axis_y + 8
-        draw.text((tick_x, tick_y), tick_str, fill="black", font=axis_font)
-
-    current_y = top_margin
-    bar_color = (51, 122, 183)
-
-    # 商家名和柱子
-    for label, value in zip(labels, values):
-        bar_len = 0 if value <= 0 else value / max_val * usable_width
-        y0 = current_y
-        y1 = current_y + bar_height
-
-        draw.rectangle((left_margin, y0, left_margin + bar_len, y1), fill=bar_color)
-
-        label_bbox = draw.textbbox((0, 0), label, font=label_font)
-        label_x = left_margin - 10 - (label_bbox[2] - label_bbox[0])
-        label_y = y0 + (bar_height - (label_bbox[3] - label_bbox[1])) / 2
-        draw.text((label_x, label_y), label, fill="black", font=label_font)
-
-        value_str = str(int(round(value))) if integer_values else f"{value:.2f}"
-        value_bbox = draw.textbbox((0, 0), value_str, font=value_font)
-        value_x = left_margin + bar_len + 8
-        value_y = y0 + (bar_height - (value_bbox[3] - value_bbox[1])) / 2
-        draw.text((value_x, value_y), value_str, fill="black", font=value_font)
-
-        current_y += bar_height + bar_spacing
-
-    img.save(path, format="PNG")
-
-
-def save_bar_chart(records: list[dict], path: str) -> None:
-    if not records:
-        return
+    top_n: int | None = None,
+    page_size: int | None = None,
+    profile: str = "default",
+) -> BarChartJob | None:
+    """各商户消费金额的柱状图，没有记录时返回 None。top_n、page_size、profile 见 charts.save_horizontal_bar_chart。"""
 
-    totals: dict[str, float] = defaultdict(float)
-    for r in records:
-        totals[r["mername"]] += r["amount"]
+    if not aggregate.merchant_cents:
+        return None
 
-    items = sorted(totals.items(), key=lambda x: x[1], reverse=True)
+    # merchant_cents 按商户首次出现的顺序排列，排序时同额商户的先后与逐条累加时一致
+    items = sorted(aggregate.merchant_cents.items(), key=lambda x: x[1], reverse=True)
     merchants = [name for name, _ in items]
     display_merchants = [_format_merchant_label(name) for name in merchants]
-    amounts = [value for _, value in items]
+    amounts = [value / 100 for _, value in items]
 
-    _save_horizontal_bar_chart(
+    return BarChartJob(
         display_merchants,
         amounts,
         path,
         title="吃饭消费总结",
         xlabel="消费金额（元）",
+        top_n=top_n,
+        page_size=page_size,
+        profile=profile,
     )
 
 
-def save_count_chart(records: list[dict], path: str) -> None:
-    if not records:
-        return
+def count_chart_job(
+    aggregate: ReportAggregate,
+    path: str,
+    top_n: int | None = None,
+    page_size: int | None = None,
+    profile: str = "default",
+) -> BarChartJob | None:
+    """各商户消费次数的柱状图，没有记录时返回 None。top_n、page_size、profile 见 charts.save_horizontal_bar_chart。"""
 
-    counts: dict[str, int] = defaultdict(int)
-    for r in records:
-        counts[r["mername"]] += 1
+    if not aggregate.merchant_counts:
+        return None
 
-    items = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    items = sorted(aggregate.merchant_counts.items(), key=lambda x: x[1], reverse=True)
     merchants = [name for name, _ in items]
     display_merchants = [_format_merchant_label(name) for name in merchants]
     times = [value for _, value in items]
 
-    _save_horizontal_bar_chart(
+    return BarChartJob(
         display_merchants,
         times,
         path,
         title="吃饭次数统计",
         xlabel="消费次数（次）",
         integer_values=True,
+        top_n=top_n,
+        page_size=page_size,
+        profile=profile,
     )
 
 
-def build_daily_stats(records: list[dict]) -> dict:
-    """按年和日期聚合每天的用餐次数与金额及商户明细。
-
-    返回结构大致为：
-    {
-        "2025": {
-            "2025-03-01": {"count": 3, "amount": 25.5, "merchants": [{"name": "一食堂", "amount": 10.0}, ...]},
-            ...
-        },
-        ...
-    }
-    """
-
-    stats: dict[str, dict[str, dict]] = {}
-
-    for r in records:
-        raw_date = str(r["txdate"])
-        # 只保留日期部分（YYYY-MM-DD），忽略具体时间，便于按天聚合
-        date_str = raw_date[:10]
-        time_str = raw_date[11:19] if len(raw_date) >= 19 else ""
-        mername = r["mername"]
-        amount = float(r["amount"])
-
-        year = date_str[:4]
-        stats.setdefault(year, {})
-        day_stats = stats[year].setdefault(
-            date_str,
-            {"count": 0, "amount": 0.0, "merchants": defaultdict(float), "txs": []},
-        )
+def save_bar_chart(
+    aggregate: ReportAggregate,
+    path: str,
+    top_n: int | None = None,
+    page_size: int | None = None,
+    profile: str = "default",
+) -> list[str]:
+    job = amount_chart_job(aggregate, path, top_n, page_size, profile)
+    return job.render() if job is not None else []
 
-        day_stats["count"] += 1
-        day_stats["amount"] += amount
-        day_stats["merchants"][mername] += amount
-        day_stats["txs"].append(
-            {
-                "txdate": raw_date,
-                "time": time_str,
-                "mername": mername,
-                "amount": amount,
-            }
-        )
 
-    # 将 merchants 从 dict 压平成列表，按金额从高到低排序
-    normalized: dict[str, dict[str, dict]] = {}
-    for year, days in stats.items():
-        normalized[year] = {}
-        for date_str, info in days.items():
-            merchants_dict: dict[str, float] = info["merchants"]
-            merchants_list = [
-                {"name": name, "amount": amt}
-                for name, amt in sorted(merchants_dict.items(), key=lambda x: x[1], reverse=True)
-            ]
-            raw_txs: list[dict] = info.get("txs", [])
-            sorted_txs = sorted(raw_txs, key=lambda t: t.get("txdate", ""))
-            txs = [
-                {
-                    "time": t.get("time", ""),
-                    "mername": t.get("mername", ""),
-                    "amount": float(t.get("amount", 0.0)),
-                }
-                for t in sorted_txs
-            ]
-
-            normalized[year][date_str] = {
-                "count": info["count"],
-                "amount": info["amount"],
-                "merchants": merchants_list,
-                "txs": txs,
-            }
-
-    return normalized
-
-
-def save_html_report(records: list[dict], path: str, student_id: str | None = None, used_default_password: bool | None = None) -> str:
-    """生成包含年度吃饭饭力图的本地 HTML 报告。"""
-
-    daily_stats = build_daily_stats(records)
-    ach_state = evaluate_achievements(
-        records,
-        student_id=student_id,
-        used_default_password=used_default_password,
-    )
+def save_count_chart(
+    aggregate: ReportAggregate,
+    path: str,
+    top_n: int | None = None,
+    page_size: int | None = None,
+    profile: str = "default",
+) -> list[str]:
+    job = count_chart_job(aggregate, path, top_n, page_size, profile)
+    return job.render() if job is not None else []
+
+
+def start_chart_rendering(
+    aggregate: ReportAggregate,
+    output_dir: str,
+    top_n: int | None = CHART_TOP_N,
+    page_size: int | None = CHART_PAGE_SIZE,
+    profile: str = CHART_PROFILE,
+) -> ChartBatch:
+    """在后台线程中渲染金额图与次数图，返回后可以继续生成其他文件。"""
+
+    ext = get_profile(profile).extension
+    jobs = [
+        amount_chart_job(aggregate, os.path.join(output_dir, f"summary_amount{ext}"), top_n, page_size, profile),
+        count_chart_job(aggregate, os.path.join(output_dir, f"summary_count{ext}"), top_n, page_size, profile),
+    ]
+    return ChartBatch([job for job in jobs if job is not None])
+
+
+def save_html_report(
+    aggregate: ReportAggregate,
+    path: str,
+    student_id: str | None = None,
+    used_default_password: bool | None = None,
+    ach_state: dict | None = None,
+    template_cache_dir: str | None = None,
+) -> str:
+    """生成包含年度吃饭饭力图的本地 HTML 报告。已经算好的成就状态可以通过 ach_state 传入。
+
+    模板的编译结果缓存在 template_cache_dir 中（见 report_template.load_report_template）。
+    """
 
-    base_tpl_path = os.path.join("templates", "index.html")
-    style_path = os.path.join("templates", "styles.css")
-    script_path = os.path.join("templates", "scripts.js")
-
-    with open(base_tpl_path, "r", encoding="utf-8") as f:
-        base_tpl = f.read()
-    with open(style_path, "r", encoding="utf-8") as f:
-        style = f.read()
-    with open(script_path, "r", encoding="utf-8") as f:
-        script = f.read()
-
-    # 将图片转为 base64 数据 URL
-    def image_to_base64(img_path: str) -> str:
-        """读取图片文件并转换为 base64 data URL。"""
-        ext = os.path.splitext(img_path)[1].lower()
-        mime_types = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".gif": "image/gif",
-            ".webp": "image/webp",
-        }
-        mime = mime_types.get(ext, "image/jpeg")
-        with open(img_path, "rb") as f:
-            data = f.read()
-        b64 = base64.b64encode(data).decode("ascii")
-        return f"data:{mime};base64,{b64}"
-
-    # 转换头像和成就精灵图
-    avatar_path = os.path.join("templates", "images", "eatbit.jpg")
-    sprite_path = os.path.join("templates", "images", "ach.jpg")
-
-    if os.path.exists(avatar_path):
-        script = script.replace(
-            'const IMG_AVATAR_DEFAULT = "images/eatbit.jpg";',
-            f'const IMG_AVATAR_DEFAULT = "{image_to_base64(avatar_path)}";',
-        )
-    if os.path.exists(sprite_path):
-        script = script.replace(
-            'const IMG_ACH_SPRITE = "images/ach.jpg";',
-            f'const IMG_ACH_SPRITE = "{image_to_base64(sprite_path)}";',
+    daily_stats = aggregate.daily_stats
+    if ach_state is None:
+        ach_state = evaluate_achievements(
+            aggregate.records,
+            student_id=student_id,
+            used_default_password=used_default_password,
+            order=aggregate.order,
         )
 
     data_json = json.dumps(daily_stats, ensure_ascii=False)
     ach_json = json.dumps(ach_state, ensure_ascii=False)
     edit_pw = f"{secrets.randbelow(10000):04d}"
 
-    html = (
-        base_tpl
-        .replace("/*__INLINE_STYLE__*/", style)
-        .replace("//__INLINE_SCRIPT__", script)
-        .replace("__EAT_DATA__", data_json)
-        .replace("__ACH_STATE__", ach_json)
-        .replace("__BARCODE_ID__", "null")  # 本地报告默认不显示条形码
-        .replace("__PROFILE__", "{}")  # 本地报告无保存的个人资料
-    )
-
+    # 内联的 CSS/JS 和图片只在模板文件改变后重新拼接，这里只需把各片段和数据依次写入文件
+    template = load_report_template("templates", template_cache_dir)
     os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        f.write(html)
+        template.write(f, {"__EAT_DATA__": data_json, "__ACH_STATE__": ach_json})
 
     # 把图片文件夹复制到 output 文件夹
     src_images = os.path.join("templates", "images")
@@ -467,10 +316,23 @@ def update_html_barcode(path: str, barcode_id: str) -> None:
         f.write(html)
 
 
+def build_upload_payload(daily_stats: dict, ach_state: dict, edit_pw: str) -> dict:
+    """组装上传到云端的报告数据。
+
+    Args:
+        daily_stats: build_daily_stats() 的结果
+        ach_state: evaluate_achievements() 的结果
+        edit_pw: 编辑密码
+    """
+    return {
+        "daily_stats": daily_stats,
+        "ach_state": ach_state,
+        "edit_pw": edit_pw,
+    }
+
+
 def upload_report(
-    daily_stats: dict,
-    ach_state: dict,
-    edit_pw: str,
+    payload: dict,
     student_key: str | None = None,
     year_from_id: str | None = None,
     year_from_openid: str | None = None,
@@ -478,18 +340,11 @@ def upload_report(
     """上传报告数据到云端，返回分享链接。
 
     Args:
-        daily_stats: build_daily_stats() 的结果
-        ach_state: evaluate_achievements() 的结果
-        edit_pw: 编辑密码
+        payload: build_upload_payload() 的结果
         student_key: 学号哈希，用于生成固定的报告 ID
         year_from_id: 学号[2:6]，用于验证
         year_from_openid: openid[94:98]，用于验证
     """
-    payload = {
-        "daily_stats": daily_stats,
-        "ach_state": ach_state,
-        "edit_pw": edit_pw,
-    }
 
     headers = {
         "Content-Type": "application/json",
@@ -532,9 +387,7 @@ def upload_report(
 
 
 def upload_with_progress(
-    daily_stats: dict,
-    ach_state: dict,
-    edit_pw: str,
+    payload: dict,
     student_key: str | None = None,
     year_from_id: str | None = None,
     year_from_openid: str | None = None,
@@ -547,9 +400,7 @@ def upload_with_progress(
     def do_upload():
         try:
             upload_result[0] = upload_report(
-                daily_stats=daily_stats,
-                ach_state=ach_state,
-                edit_pw=edit_pw,
+                payload,
                 student_key=student_key,
                 year_from_id=year_from_id,
                 year_from_openid=year_from_openid,
@@ -581,29 +432,224 @@ def upload_with_progress(
     return upload_result[0]
 
 
-def split_date_range(begin_date: str, end_date: str, max_days: int = 31) -> list[tuple[str, str]]:
-    """将总的起止日期拆分为若干不超过 max_days 天的小段，因为查询接口似乎有日期范围限制。
+def achievement_state_path(openid: str, begin_date: str, end_date: str) -> str:
+    """成就计算状态在缓存目录中的路径。与 TradeCache 一样以 openid 与起止日期的哈希命名，不同账号、年份互不干扰。"""
+
+    key = hashlib.sha256(f"achievements:{openid}:{begin_date}:{end_date}".encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, "achievements", f"{key}.json")
+
+
+def load_achievement_state(path: str) -> dict | None:
+    """读取上次保存的成就计算状态；文件不存在或损坏时返回 None。"""
 
-    例如 [2025-01-01, 2025-03-15] 会被拆成：
-    - 2025-01-01 ~ 2025-01-31
-    - 2025-02-01 ~ 2025-03-03
-    - 2025-03-04 ~ 2025-03-15
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def save_achievement_state(path: str, state: dict) -> None:
+    """保存成就计算状态，写入失败不影响报告。"""
+
+    atomic_write(path, lambda f: json.dump(state, f, ensure_ascii=False))
+
+
+def evaluate_achievements_saved(
+    aggregate: ReportAggregate,
+    student_id: str,
+    used_default_password: bool | None,
+    state_path: str,
+) -> dict:
+    """在 state_path 中保存的状态上续算成就，只处理比上次最后一笔更晚的记录，再写回新的状态。"""
+
+    state = load_achievement_state(state_path)
+    ach_state, new_state = evaluate_achievements_incremental(
+        aggregate.records,
+        state,
+        student_id=student_id,
+        used_default_password=used_default_password,
+        order=aggregate.order,
+    )
+    save_achievement_state(state_path, new_state)
+    return ach_state
+
+
+def build_report_pipeline(
+    aggregate: ReportAggregate,
+    student_id: str,
+    used_default_password: bool | None = None,
+    output_dir: str = "output",
+    ach_state_path: str | None = None,
+    template_cache_dir: str | None = None,
+) -> ReportPipeline:
+    """组装生成报告的各个阶段：
+
+    - csv：由 aggregate 写出文件；
+    - charts：在后台线程中开始渲染金额图与次数图，返回 ChartBatch，需要图片时调用其 wait()；
+    - daily_stats、ach_state：由 aggregate 计算，给出 ach_state_path 时成就在上次保存的状态上续算；
+    - html：使用算好的 ach_state 写出本地报告，输出编辑密码；给出 template_cache_dir 时模板的编译结果缓存在其中；
+    - upload_payload：由 daily_stats、ach_state 与编辑密码组成。
+
+    每个阶段只在第一次 get() 时执行，本地报告与上传共用同一份 daily_stats 和 ach_state。
     """
 
-    start = datetime.strptime(begin_date, "%Y-%m-%d").date()
-    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    pipeline = ReportPipeline()
+    pipeline.set("aggregate", aggregate)
+    pipeline.set("student_id", student_id)
+    pipeline.set("used_default_password", used_default_password)
+
+    pipeline.add("daily_stats", lambda agg: agg.daily_stats, "aggregate")
+    if ach_state_path is None:
+        def compute_ach_state(agg, sid, pw):
+            return evaluate_achievements(agg.records, student_id=sid, used_default_password=pw, order=agg.order)
+    else:
+        def compute_ach_state(agg, sid, pw):
+            return evaluate_achievements_saved(agg, sid, pw, ach_state_path)
+
+    pipeline.add(
+        "ach_state",
+        compute_ach_state,
+        "aggregate",
+        "student_id",
+        "used_default_password",
+    )
+    pipeline.add("csv", lambda agg: save_csv(agg, os.path.join(output_dir, "records.csv")), "aggregate")
+    pipeline.add("charts", lambda agg: start_chart_rendering(agg, output_dir), "aggregate")
+    pipeline.add(
+        "html",
+        lambda agg, sid, pw, ach: save_html_report(
+            agg,
+            os.path.join(output_dir, "report.html"),
+            student_id=sid,
+            used_default_password=pw,
+            ach_state=ach,
+            template_cache_dir=template_cache_dir,
+        ),
+        "aggregate",
+        "student_id",
+        "used_default_password",
+        "ach_state",
+    )
+    pipeline.add("upload_payload", build_upload_payload, "daily_stats", "ach_state", "html")
+    return pipeline
+
+
+def open_checkpoint(openid: str, begin_date: str, end_date: str) -> FetchCheckpoint | None:
+    """拉取中断（如网络故障）后重新运行，会跳过断点文件中已完成的区间；--no-cache 时不写断点文件。"""
+
+    if not USE_CACHE:
+        return None
+    checkpoint = FetchCheckpoint(os.path.join(CACHE_DIR, "checkpoint.jsonl"), openid, begin_date, end_date)
+    if checkpoint.completed:
+        print(f"检测到上次未完成的拉取，已完成的 {len(checkpoint.completed)} 个区间将直接复用。")
+    return checkpoint
+
 
-    if start > end:
-        raise ValueError("开始日期不能晚于结束日期")
+def open_trade_cache() -> TradeCache | None:
+    return TradeCache(os.path.join(CACHE_DIR, "trades"), CACHE_TTL_DAYS) if USE_CACHE else None
 
-    ranges: list[tuple[str, str]] = []
-    cur = start
-    while cur <= end:
-        chunk_end = min(cur + timedelta(days=max_days - 1), end)
-        ranges.append((cur.isoformat(), chunk_end.isoformat()))
-        cur = chunk_end + timedelta(days=1)
 
-    return ranges
+def report_fetch_stats(fetch_stats: FetchStats) -> None:
+    print(f"共发起 {fetch_stats.requests} 次查询请求，{fetch_stats.cache_hits} 个区间来自本地缓存。")
+    if fetch_stats.unresolved:
+        print(f"{Fore.YELLOW}警告：以下日期的记录可能不完整：{Fore.RESET}"
+              + "、".join(b for b, _ in fetch_stats.unresolved))
+
+
+def fetch_records(
+    jsessionid: str,
+    idserial: str,
+    begin_date: str,
+    end_date: str,
+) -> tuple[str, ReportAggregate]:
+    """推断 openid 并拉取全部区间。
+
+    各区间下载完成后立即在后台线程中聚合，返回 (openid, 聚合结果)。
+    """
+
+    session = requests.Session()
+    session.cookies.set("JSESSIONID", jsessionid, domain=urlparse(DKYKT_BASE).hostname, path="/")
+
+    print("正在推断 openid...")
+    openid = get_openid(session, idserial, DINGTALK_UA)
+
+    print("openid 获取成功，正在按时间分段拉取消费记录...")
+
+    checkpoint = open_checkpoint(openid, begin_date, end_date)
+    consumer = AggregatingConsumer()
+    try:
+        # 流式解析每个区间的响应，原始记录直接转换为扣费记录，不整体保存在内存中
+        fetch_stats = fetch_trades_adaptive(
+            session,
+            openid,
+            begin_date,
+            end_date,
+            DINGTALK_UA,
+            max_workers=FETCH_WORKERS,
+            limiter=TokenBucket(FETCH_RATE, burst=FETCH_WORKERS),
+            on_request=lambda b, e: print(f"  查询区间: {b} ~ {e} ..."),
+            cache=open_trade_cache(),
+            checkpoint=checkpoint,
+            transform=to_spend_records,
+            on_slice=consumer.submit,
+        )
+        aggregate = consumer.finish(fetch_stats.leaves)
+    finally:
+        consumer.close()
+
+    if checkpoint is not None:
+        checkpoint.clear()
+    report_fetch_stats(fetch_stats)
+    return openid, aggregate
+
+
+async def fetch_records_async(
+    jsessionid: str,
+    idserial: str,
+    begin_date: str,
+    end_date: str,
+) -> tuple[str, ReportAggregate]:
+    """异步推断 openid 并拉取全部区间，每个区间下载完成后立即转换为扣费记录并在后台线程中聚合。
+
+    与 fetch_records 一样限流、使用本地缓存和断点，并对疑似被截断的区间二分重查。返回 (openid, 聚合结果)。
+    """
+
+    session = dkykt_api_async.AsyncSession({"JSESSIONID": jsessionid})
+
+    print("正在推断 openid...")
+    openid = await dkykt_api_async.get_openid(session, idserial, DINGTALK_UA)
+
+    print("openid 获取成功，正在异步拉取消费记录...")
+    checkpoint = open_checkpoint(openid, begin_date, end_date)
+    consumer = AggregatingConsumer()
+
+    def on_slice(rng: tuple[str, str], trades: list[dict]) -> None:
+        print(f"  已完成区间: {rng[0]} ~ {rng[1]}")
+        consumer.submit(rng, to_spend_records(trades))
+
+    try:
+        fetch_stats = await fetch_trades_adaptive_async(
+            session,
+            openid,
+            begin_date,
+            end_date,
+            DINGTALK_UA,
+            max_workers=FETCH_WORKERS,
+            limiter=TokenBucket(FETCH_RATE, burst=FETCH_WORKERS),
+            cache=open_trade_cache(),
+            checkpoint=checkpoint,
+            on_slice=on_slice,
+        )
+        aggregate = consumer.finish(fetch_stats.leaves)
+    finally:
+        consumer.close()
+
+    if checkpoint is not None:
+        checkpoint.clear()
+    report_fetch_stats(fetch_stats)
+    return openid, aggregate
 
 
 def main() -> None:
@@ -631,6 +677,10 @@ def main() -> None:
     begin_date = f"{year:04d}-01-01"
     end_date = f"{year:04d}-12-31"
     output_saved = False
+    chart_batch = None
+    # 找到的字体路径记在缓存目录中，之后的运行不必再逐个查找候选字体；--no-cache 时不写入
+    if USE_CACHE:
+        set_font_hint(os.path.join(CACHE_DIR, "font_hint.json"))
 
     try:
         print("\n正在尝试获取 JSESSIONID...")
@@ -644,53 +694,46 @@ def main() -> None:
             if not jsessionid:
                 return
 
-        session = requests.Session()
-        session.cookies.set("JSESSIONID", jsessionid, domain="dkykt.info.bit.edu.cn", path="/")
-
-        print("正在推断 openid...")
-        openid = get_openid(session, idserial, DINGTALK_UA)
-
-        print("openid 获取成功，正在按时间分段拉取消费记录...")
-
-        all_trades: list[dict] = []
-        for sub_begin, sub_end in split_date_range(begin_date, end_date):
-            print(f"  查询区间: {sub_begin} ~ {sub_end} ...")
-            sub_trades = query_trades(session, openid, sub_begin, sub_end, DINGTALK_UA)
-            all_trades.extend(sub_trades)
-            time.sleep(0.5)
-
-        records = to_spend_records(all_trades)
+        if USE_ASYNC:
+            openid, aggregate = asyncio.run(
+                fetch_records_async(jsessionid, idserial, begin_date, end_date)
+            )
+        else:
+            openid, aggregate = fetch_records(jsessionid, idserial, begin_date, end_date)
+        records = aggregate.records
 
         if not records:
             print("在指定时间范围内没有找到任何扣费记录。")
             return
 
         os.makedirs("output", exist_ok=True)
-        csv_path = os.path.join("output", "records.csv")
-        img_amount_path = os.path.join("output", "summary_amount.png")
-        img_count_path = os.path.join("output", "summary_count.png")
-
-        save_csv(records, csv_path)
-        save_bar_chart(records, img_amount_path)
-        save_count_chart(records, img_count_path)
-
-        total_amount = sum(r["amount"] for r in records)
+        # 成就计算状态以前保存在输出目录中，现在放在缓存目录，删掉旧文件
+        try:
+            os.remove(os.path.join("output", "achievement_state.json"))
+        except OSError:
+            pass
         html_report_path = os.path.join("output", "report.html")
-        print(f"总消费金额: {total_amount:.2f} 元")
 
         used_default_password = None
-        daily_stats = build_daily_stats(records)
-        ach_state = evaluate_achievements(
-            records,
-            student_id=idserial,
-            used_default_password=used_default_password,
-        )
-        edit_pw = save_html_report(
-            records,
-            html_report_path,
-            student_id=idserial,
-            used_default_password=used_default_password,
+        pipeline = build_report_pipeline(
+            aggregate,
+            idserial,
+            used_default_password,
+            ach_state_path=achievement_state_path(openid, begin_date, end_date) if USE_CACHE else None,
+            template_cache_dir=os.path.join(CACHE_DIR, "templates") if USE_CACHE else None,
         )
+        # 柱状图在后台渲染，同时继续生成 CSV 和网页报告
+        chart_batch = pipeline.get("charts")
+        pipeline.get("csv")
+
+        total_amount = aggregate.total_amount
+        print(f"总消费金额: {total_amount:.2f} 元")
+
+        edit_pw = pipeline.get("html")
+        if DEBUG:
+            print(f"{Fore.YELLOW}[调试信息] 各阶段耗时:{Fore.RESET}\n{pipeline.format_timings()}")
+            info = text_bbox.cache_info()
+            print(f"{Fore.YELLOW}[调试信息] 文字尺寸缓存:{Fore.RESET} 命中 {info.hits} 次，测量 {info.misses} 次")
         print(f"\n{Fore.GREEN}已生成本地网页版报告:{Fore.RESET} {html_report_path}。")
         output_saved = True
 
@@ -698,9 +741,7 @@ def main() -> None:
         if choice == "y":
             student_key = make_student_key(idserial)
             url = upload_with_progress(
-                daily_stats=daily_stats,
-                ach_state=ach_state,
-                edit_pw=edit_pw,
+                pipeline.get("upload_payload"),
                 student_key=student_key,
                 year_from_id=idserial[2:6],
                 year_from_openid=openid[94:98],
@@ -734,6 +775,14 @@ def main() -> None:
             print(f"{Fore.YELLOW}[调试信息] 完整堆栈:{Fore.RESET}")
             traceback.print_exc()
     finally:
+        if chart_batch is not None:
+            try:
+                chart_batch.wait()
+            except Exception as exc:  # noqa: BLE001
+                print("生成柱状图失败:", exc)
+            if DEBUG:
+                for path, seconds in chart_batch.timings.items():
+                    print(f"{Fore.YELLOW}[调试信息]{Fore.RESET} {path}: {seconds * 1000:.1f} ms")
         # 只在成功时才自动打开 output 文件夹
         if output_saved:
             output_dir = os.path.abspath("output")
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from array import array
+from typing import Iterable, Iterator
+
+from txtime import TimeFields, format_ts, parse_txdate
+
+
+def format_cents(cents: int) -> str:
+    """以两位小数的形式输出分为单位的金额，例如 1250 -> "12.50"。"""
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+
+class SpendRecords:
+    """按列存储的扣费记录。
+
+    每条记录只占三个定长数组中的各一个元素：
+    - timestamps：交易时间，epoch 秒（把服务器给出的本地时间当作 UTC，不做时区换算）；
+    - cents：消费金额，单位为分，正数；
+    - merchant_ids：商户编号，对应 merchants 中的名称，同名商户只保存一份字符串。
+
+    迭代、下标访问时仍然得到 {"txdate", "mername", "amount"} 字典，兼容原来的 list[dict] 用法；
+    需要性能的地方应直接读取各列。
+    """
+
+    __slots__ = ("timestamps", "cents", "merchant_ids", "merchants", "_merchant_index", "_time_fields")
+
+    def __init__(self) -> None:
+        self.timestamps = array("q")
+        self.cents = array("q")
+        self.merchant_ids = array("i")
+        self.merchants: list[str] = []
+        self._merchant_index: dict[str, int] = {}
+        self._time_fields: TimeFields | None = None
+
+    def merchant_id(self, name: str) -> int:
+        mid = self._merchant_index.get(name)
+        if mid is None:
+            mid = len(self.merchants)
+            self.merchants.append(name)
+            self._merchant_index[name] = mid
+        return mid
+
+    def append(self, ts: int, cents: int, mername: str) -> None:
+        self.timestamps.append(ts)
+        self.cents.append(cents)
+        self.merchant_ids.append(self.merchant_id(mername))
+
+    def extend(self, other: Iterable[dict] | "SpendRecords") -> None:
+        """追加另一批记录；other 为 SpendRecords 时按列整体拷贝。"""
+
+        if isinstance(other, SpendRecords):
+            mine = self._cached_time_fields()
+            theirs = other._cached_time_fields()
+            was_empty = not self.timestamps
+
+            remap = [self.merchant_id(name) for name in other.merchants]
+            self.timestamps.extend(other.timestamps)
+            self.cents.extend(other.cents)
+            self.merchant_ids.extend(array("i", (remap[m] for m in other.merchant_ids)))
+
+            # 两边都已算过派生列时直接拼接，合并各区间后不必重新计算
+            if theirs is not None and (mine is not None or was_empty):
+                if mine is None:
+                    mine = self._time_fields = TimeFields(())
+                mine.extend(theirs)
+            return
+        for r in other:
+            self.append(*_dict_to_row(r))
+
+    @classmethod
+    def from_dicts(cls, records: Iterable[dict]) -> "SpendRecords":
+        store = cls()
+        store.extend(records)
+        return store
+
+    def _cached_time_fields(self) -> TimeFields | None:
+        fields = self._time_fields
+        if fields is None or len(fields) != len(self.timestamps):
+            return None
+        return fields
+
+    def time_fields(self) -> TimeFields:
+        """由 timestamps 派生的日期、小时、星期等列；结果会被缓存，记录条数变化后重新计算。"""
+        fields = self._cached_time_fields()
+        if fields is None:
+            fields = self._time_fields = TimeFields(self.timestamps)
+        return fields
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def txdate(self, i: int) -> str:
+        return format_ts(self.timestamps[i])
+
+    def mername(self, i: int) -> str:
+        return self.merchants[self.merchant_ids[i]]
+
+    def amount(self, i: int) -> float:
+        return self.cents[i] / 100
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self)
+        return {"txdate": self.txdate(i), "mername": self.mername(i), "amount": self.amount(i)}
+
+    def __iter__(self) -> Iterator[dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def sorted_indices(self) -> list[int]:
+        """按交易时间排序后的下标（稳定排序，同一时间保持原有顺序）。"""
+        return sorted(range(len(self)), key=self.timestamps.__getitem__)
+
+
+def _dict_to_row(r: dict) -> tuple[int, int, str]:
+    return parse_txdate(str(r["txdate"])), int(round(float(r["amount"]) * 100)), str(r["mername"])
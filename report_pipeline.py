@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass
+class _Stage:
+    func: Callable[..., Any]
+    deps: tuple[str, ...]
+
+
+class ReportPipeline:
+    """由命名阶段组成的小型 DAG，用于生成报告时避免重复计算。
+
+    输入用 set() 提供，阶段用 add() 注册：阶段函数的参数依次为各依赖（输入或其他阶段）的值，
+    依赖必须事先注册，因此不会出现环。get() 按需递归计算依赖，并按依赖值的身份（is）缓存
+    每个阶段的输出：只要依赖没有换成别的对象，再次 get() 直接返回上次的结果。
+
+    timings 记录每个阶段最近一次实际执行的耗时（秒），不含其依赖的耗时。
+    """
+
+    def __init__(self) -> None:
+        self._inputs: dict[str, Any] = {}
+        self._stages: dict[str, _Stage] = {}
+        self._memo: dict[str, tuple[tuple, Any]] = {}
+        self.timings: dict[str, float] = {}
+
+    def set(self, name: str, value: Any) -> None:
+        if name in self._stages:
+            raise ValueError(f"{name!r} is a stage, not an input")
+        self._inputs[name] = value
+
+    def add(self, name: str, func: Callable[..., Any], *deps: str) -> None:
+        if name in self._stages or name in self._inputs:
+            raise ValueError(f"duplicate pipeline node {name!r}")
+        for dep in deps:
+            if dep not in self._stages and dep not in self._inputs:
+                raise ValueError(f"unknown dependency {dep!r} of stage {name!r}")
+        self._stages[name] = _Stage(func, deps)
+
+    def get(self, name: str) -> Any:
+        if name in self._inputs:
+            return self._inputs[name]
+
+        stage = self._stages[name]
+        args = tuple(self.get(dep) for dep in stage.deps)
+        memo = self._memo.get(name)
+        if memo is not None and all(a is b for a, b in zip(memo[0], args)):
+            return memo[1]
+
+        start = time.perf_counter()
+        value = stage.func(*args)
+        self.timings[name] = time.perf_counter() - start
+        self._memo[name] = (args, value)
+        return value
+
+    def format_timings(self) -> str:
+        """按执行顺序列出各阶段耗时，便于在调试模式下查看时间花在哪里。"""
+        return "\n".join(f"  {name}: {seconds * 1000:.1f} ms" for name, seconds in self.timings.items())
@@ -0,0 +1,272 @@
+"""网页报告模板的切分、预编译与缓存。
+
+SlotTemplate 把模板文本一次切分为字面片段和命名占位符交替的序列，填入的内容原样输出、不会再被查找
+占位符，因此 CSS、JS 或数据中碰巧出现的占位符文字不会被误替换；输出时各片段直接写入文件，
+不必反复复制整个页面。cloudflare_worker/build_worker.py 也用它填充 worker 模板。
+
+本地报告由 templates 目录下的 index.html、styles.css、scripts.js 和两张图片拼成，其中只有
+__EAT_DATA__ 和 __ACH_STATE__ 两处随数据变化，其余部分对同一份模板文件总是相同的。
+compile_report_template 预先填好不变的部分（内联 CSS/JS、图片转成 data URL、本地报告固定的占位符），
+只留下这两个占位符；load_report_template 以模板文件内容的哈希为键，把编译结果缓存在内存和 cache_dir 中，
+模板文件改过以后哈希随之改变，自动重新编译。
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Mapping, TextIO
+
+from atomic_file import atomic_write
+
+TEMPLATE_VERSION = 2
+
+# index.html 中的占位符：名称 -> 模板中的写法
+REPORT_MARKERS = {
+    "__INLINE_STYLE__": "/*__INLINE_STYLE__*/",
+    "__INLINE_SCRIPT__": "//__INLINE_SCRIPT__",
+    "__EAT_DATA__": "__EAT_DATA__",
+    "__ACH_STATE__": "__ACH_STATE__",
+    "__BARCODE_ID__": "__BARCODE_ID__",
+    "__PROFILE__": "__PROFILE__",
+}
+
+# 随数据变化的占位符
+DATA_SLOTS = ("__EAT_DATA__", "__ACH_STATE__")
+
+# 本地报告中固定的占位符
+LOCAL_VALUES = {
+    "__BARCODE_ID__": "null",  # 本地报告默认不显示条形码
+    "__PROFILE__": "{}",  # 本地报告无保存的个人资料
+}
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+_TEXT_FILES = ("index.html", "styles.css", "scripts.js")
+_IMAGE_FILES = (
+    # (文件, scripts.js 中原来的写法, 替换成 data URL 的写法)
+    ("images/eatbit.jpg", 'const IMG_AVATAR_DEFAULT = "images/eatbit.jpg";', 'const IMG_AVATAR_DEFAULT = "{}";'),
+    ("images/ach.jpg", 'const IMG_ACH_SPRITE = "images/ach.jpg";', 'const IMG_ACH_SPRITE = "{}";'),
+)
+
+
+@dataclass
+class SlotTemplate:
+    """切分好的模板：segments 比 slots 多一个，输出为 segments[0] + 值 + segments[1] + ……"""
+
+    segments: list[str]
+    slots: list[str]
+
+    @classmethod
+    def parse(cls, text: str, markers: Mapping[str, str]) -> SlotTemplate:
+        """在 markers（名称 -> 模板中的写法）出现的位置切开 text，只扫描一遍。
+
+        几种写法在同一位置都能匹配时取最长的一种。
+        """
+
+        by_marker = {marker: name for name, marker in markers.items()}
+        if not by_marker:
+            return cls([text], [])
+        pattern = re.compile("|".join(re.escape(m) for m in sorted(by_marker, key=len, reverse=True)))
+        segments = []
+        slots = []
+        pos = 0
+        for match in pattern.finditer(text):
+            segments.append(text[pos:match.start()])
+            slots.append(by_marker[match.group()])
+            pos = match.end()
+        segments.append(text[pos:])
+        return cls(segments, slots)
+
+    def fill(self, values: Mapping[str, str]) -> SlotTemplate:
+        """填入 values 中给出的占位符，其余保留，返回新的模板。填入的内容作为字面文字，不再切分。"""
+
+        segments = [self.segments[0]]
+        slots = []
+        for name, segment in zip(self.slots, self.segments[1:]):
+            value = values.get(name)
+            if value is None:
+                slots.append(name)
+                segments.append(segment)
+            else:
+                segments[-1] += value + segment
+        return SlotTemplate(segments, slots)
+
+    def write(self, out: TextIO, values: Mapping[str, str]) -> None:
+        """把各片段与 values 中的值依次写入 out；缺少某个占位符的值时抛出 KeyError。"""
+
+        self._check(values)
+        out.write(self.segments[0])
+        for name, segment in zip(self.slots, self.segments[1:]):
+            out.write(values[name])
+            out.write(segment)
+
+    def render(self, values: Mapping[str, str]) -> str:
+        """与 write 相同，但返回拼好的字符串。"""
+
+        self._check(values)
+        parts = [self.segments[0]]
+        for name, segment in zip(self.slots, self.segments[1:]):
+            parts.append(values[name])
+            parts.append(segment)
+        return "".join(parts)
+
+    def _check(self, values: Mapping[str, str]) -> None:
+        missing = set(self.slots) - values.keys()
+        if missing:
+            raise KeyError(f"missing template values: {', '.join(sorted(missing))}")
+
+
+def _read_sources(template_dir: str) -> dict[str, bytes | None]:
+    sources: dict[str, bytes | None] = {}
+    for name in _TEXT_FILES + tuple(image for image, _, _ in _IMAGE_FILES):
+        try:
+            with open(os.path.join(template_dir, name), "rb") as f:
+                sources[name] = f.read()
+        except FileNotFoundError:
+            if name in _TEXT_FILES:
+                raise
+            sources[name] = None
+    return sources
+
+
+def _template_key(sources: Mapping[str, bytes | None]) -> str:
+    h = hashlib.sha256()
+    h.update(repr((TEMPLATE_VERSION, REPORT_MARKERS, DATA_SLOTS, LOCAL_VALUES)).encode("utf-8"))
+    for name, data in sources.items():
+        h.update(name.encode("utf-8"))
+        if data is None:
+            h.update(b"\x00missing")
+        else:
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+    return h.hexdigest()[:32]
+
+
+def _decode_text(data: bytes) -> str:
+    # 与以文本模式 open() 读取相同，统一换行符
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def image_data_url(path: str, data: bytes | None = None) -> str:
+    """图片文件的 base64 data URL；data 为 None 时从 path 读取。"""
+
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    mime = MIME_TYPES.get(os.path.splitext(path)[1].lower(), "image/jpeg")
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _compile(sources: Mapping[str, bytes | None]) -> SlotTemplate:
+    base_tpl = _decode_text(sources["index.html"])
+    style = _decode_text(sources["styles.css"])
+    script = _decode_text(sources["scripts.js"])
+
+    for name, original, embedded in _IMAGE_FILES:
+        data = sources[name]
+        if data is not None:
+            script = script.replace(original, embedded.format(image_data_url(name, data)))
+
+    template = SlotTemplate.parse(base_tpl, REPORT_MARKERS)
+    return template.fill({"__INLINE_STYLE__": style, "__INLINE_SCRIPT__": script, **LOCAL_VALUES})
+
+
+def compile_report_template(template_dir: str = "templates") -> SlotTemplate:
+    """读取 template_dir 下的模板文件，编译出只剩 DATA_SLOTS 的 SlotTemplate，不使用缓存。"""
+
+    return _compile(_read_sources(template_dir))
+
+
+_MEMO: dict[str, SlotTemplate] = {}
+_MEMO_LOCK = threading.Lock()
+
+
+def load_report_template(template_dir: str = "templates", cache_dir: str | None = None) -> SlotTemplate:
+    """返回 template_dir 下模板的编译结果。
+
+    仍然读取模板文件以计算哈希，但只在内存和 cache_dir 中都没有这个哈希的编译结果时才重新编译，
+    编译后写入 cache_dir（为 None 时只缓存在内存中），并删掉其他哈希的旧文件。
+    """
+
+    sources = _read_sources(template_dir)
+    key = _template_key(sources)
+    with _MEMO_LOCK:
+        compiled = _MEMO.get(key)
+    if compiled is not None:
+        return compiled
+
+    path = os.path.join(cache_dir, f"report-{key}.tpl") if cache_dir is not None else None
+    if path is not None:
+        compiled = _read_cached(path, key)
+    if compiled is None:
+        compiled = _compile(sources)
+        if cache_dir is not None:
+            _write_cached(cache_dir, path, key, compiled)
+
+    with _MEMO_LOCK:
+        return _MEMO.setdefault(key, compiled)
+
+
+# 缓存文件的第一行是 JSON 头，记录各个字面片段的结束位置（字符数）和片段之间的占位符，
+# 之后是原样拼接的全部字面片段，读取时按位置切开即可，不需要解析转义后的长字符串。
+def _read_cached(path: str, key: str) -> SlotTemplate | None:
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            header = json.loads(f.readline())
+            body = f.read()
+        ends = header["ends"]
+        slots = header["slots"]
+        if header["version"] != TEMPLATE_VERSION or header["key"] != key:
+            raise ValueError("template cache mismatch")
+        if len(ends) != len(slots) + 1 or not set(slots) <= set(DATA_SLOTS) or ends[-1] != len(body):
+            raise ValueError("malformed template cache")
+        segments = [body[start:end] for start, end in zip([0] + ends[:-1], ends)]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError):
+        # 文件损坏，删掉后重新编译
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return SlotTemplate(segments, slots)
+
+
+def _write_cached(cache_dir: str, path: str, key: str, compiled: SlotTemplate) -> None:
+    ends = []
+    offset = 0
+    for segment in compiled.segments:
+        offset += len(segment)
+        ends.append(offset)
+    header = {"version": TEMPLATE_VERSION, "key": key, "slots": compiled.slots, "ends": ends}
+
+    def write(f: TextIO) -> None:
+        f.write(json.dumps(header))
+        f.write("\n")
+        f.writelines(compiled.segments)
+
+    if not atomic_write(path, write, newline=""):
+        # 写入失败只是下次需要重新编译
+        return
+
+    # 模板改过以后，旧哈希的文件不会再被用到
+    current = os.path.basename(path)
+    for name in os.listdir(cache_dir):
+        if name.startswith("report-") and name.endswith(".tpl") and name != current:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+from atomic_file import atomic_write
+
+# 只缓存生成报告需要的字段，避免把接口返回的其他个人信息写入本地文件
+CACHED_FIELDS = ("txdate", "mername", "txamt")
+
+
+def trim_trade(trade: dict) -> dict:
+    """只保留 CACHED_FIELDS 中的字段。"""
+    return {k: trade.get(k) for k in CACHED_FIELDS}
+
+
+class TradeCache:
+    """按 (openid, 日期区间) 缓存查询接口返回的 resultData。
+
+    每个区间单独存为一个 JSON 文件，文件名是 openid 与区间的 SHA-256 哈希。
+    满足以下任一条件的区间视为未命中，需要重新查询：
+    - 没有缓存文件，或文件损坏；
+    - 区间在抓取时尚未结束（结束日期不早于抓取当月的 1 号），之后可能还有新记录；
+    - 缓存时间超过 ttl_days。
+
+    写入时先写临时文件再 os.replace，多个进程同时运行也不会读到写了一半的文件。
+    """
+
+    def __init__(self, cache_dir: str, ttl_days: float = 30.0) -> None:
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_days * 86400
+
+    def _path(self, openid: str, begin_date: str, end_date: str) -> str:
+        key = hashlib.sha256(f"{openid}:{begin_date}:{end_date}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, openid: str, begin_date: str, end_date: str) -> list[dict] | None:
+        path = self._path(openid, begin_date, end_date)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            fetched_at = float(entry["fetched_at"])
+            trades = entry["trades"]
+            if entry["begin"] != begin_date or entry["end"] != end_date or not isinstance(trades, list):
+                raise ValueError("cache entry mismatch")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            # 文件损坏，删掉后当作未命中
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        if time.time() - fetched_at > self.ttl_seconds:
+            return None
+
+        fetched_month_start = datetime.fromtimestamp(fetched_at).date().replace(day=1)
+        if date.fromisoformat(end_date) >= fetched_month_start:
+            return None
+
+        return trades
+
+    def put(self, openid: str, begin_date: str, end_date: str, trades: list[dict]) -> None:
+        entry = {
+            "begin": begin_date,
+            "end": end_date,
+            "fetched_at": time.time(),
+            "trades": [trim_trade(t) for t in trades],
+        }
+
+        # 缓存写入失败不影响本次查询
+        atomic_write(self._path(openid, begin_date, end_date), lambda f: json.dump(entry, f, ensure_ascii=False))
+
+
+class FetchCheckpoint:
+    """记录本次拉取中已经完成的日期区间，中断后重新运行可以从缺失的区间继续。
+
+    文件为 JSON Lines：第一行记录 openid 与总起止日期的哈希，之后每完成一个区间追加一行。
+    追加写入即使中途被打断，也最多损坏最后一行，读取时会忽略无法解析的行。
+    哈希与本次运行不一致时（换了账号或年份），或断点早于 max_age_hours 小时前创建时，视为没有断点。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        openid: str,
+        begin_date: str,
+        end_date: str,
+        max_age_hours: float = 24.0,
+    ) -> None:
+        self.path = path
+        self.max_age_seconds = max_age_hours * 3600
+        self.key = hashlib.sha256(f"{openid}:{begin_date}:{end_date}".encode("utf-8")).hexdigest()
+        # 上次运行中已完成的区间；本次新完成的区间只写入文件，不在内存中重复保存
+        self.completed: dict[tuple[str, str], list[dict]] = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._append = bool(self.completed)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return
+
+        try:
+            header = json.loads(lines[0]) if lines else None
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("key") != self.key:
+            return
+        try:
+            if time.time() - float(header["created"]) > self.max_age_seconds:
+                return
+        except (KeyError, TypeError, ValueError):
+            return
+
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+                rng = (entry["begin"], entry["end"])
+                trades = entry["trades"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            if isinstance(trades, list):
+                self.completed[rng] = trades
+
+    def get(self, begin_date: str, end_date: str) -> list[dict] | None:
+        return self.completed.get((begin_date, end_date))
+
+    def record(self, begin_date: str, end_date: str, trades: list[dict]) -> None:
+        """追加一个已完成的区间，可在多个线程中调用。"""
+
+        kept = [trim_trade(t) for t in trades]
+        line = json.dumps({"begin": begin_date, "end": end_date, "trades": kept}, ensure_ascii=False)
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a" if self._append else "w", encoding="utf-8") as f:
+                    if not self._append:
+                        f.write(json.dumps({"key": self.key, "created": time.time()}) + "\n")
+                    f.write(line + "\n")
+                self._append = True
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """全部区间拉取完成后删除断点文件。"""
+
+        with self._lock:
+            self.completed.clear()
+            self._append = False
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,506 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Iterator
+
+import requests
+
+import dkykt_api
+import dkykt_api_async
+from dkykt_api import StreamInterruptedError, _retry_delay, query_trades, query_trades_stream
+from trade_cache import FetchCheckpoint, TradeCache, trim_trade
+
+
+class TokenBucket:
+    """简单的令牌桶限流器，线程安全。
+
+    rate 为每秒补充的令牌数，burst 为桶容量（允许的瞬时并发请求数）。
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """尝试取走一个令牌：取到时返回 0，否则返回还需等待的秒数。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        """取走一个令牌，令牌不足时阻塞等待。"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """acquire 的 asyncio 版本，等待时不阻塞事件循环。"""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class FetchStats:
+    """一次拉取的请求统计。"""
+
+    requests: int = 0
+    cache_hits: int = 0
+    # 从断点文件中直接恢复的区间数
+    resumed: int = 0
+    # 因疑似被截断而二分的区间数，以及二分后确认确实被截断的区间数
+    bisected: int = 0
+    confirmed_truncated: int = 0
+    # 已经拆到 1 天仍然达到上限、可能仍不完整的区间
+    unresolved: list[tuple[str, str]] | None = None
+    detected_cap: int | None = None
+    # 最终采用的区间（按日期排列），返回的记录按此顺序拼接
+    leaves: list[tuple[str, str]] | None = None
+
+
+def split_date_range(begin_date: str, end_date: str, max_days: int = 31) -> list[tuple[str, str]]:
+    """将总的起止日期拆分为若干不超过 max_days 天的小段，因为查询接口似乎有日期范围限制。
+
+    例如 [2025-01-01, 2025-03-15] 会被拆成：
+    - 2025-01-01 ~ 2025-01-31
+    - 2025-02-01 ~ 2025-03-03
+    - 2025-03-04 ~ 2025-03-15
+    """
+
+    start = datetime.strptime(begin_date, "%Y-%m-%d").date()
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+    if start > end:
+        raise ValueError("开始日期不能晚于结束日期")
+
+    ranges: list[tuple[str, str]] = []
+    cur = start
+    while cur <= end:
+        chunk_end = min(cur + timedelta(days=max_days - 1), end)
+        ranges.append((cur.isoformat(), chunk_end.isoformat()))
+        cur = chunk_end + timedelta(days=1)
+
+    return ranges
+
+
+def _bisect_range(begin_date: str, end_date: str) -> tuple[tuple[str, str], tuple[str, str]] | None:
+    """把区间从中间拆成两半；只有一天的区间无法再拆，返回 None。"""
+
+    start = date.fromisoformat(begin_date)
+    end = date.fromisoformat(end_date)
+    if start >= end:
+        return None
+    mid = start + timedelta(days=(end - start).days // 2)
+    return (begin_date, mid.isoformat()), ((mid + timedelta(days=1)).isoformat(), end_date)
+
+
+def fetch_slices(
+    session: requests.Session,
+    openid: str,
+    ranges: list[tuple[str, str]],
+    dingtalk_ua: str,
+    max_workers: int = 6,
+    limiter: TokenBucket | None = None,
+    on_request: Callable[[str, str], None] | None = None,
+    cache: TradeCache | None = None,
+    checkpoint: FetchCheckpoint | None = None,
+    transform: Callable[[Iterable[dict]], list] | None = None,
+    on_slice: Callable[[tuple[str, str], list], None] | None = None,
+    on_result: Callable[[tuple[str, str], list, int], None] | None = None,
+    stats: FetchStats | None = None,
+) -> list[tuple[list, int]]:
+    """用有界线程池并发查询各个日期区间，按 ranges 的顺序返回 (记录列表, 原始记录条数)。
+
+    所有线程共用同一个 session；limiter 控制请求速率，取代原来固定的 sleep。
+    任一区间出错时取消尚未开始的请求，并按日期顺序抛出最早出错区间的 DkyktError。
+    传入 cache 时，命中缓存的区间不发请求，也不占用限流令牌。
+    传入 checkpoint 时，断点中已完成的区间直接复用，新完成的区间会立即写入断点文件。
+
+    传入 transform（如 to_spend_records）时改用流式查询：响应边下载边解析，原始记录逐条
+    交给 transform，返回的记录列表是 transform 的结果，原始记录不会整体保存在内存中
+    （需要写缓存或断点时，只额外保留当前区间裁剪后的字段）。
+
+    on_slice((begin, end), items) 在每个区间完成后立即从工作线程中调用，顺序不定，
+    可用于边下载边处理；on_result((begin, end), items, 原始记录条数) 与之相同，只是多给出条数。
+    """
+
+    if not ranges:
+        return []
+
+    def fetch_stream(sub_begin: str, sub_end: str) -> tuple[list, int]:
+        attempt = 0
+        while True:
+            count = 0
+            kept: list[dict] | None = [] if cache is not None or checkpoint is not None else None
+
+            def tee(trades: Iterator[dict]) -> Iterator[dict]:
+                nonlocal count
+                for t in trades:
+                    count += 1
+                    if kept is not None:
+                        kept.append(trim_trade(t))
+                    yield t
+
+            try:
+                items = transform(tee(query_trades_stream(session, openid, sub_begin, sub_end, dingtalk_ua)))
+                break
+            except StreamInterruptedError:
+                # transform 处理完整个区间才交出结果，中途断开时丢弃已解析的部分，整段重新查询
+                if attempt >= dkykt_api.RETRIES:
+                    raise
+                time.sleep(_retry_delay(attempt, dkykt_api.BACKOFF))
+                attempt += 1
+                if limiter is not None:
+                    limiter.acquire()
+
+        if kept is not None:
+            if cache is not None:
+                cache.put(openid, sub_begin, sub_end, kept)
+            if checkpoint is not None:
+                checkpoint.record(sub_begin, sub_end, kept)
+        return items, count
+
+    def load_one(sub_begin: str, sub_end: str) -> tuple[list, int, str]:
+        stored = checkpoint.get(sub_begin, sub_end) if checkpoint is not None else None
+        source = "resumed"
+        if stored is None and cache is not None:
+            stored = cache.get(openid, sub_begin, sub_end)
+            source = "cache_hits"
+        if stored is not None:
+            return (transform(stored) if transform is not None else stored), len(stored), source
+
+        if limiter is not None:
+            limiter.acquire()
+        if on_request is not None:
+            on_request(sub_begin, sub_end)
+        if transform is not None:
+            items, count = fetch_stream(sub_begin, sub_end)
+            return items, count, "requests"
+
+        trades = query_trades(session, openid, sub_begin, sub_end, dingtalk_ua)
+        if cache is not None:
+            cache.put(openid, sub_begin, sub_end, trades)
+        if checkpoint is not None:
+            checkpoint.record(sub_begin, sub_end, trades)
+        return trades, len(trades), "requests"
+
+    def fetch_one(sub_begin: str, sub_end: str) -> tuple[list, int, str]:
+        items, count, source = load_one(sub_begin, sub_end)
+        if on_slice is not None:
+            on_slice((sub_begin, sub_end), items)
+        if on_result is not None:
+            on_result((sub_begin, sub_end), items, count)
+        return items, count, source
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges))))
+    try:
+        futures = [executor.submit(fetch_one, b, e) for b, e in ranges]
+        results: list[tuple[list, int]] = []
+        for fut in futures:
+            items, count, source = fut.result()
+            results.append((items, count))
+            if stats is not None:
+                setattr(stats, source, getattr(stats, source) + 1)
+    finally:
+        # 出错时不再发起剩余请求
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return results
+
+
+def fetch_trades(
+    session: requests.Session,
+    openid: str,
+    ranges: list[tuple[str, str]],
+    dingtalk_ua: str,
+    **kwargs,
+) -> list:
+    """并发查询各个日期区间，按区间顺序拼接返回记录。参数同 fetch_slices。"""
+
+    # transform 返回的容器（如 SpendRecords）也支持 extend，用 transform([]) 得到同类型的空容器
+    transform = kwargs.get("transform")
+    all_items = transform([]) if transform is not None else []
+    for items, _count in fetch_slices(session, openid, ranges, dingtalk_ua, **kwargs):
+        all_items.extend(items)
+    return all_items
+
+
+def _detect_cap(counts: list[int]) -> int | None:
+    """根据各区间的返回条数推断查询接口单次返回条数的上限。
+
+    如果最大的非零条数在多个区间里重复出现，就怀疑它是接口的截断上限。
+    """
+
+    nonzero = [c for c in counts if c > 0]
+    if not nonzero:
+        return None
+    top = max(nonzero)
+    return top if Counter(nonzero)[top] >= 2 else None
+
+
+class _AdaptiveSplit:
+    """fetch_trades_adaptive 的拆分过程，与如何发请求无关，同步和异步拉取共用。
+
+    pending 为下一轮需要查询的区间；把这些区间的 (记录列表, 原始条数) 交给 add_round，
+    它会记下结果并算出新的 pending，pending 为空时 leaves 即为最终采用的区间。
+
+    给出 on_slice 时不保留记录，而是把 offer 作为 fetch_slices 的 on_result：确定不会再被二分的
+    区间立即交给 on_slice，其余暂存到本轮结束，只有最终采用的区间会交出去。
+    """
+
+    def __init__(
+        self,
+        begin_date: str,
+        end_date: str,
+        max_days: int,
+        truncation_threshold: int | None,
+        on_slice: Callable[[tuple[str, str], list], None] | None = None,
+    ) -> None:
+        self.stats = FetchStats(unresolved=[])
+        self.leaves = split_date_range(begin_date, end_date, max_days)
+        self.pending = list(self.leaves)
+        self.results: dict[tuple[str, str], list] = {}
+        self._counts: dict[tuple[str, str], int] = {}
+        self._parents: dict[tuple[str, str], tuple[str, str]] = {}
+        self._threshold = truncation_threshold
+        self._cap = truncation_threshold
+        self._rounds = 0
+        self._on_slice = on_slice
+        self._held: dict[tuple[str, str], tuple[list, int]] = {}
+        self._round_top = 0
+        self._lock = threading.Lock()
+
+    def offer(self, r: tuple[str, str], items: list, count: int) -> None:
+        ready: list[tuple[tuple[str, str], list]] = []
+        with self._lock:
+            if self._threshold is not None or self._rounds > 0:
+                # 上限已知（首轮之后 _cap 不会变大），低于上限的区间不会再被二分
+                final = count < self._cap
+            else:
+                # 首轮推断出的上限只可能是本轮最大的条数，比已见过的最大值少的区间不会被二分
+                final = count < self._round_top
+                if count > self._round_top:
+                    self._round_top = count
+                    ready = [(k, v) for k, (v, c) in self._held.items() if c < count]
+                    for k, _ in ready:
+                        del self._held[k]
+            if final:
+                ready.append((r, items))
+            else:
+                self._held[r] = (items, count)
+        for k, v in ready:
+            self._on_slice(k, v)
+
+    def add_round(self, fetched: list[tuple[list, int]]) -> None:
+        stats = self.stats
+        counts = self._counts
+        for r, (items, count) in zip(self.pending, fetched):
+            if self._on_slice is None:
+                self.results[r] = items
+            counts[r] = count
+
+        # 子区间合计多于父区间，说明父区间确实被截断
+        for parent in {self._parents[r] for r in self.pending if r in self._parents}:
+            left, right = _bisect_range(*parent)
+            if counts[left] + counts[right] > counts[parent]:
+                stats.confirmed_truncated += 1
+
+        if self._threshold is None:
+            if self._rounds == 0:
+                self._cap = _detect_cap([counts[r] for r in self.leaves])
+            elif self._rounds == 1 and stats.confirmed_truncated == 0:
+                self._cap = None
+        self._rounds += 1
+        cap = stats.detected_cap = self._cap
+
+        self.pending = []
+        if cap is None:
+            stats.leaves = self.leaves
+            self._release()
+            return
+
+        new_leaves: list[tuple[str, str]] = []
+        for r in self.leaves:
+            halves = _bisect_range(*r) if counts[r] >= cap else None
+            if halves is None:
+                if counts[r] >= cap and r not in stats.unresolved:
+                    stats.unresolved.append(r)
+                new_leaves.append(r)
+                continue
+            stats.bisected += 1
+            for half in halves:
+                self._parents[half] = r
+                new_leaves.append(half)
+                self.pending.append(half)
+        self.leaves = stats.leaves = new_leaves
+        self._release()
+
+    def _release(self) -> None:
+        """本轮结束后交出暂存区间中最终采用的部分，被二分的区间直接丢弃。"""
+        if self._on_slice is None:
+            return
+        held, self._held = self._held, {}
+        for r in self.leaves:
+            if r in held:
+                self._on_slice(r, held[r][0])
+
+    def items(self, transform: Callable[[Iterable[dict]], list] | None = None) -> list:
+        all_items = transform([]) if transform is not None else []
+        for r in self.leaves:
+            all_items.extend(self.results[r])
+        return all_items
+
+
+def fetch_trades_adaptive(
+    session: requests.Session,
+    openid: str,
+    begin_date: str,
+    end_date: str,
+    dingtalk_ua: str,
+    max_days: int = 31,
+    truncation_threshold: int | None = None,
+    on_slice: Callable[[tuple[str, str], list], None] | None = None,
+    **kwargs,
+) -> tuple[list, FetchStats] | FetchStats:
+    """自适应地拆分日期区间并拉取全部交易记录，返回 (按日期排列的记录, 请求统计)。
+
+    先按 max_days 切出尽量大的区间并发查询；返回条数达到 truncation_threshold 的区间
+    疑似被截断，会被二分后重新查询，直到不再触顶或只剩一天为止。没有截断时请求数与
+    固定切分相同，稀疏时段不会产生额外请求。
+
+    未给出 truncation_threshold 时从第一轮结果中推断上限（见 _detect_cap）；如果第一轮
+    二分后没有任何区间被证实截断，说明只是巧合，不再继续拆分。其余参数同 fetch_slices。
+
+    传入 on_slice 时记录不再合并，只返回请求统计：on_slice 只会收到最终采用的区间
+    （即 FetchStats.leaves），被二分的区间不会交出；确定不会再被二分的区间仍在工作线程中
+    立即交出，其余区间在本轮结束后从调用线程交出。
+    """
+
+    split = _AdaptiveSplit(begin_date, end_date, max_days, truncation_threshold, on_slice)
+    on_result = split.offer if on_slice is not None else None
+    while split.pending:
+        split.add_round(
+            fetch_slices(
+                session, openid, split.pending, dingtalk_ua, on_result=on_result, stats=split.stats, **kwargs
+            )
+        )
+    if on_slice is not None:
+        return split.stats
+    return split.items(kwargs.get("transform")), split.stats
+
+
+async def fetch_slices_async(
+    session: dkykt_api_async.AsyncSession,
+    openid: str,
+    ranges: list[tuple[str, str]],
+    dingtalk_ua: str,
+    max_workers: int = 6,
+    limiter: TokenBucket | None = None,
+    on_request: Callable[[str, str], None] | None = None,
+    cache: TradeCache | None = None,
+    checkpoint: FetchCheckpoint | None = None,
+    on_slice: Callable[[tuple[str, str], list], None] | None = None,
+    on_result: Callable[[tuple[str, str], list, int], None] | None = None,
+    stats: FetchStats | None = None,
+) -> list[tuple[list, int]]:
+    """fetch_slices 的 asyncio 版本，按 ranges 的顺序返回 (原始记录列表, 条数)。
+
+    max_workers 为同时进行的请求数；limiter、cache、checkpoint、on_slice、on_result、stats 的用法与 fetch_slices 相同
+    （限流用 TokenBucket.acquire_async 等待；缓存文件很小，直接在事件循环中读写）。
+    任一区间出错时取消其余请求并抛出该 DkyktError。
+    """
+
+    if not ranges:
+        return []
+    sem = asyncio.Semaphore(max(1, max_workers))
+
+    async def fetch_one(sub_begin: str, sub_end: str) -> tuple[list, str]:
+        stored = checkpoint.get(sub_begin, sub_end) if checkpoint is not None else None
+        source = "resumed"
+        if stored is None and cache is not None:
+            stored = cache.get(openid, sub_begin, sub_end)
+            source = "cache_hits"
+        if stored is not None:
+            trades = stored
+        else:
+            async with sem:
+                if limiter is not None:
+                    await limiter.acquire_async()
+                if on_request is not None:
+                    on_request(sub_begin, sub_end)
+                trades = await dkykt_api_async.query_trades(session, openid, sub_begin, sub_end, dingtalk_ua)
+            source = "requests"
+            if cache is not None:
+                cache.put(openid, sub_begin, sub_end, trades)
+            if checkpoint is not None:
+                checkpoint.record(sub_begin, sub_end, trades)
+        if on_slice is not None:
+            on_slice((sub_begin, sub_end), trades)
+        if on_result is not None:
+            on_result((sub_begin, sub_end), trades, len(trades))
+        return trades, source
+
+    tasks = [asyncio.create_task(fetch_one(b, e)) for b, e in ranges]
+    try:
+        done = await asyncio.gather(*tasks)
+    finally:
+        # 出错时不再发起剩余请求
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    results: list[tuple[list, int]] = []
+    for trades, source in done:
+        results.append((trades, len(trades)))
+        if stats is not None:
+            setattr(stats, source, getattr(stats, source) + 1)
+    return results
+
+
+async def fetch_trades_adaptive_async(
+    session: dkykt_api_async.AsyncSession,
+    openid: str,
+    begin_date: str,
+    end_date: str,
+    dingtalk_ua: str,
+    max_days: int = 31,
+    truncation_threshold: int | None = None,
+    on_slice: Callable[[tuple[str, str], list], None] | None = None,
+    **kwargs,
+) -> tuple[list, FetchStats] | FetchStats:
+    """fetch_trades_adaptive 的 asyncio 版本，拆分和截断检测的规则相同，传入 on_slice 时同样只返回请求统计。
+
+    其余参数（max_workers、limiter 等）原样传给每一轮的 fetch_slices_async，各轮共用同一个限流器。
+    """
+
+    split = _AdaptiveSplit(begin_date, end_date, max_days, truncation_threshold, on_slice)
+    on_result = split.offer if on_slice is not None else None
+    while split.pending:
+        split.add_round(
+            await fetch_slices_async(
+                session, openid, split.pending, dingtalk_ua, on_result=on_result, stats=split.stats, **kwargs
+            )
+        )
+    if on_slice is not None:
+        return split.stats
+    return split.items(), split.stats
@@ -0,0 +1,161 @@
+"""交易时间的解析与格式化。
+
+记录内部统一用 epoch 秒表示交易时间：把服务器给出的本地时间当作 UTC，不做任何时区换算，
+因此 ts // 86400 就是当天的天号，ts % 86400 就是当天的第几秒。
+"""
+
+from __future__ import annotations
+
+import calendar
+from array import array
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Sequence
+
+_EPOCH = datetime(1970, 1, 1)
+# 1970-01-01 的公历序数，epoch 天号加上它就是 date.toordinal() 的值
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def parse_datetime(raw: str) -> datetime:
+    """将 txdate 字符串解析为 datetime，接受 ISO 格式及少数常见格式。"""
+
+    raw = raw.strip()
+    if not raw:
+        raise ValueError("Empty datetime string")
+
+    try:
+        return datetime.fromisoformat(raw)
+    except ValueError:
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(raw, fmt)
+            except ValueError:
+                continue
+    raise ValueError(f"Unrecognized datetime format: {raw!r}")
+
+
+def _days_from_civil(year: int, month: int, day: int) -> int:
+    """公历日期到 epoch 天号，纯整数运算。"""
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+# "HH:MM" -> 当天的秒数，":SS" -> 秒；只包含合法取值，查不到即说明格式不对
+_CLOCK_MINUTES = {f"{h:02d}:{m:02d}": (h * 60 + m) * 60 for h in range(24) for m in range(60)}
+_CLOCK_SECONDS = {f":{sec:02d}": sec for sec in range(60)}
+# 已验证过的 "YYYY-MM-DD" -> epoch 天号，一份记录通常只涉及几百个不同的日期
+_DAY_CACHE: dict[str, int] = {}
+_DAY_CACHE_LIMIT = 100_000
+
+
+def _parse_day(text: str) -> int | None:
+    """把严格的 YYYY-MM-DD 转换为 epoch 天号，格式或日期不合法时返回 None。"""
+
+    if len(text) != 10 or text[4] != "-" or text[7] != "-":
+        return None
+    digits = text[0:4] + text[5:7] + text[8:10]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+    if year < 1 or not 1 <= month <= 12:
+        return None
+    if not 1 <= day <= (29 if month == 2 and calendar.isleap(year) else _DAYS_IN_MONTH[month]):
+        return None
+
+    if len(_DAY_CACHE) >= _DAY_CACHE_LIMIT:
+        _DAY_CACHE.clear()
+    result = _DAY_CACHE[text] = _days_from_civil(year, month, day)
+    return result
+
+
+def parse_txdate(raw: str) -> int:
+    """将 txdate 字符串解析为 epoch 秒。
+
+    服务器返回的 "YYYY-MM-DD HH:MM:SS" 切成日期、时分、秒三段查表转换；其他格式或数值不合法时
+    退回 parse_datetime，结果与其完全一致，无法解析时抛出 ValueError。
+    """
+
+    if len(raw) == 19 and raw[10] == " ":
+        minutes = _CLOCK_MINUTES.get(raw[11:16])
+        seconds = _CLOCK_SECONDS.get(raw[16:])
+        if minutes is not None and seconds is not None:
+            day = _DAY_CACHE.get(raw[:10])
+            if day is None:
+                day = _parse_day(raw[:10])
+            if day is not None:
+                return day * 86400 + minutes + seconds
+    return to_ts(parse_datetime(raw))
+
+
+def to_ts(dt: datetime) -> int:
+    """把 naive datetime 当作 UTC 转换为 epoch 秒，与 format_ts / to_datetime 互逆。"""
+    return calendar.timegm(dt.timetuple())
+
+
+def to_datetime(ts: int) -> datetime:
+    """epoch 秒转换回 naive datetime。"""
+    return _EPOCH + timedelta(seconds=ts)
+
+
+@lru_cache(maxsize=16384)
+def format_day(day: int) -> str:
+    """将 epoch 天号（ts // 86400）转换为 YYYY-MM-DD。同一天总是返回同一个字符串对象。"""
+    return date.fromordinal(day + _EPOCH_ORDINAL).isoformat()
+
+
+# 一天内每分钟的 "HH:MM" 与每秒的 ":SS"，查表拼接比逐条格式化快得多
+_MINUTE_STRS = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)]
+_SECOND_STRS = [f":{sec:02d}" for sec in range(60)]
+
+
+def format_time(ts: int) -> str:
+    """只取 epoch 秒中的时刻部分，格式为 HH:MM:SS。"""
+    seconds = ts % 86400
+    return _MINUTE_STRS[seconds // 60] + _SECOND_STRS[seconds % 60]
+
+
+def format_ts(ts: int) -> str:
+    """将 epoch 秒转换回 txdate 格式的字符串（YYYY-MM-DD HH:MM:SS）。"""
+    return f"{format_day(ts // 86400)} {format_time(ts)}"
+
+
+def format_minute(ts: int | None) -> str | None:
+    """格式化为 YYYY-MM-DD HH:MM，用于成就的解锁时间。"""
+    if ts is None:
+        return None
+    return f"{format_day(ts // 86400)} {_MINUTE_STRS[ts % 86400 // 60]}"
+
+
+class TimeFields:
+    """由一列 epoch 秒派生出的各列，按记录下标对齐，计算一次后供各处共用。
+
+    - days：epoch 天号；
+    - dates：YYYY-MM-DD，同一天共用同一个字符串对象；
+    - hours：0-23；
+    - weekdays：0 为周一，与 date.weekday() 相同。
+    """
+
+    __slots__ = ("days", "dates", "hours", "weekdays")
+
+    def __init__(self, timestamps: Sequence[int]) -> None:
+        self.days = array("q", [ts // 86400 for ts in timestamps])
+        self.dates = [format_day(day) for day in self.days]
+        self.hours = array("b", [ts % 86400 // 3600 for ts in timestamps])
+        # 1970-01-01 是周四
+        self.weekdays = array("b", [(day + 3) % 7 for day in self.days])
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def extend(self, other: TimeFields) -> None:
+        self.days.extend(other.days)
+        self.dates.extend(other.dates)
+        self.hours.extend(other.hours)
+        self.weekdays.extend(other.weekdays)